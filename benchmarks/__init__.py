@@ -0,0 +1,21 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks for the CDC Aggregator Client.
+
+Run the suite with::
+
+    python -m benchmarks.run --size 10000
+
+See :mod:`benchmarks.run` for details. The suite is not part of the
+installed package.
+"""
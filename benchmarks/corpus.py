@@ -0,0 +1,223 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Synthetic corpus of OAI-PMH wrapped DDI records.
+
+Each file contains a single record in an OAI-PMH GetRecord envelope,
+like the files harvested to ``/xml_sources``. Record content is
+derived from the seed, the record index and a revision number, so the
+same corpus can be generated again and a chosen fraction of it
+changed between runs.
+"""
+import os
+import random
+import argparse
+from xml.sax.saxutils import escape
+
+
+#: Supported DDI formats.
+FORMATS = ('ddi122', 'ddi25', 'ddi31', 'ddi32', 'ddi33')
+
+_WORDS = ('survey', 'election', 'health', 'income', 'education', 'labour', 'youth', 'attitudes',
+          'household', 'panel', 'municipal', 'regional', 'national', 'values', 'media', 'climate',
+          'migration', 'housing', 'wellbeing', 'culture', 'religion', 'family', 'work', 'leisure')
+
+_OAI_ENVELOPE = """<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
+xsi:schemaLocation="http://www.openarchives.org/OAI/2.0/ http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd">
+  <responseDate>2026-01-01T00:00:00Z</responseDate>
+  <request metadataPrefix="{prefix}" identifier="{identifier}" verb="GetRecord">{base_url}</request>
+  <GetRecord>
+    <record>
+      <header>
+        <identifier>{identifier}</identifier>
+        <datestamp>{datestamp}</datestamp>
+      </header>
+      <metadata>
+{metadata}
+      </metadata>
+    </record>
+  </GetRecord>
+</OAI-PMH>
+"""
+
+_CODEBOOK = """        <codeBook version="{version}" xmlns="{namespace}">
+          <stdyDscr{stdy_dscr_attrs}>
+            <citation>
+              <titlStmt>
+                <titl xml:lang="en">{title}</titl>
+                <IDNo>{study_number}</IDNo>
+              </titlStmt>
+            </citation>
+            <stdyInfo>
+              <subject>
+{keywords}
+              </subject>
+              <abstract xml:lang="en">{abstract}</abstract>
+            </stdyInfo>
+          </stdyDscr>
+        </codeBook>"""
+
+_DDI_INSTANCE = """        <ddi:DDIInstance xmlns:ddi="ddi:instance:{version}" xmlns:s="ddi:studyunit:{version}" \
+xmlns:r="ddi:reusable:{version}">
+          <r:URN>urn:ddi:benchmark:ddi_metadata:{study_number}</r:URN>
+          <s:StudyUnit xml:lang="en">
+            <r:URN>urn:ddi:benchmark:study:{study_number}</r:URN>
+            <r:UserID typeOfUserID="StudyNumber">{study_number}</r:UserID>
+            <r:Citation>
+              <r:Title>
+                <r:String xml:lang="en">{title}</r:String>
+              </r:Title>
+            </r:Citation>
+            <r:Abstract>
+              <r:Content xml:lang="en">{abstract}</r:Content>
+            </r:Abstract>
+          </s:StudyUnit>
+        </ddi:DDIInstance>"""
+
+# Nesstar DDI 1.2.2 exports leave elements below codeBook unqualified.
+_FORMAT_PARAMS = {
+    'ddi122': ('ddi_c', _CODEBOOK,
+               {'version': '1.2.2', 'namespace': 'http://www.icpsr.umich.edu/DDI', 'stdy_dscr_attrs': ' xmlns=""'}),
+    'ddi25': ('oai_ddi25', _CODEBOOK,
+              {'version': '2.5', 'namespace': 'ddi:codebook:2_5', 'stdy_dscr_attrs': ''}),
+    'ddi31': ('ddi_31', _DDI_INSTANCE, {'version': '3_1'}),
+    'ddi32': ('ddi_32', _DDI_INSTANCE, {'version': '3_2'}),
+    'ddi33': ('ddi_33', _DDI_INSTANCE, {'version': '3_3'}),
+}
+
+
+class Corpus:
+    """Synthetic corpus on disk.
+
+    Records are split evenly between `formats` and written to
+    ``<path>/<format>/<nnnn>/record_<index>.xml``, at most
+    `files_per_dir` files per folder.
+
+    :param str path: Root folder of the corpus.
+    :param int size: Number of records.
+    :param tuple formats: DDI formats to generate. See :data:`FORMATS`.
+    :param int seed: Seed for generated content.
+    :param int files_per_dir: Maximum number of files per folder.
+    :param int abstract_words: Number of words in each abstract.
+    :param str base_url: OAI-PMH base URL used in provenance.
+    """
+
+    def __init__(self, path, size, formats=FORMATS, seed=0, files_per_dir=1000,
+                 abstract_words=200, base_url='http://benchmark.example/oai'):
+        unknown = set(formats) - set(FORMATS)
+        if unknown:
+            raise ValueError('Unknown formats: %s' % (', '.join(sorted(unknown)),))
+        self.path = path
+        self.size = size
+        self.formats = tuple(formats)
+        self.seed = seed
+        self.files_per_dir = files_per_dir
+        self.abstract_words = abstract_words
+        self.base_url = base_url
+        self._revisions = {}
+
+    def record_format(self, index):
+        """Get DDI format of a record.
+
+        :param int index: Record index.
+        :rtype: str
+        """
+        return self.formats[index % len(self.formats)]
+
+    def record_path(self, index):
+        """Get path to the file of a record.
+
+        :param int index: Record index.
+        :rtype: str
+        """
+        return os.path.join(self.path, self.record_format(index),
+                            '%04d' % (index // self.files_per_dir,), 'record_%s.xml' % (index,))
+
+    def render(self, index, revision=0):
+        """Render the file content of a record.
+
+        :param int index: Record index.
+        :param int revision: Content revision.
+        :returns: XML document.
+        :rtype: str
+        """
+        rand = random.Random('%s:%s:%s' % (self.seed, index, revision))
+        prefix, template, params = _FORMAT_PARAMS[self.record_format(index)]
+        study_number = 'bench_%s' % (index,)
+        keywords = rand.sample(_WORDS, 3)
+        metadata = template.format(
+            study_number=study_number,
+            title=escape('%s %s study %s' % (keywords[0].title(), keywords[1], index)),
+            abstract=escape(' '.join(rand.choice(_WORDS) for _ in range(self.abstract_words))),
+            keywords='\n'.join('                <keyword>%s</keyword>' % (keyword,) for keyword in keywords),
+            **params)
+        return _OAI_ENVELOPE.format(prefix=prefix, identifier='oai:benchmark.example:%s' % (study_number,),
+                                    base_url=self.base_url,
+                                    datestamp='2026-01-%02dT00:00:00Z' % (1 + revision % 28,),
+                                    metadata=metadata)
+
+    def write(self, index, revision=0):
+        """Write the file of a record.
+
+        :param int index: Record index.
+        :param int revision: Content revision.
+        :returns: Path to the file.
+        :rtype: str
+        """
+        path = self.record_path(index)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf8') as file_obj:
+            file_obj.write(self.render(index, revision))
+        self._revisions[index] = revision
+        return path
+
+    def generate(self):
+        """Write all records at revision 0."""
+        for index in range(self.size):
+            self.write(index)
+
+    def mutate(self, change_rate):
+        """Change content of a fraction of the records.
+
+        Records to change are picked deterministically from the seed
+        and the number of previous mutations.
+
+        :param float change_rate: Fraction of records to change, from 0 to 1.
+        :returns: Indexes of changed records.
+        :rtype: list
+        """
+        revision = max(self._revisions.values(), default=0) + 1
+        count = int(round(self.size * change_rate))
+        indexes = sorted(random.Random('%s:mutate:%s' % (self.seed, revision)).sample(range(self.size), count))
+        for index in indexes:
+            self.write(index, revision)
+        return indexes
+
+
+def cli():
+    """Generate a corpus from command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='Root folder of the corpus')
+    parser.add_argument('--size', type=int, default=1000, help='Number of records')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS),
+                        help='DDI formats to generate')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for generated content')
+    parser.add_argument('--files-per-dir', type=int, default=1000, help='Maximum number of files per folder')
+    parser.add_argument('--abstract-words', type=int, default=200, help='Number of words in each abstract')
+    args = parser.parse_args()
+    Corpus(args.path, args.size, formats=args.formats, seed=args.seed, files_per_dir=args.files_per_dir,
+           abstract_words=args.abstract_words).generate()
+
+
+if __name__ == '__main__':
+    cli()
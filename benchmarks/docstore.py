@@ -0,0 +1,330 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-process stand-in for CDC Aggregator DocStore.
+
+Implements the parts of the DocStore HTTP API used by
+:mod:`cdcagg_client.sync`:
+
+- ``POST <prefix>/query/<collection>?query_type=select|count|distinct``
+- ``POST <prefix>/<collection>`` creates a record.
+- ``PUT <prefix>/<collection>/<id>`` replaces a record.
+- ``DELETE <prefix>/<collection>/<id>`` marks a record deleted.
+
+A store created with ``gzip=True`` accepts gzip-compressed requests
+and compresses responses, and counts compressed requests.
+
+Records are kept in memory. Query filters support field equality,
+dotted paths, ``$elemMatch``, ``$or``, ``$and``, ``$ne``, ``$in`` and
+``$gte``, which covers the queries sent by the client. Select queries with a
+limit of one respond with a single record, or an empty object if
+nothing matches. Other select queries stream newline-separated records.
+
+Every request waits `latency` seconds before it is handled and is
+counted in :attr:`FakeDocumentStore.counters`. Setting
+:attr:`FakeDocumentStore.failures` makes that many next requests fail
+with 503.
+"""
+import json
+import asyncio
+import threading
+import itertools
+from collections import Counter
+from datetime import datetime, timezone
+from tornado.web import Application, HTTPError, RequestHandler
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+
+REC_STATUS_CREATED = 'created'
+REC_STATUS_UPDATED = 'updated'
+REC_STATUS_DELETED = 'deleted'
+
+
+def _values(document, path):
+    """Values found at dotted `path`, descending into lists."""
+    values = [document]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, list):
+                found.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+            elif isinstance(value, dict) and part in value:
+                found.append(value[part])
+        values = found
+    flat = []
+    for value in values:
+        flat.extend(value if isinstance(value, list) else [value])
+    return flat or [None]
+
+
+def _match_condition(document, path, condition):
+    if isinstance(condition, dict) and any(key.startswith('$') for key in condition):
+        for operator, operand in condition.items():
+            if operator == '$elemMatch':
+                items = document.get(path) if isinstance(document, dict) else None
+                if not isinstance(items, list) or not any(
+                        matches(item, operand, prefix=path + '.') for item in items):
+                    return False
+            elif operator == '$ne':
+                if operand in _values(document, path):
+                    return False
+            elif operator == '$in':
+                if not set(map(_hashable, _values(document, path))) & set(map(_hashable, operand)):
+                    return False
+            elif operator == '$gte':
+                if not any(value is not None and value >= operand for value in _values(document, path)):
+                    return False
+            else:
+                raise ValueError('Unsupported operator %s' % (operator,))
+        return True
+    return condition in _values(document, path)
+
+
+def _hashable(value):
+    return json.dumps(value, sort_keys=True) if isinstance(value, (dict, list)) else value
+
+
+def matches(document, _filter, prefix=''):
+    """Return True if `document` matches query `_filter`.
+
+    :param dict document: Stored record.
+    :param dict _filter: Query filter.
+    :param str prefix: Field path prefix to strip from keys, used in ``$elemMatch``.
+    :rtype: bool
+    """
+    for key, condition in (_filter or {}).items():
+        if key == '$or':
+            if not any(matches(document, sub, prefix) for sub in condition):
+                return False
+        elif key == '$and':
+            if not all(matches(document, sub, prefix) for sub in condition):
+                return False
+        else:
+            path = key[len(prefix):] if prefix and key.startswith(prefix) else key
+            if not _match_condition(document, path, condition):
+                return False
+    return True
+
+
+class FakeDocumentStore:
+    """In-memory record storage with request counters.
+
+    :param float latency: Seconds to wait before handling each request.
+    :param bool gzip: Accept compressed requests and compress responses.
+    """
+
+    def __init__(self, latency=0, gzip=False):
+        self.latency = latency
+        self.gzip = gzip
+        #: Number of next requests to fail with 503.
+        self.failures = 0
+        self.collections = {}
+        self.counters = Counter()
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def records(self, collection):
+        """Get stored records of a collection keyed by ID.
+
+        :param str collection: Collection name.
+        :rtype: dict
+        """
+        return self.collections.setdefault(collection, {})
+
+    def query(self, collection, _filter=None, fields=None, sort_by=None, limit=None, skip=None, **_):
+        """Select records.
+
+        :returns: List of matching records.
+        :rtype: list
+        """
+        found = [record for record in self.records(collection).values() if matches(record, _filter)]
+        if sort_by:
+            for field in reversed([sort_by] if isinstance(sort_by, str) else list(sort_by)):
+                found.sort(key=lambda record, _field=field: str(_values(record, _field)[0]))
+        found = found[skip or 0:]
+        if limit:
+            found = found[:limit]
+        if fields:
+            found = [{key: value for key, value in record.items() if key in fields or key == '_id'}
+                     for record in found]
+        return found
+
+    def distinct(self, collection, fieldname, _filter=None, **_):
+        """Query distinct values of a field."""
+        values = {}
+        for record in self.records(collection).values():
+            if matches(record, _filter):
+                for value in _values(record, fieldname):
+                    if value is not None:
+                        values.setdefault(_hashable(value), value)
+        return list(values.values())
+
+    def create(self, collection, document):
+        """Create record and return its ID."""
+        record_id = '%024x' % (next(self._ids),)
+        now = self._now()
+        document = dict(document, _id=record_id,
+                        _metadata={'created': now, 'updated': now, 'status': REC_STATUS_CREATED})
+        self.records(collection)[record_id] = document
+        return record_id
+
+    def update(self, collection, record_id, document):
+        """Replace record content. Returns False if record does not exist."""
+        old = self.records(collection).get(record_id)
+        if old is None:
+            return False
+        metadata = dict(old['_metadata'], updated=self._now(), status=REC_STATUS_UPDATED)
+        metadata.update(document.pop('_metadata', None) or {})
+        self.records(collection)[record_id] = dict(document, _id=record_id, _metadata=metadata)
+        return True
+
+    def delete(self, collection, record_id):
+        """Mark record deleted. Returns False if record does not exist."""
+        record = self.records(collection).get(record_id)
+        if record is None:
+            return False
+        record['_metadata'] = dict(record['_metadata'], status=REC_STATUS_DELETED, deleted=self._now())
+        return True
+
+
+class _BaseHandler(RequestHandler):
+
+    def initialize(self, store):
+        self.store = store  # pylint: disable=attribute-defined-outside-init
+
+    async def prepare(self):
+        self.store.counters['requests'] += 1
+        if self.request.headers.get('X-Consumed-Content-Encoding') == 'gzip':
+            self.store.counters['gzip_requests'] += 1
+        if self.store.latency:
+            await asyncio.sleep(self.store.latency)
+        if self.store.failures:
+            self.store.failures -= 1
+            raise HTTPError(503)
+
+    def _body(self):
+        return json.loads(self.request.body) if self.request.body else {}
+
+    def _write_result(self, result, record_id=None, status=200):
+        self.set_status(status)
+        self.write({'result': result, 'affected_resource': record_id, 'error': None if status < 400 else result})
+
+
+class QueryHandler(_BaseHandler):
+
+    def post(self, collection):
+        query_type = self.get_argument('query_type', 'select')
+        self.store.counters['query_%s' % (query_type,)] += 1
+        query = self._body()
+        if query_type == 'count':
+            self.write({'count': len(self.store.query(collection, query.get('_filter')))})
+        elif query_type == 'distinct':
+            fieldname = query['fieldname']
+            self.write({fieldname: self.store.distinct(collection, **query)})
+        elif query.get('limit') == 1:
+            found = self.store.query(collection, **query)
+            self.write(found[0] if found else {})
+        else:
+            self.set_header('Content-Type', 'application/json')
+            for record in self.store.query(collection, **query):
+                self.write(json.dumps(record) + '\n')
+
+
+class CollectionHandler(_BaseHandler):
+
+    def post(self, collection):
+        self.store.counters['create'] += 1
+        self._write_result('insert_successful', self.store.create(collection, self._body()), status=201)
+
+
+class RecordHandler(_BaseHandler):
+
+    def put(self, collection, record_id):
+        self.store.counters['update'] += 1
+        if self.store.update(collection, record_id, self._body()):
+            self._write_result('update_successful', record_id)
+        else:
+            self._write_result('not_found', record_id, status=404)
+
+    def delete(self, collection, record_id):
+        self.store.counters['delete'] += 1
+        if self.store.delete(collection, record_id):
+            self._write_result('delete_successful', record_id)
+        else:
+            self._write_result('not_found', record_id, status=404)
+
+
+def make_app(store, prefix='/v6'):
+    """Create tornado application serving `store`.
+
+    :param store: Storage.
+    :type store: :obj:`FakeDocumentStore`
+    :param str prefix: API path prefix.
+    :rtype: :obj:`tornado.web.Application`
+    """
+    kwargs = {'store': store}
+    return Application([
+        (prefix + r'/query/(\w+)/?', QueryHandler, kwargs),
+        (prefix + r'/(\w+)/?', CollectionHandler, kwargs),
+        (prefix + r'/(\w+)/(\w+)/?', RecordHandler, kwargs),
+    ], compress_response=store.gzip)
+
+
+class ServerThread:
+    """Serve a :obj:`FakeDocumentStore` from a background thread.
+
+    Use as a context manager. :attr:`url` is the DocStore URL to give
+    to the client with ``--document-store-url``.
+
+    :param store: Storage.
+    :type store: :obj:`FakeDocumentStore`
+    :param str host: Address to bind to.
+    :param int port: Port to bind to. Zero picks a free port.
+    :param str prefix: API path prefix.
+    """
+
+    def __init__(self, store, host='127.0.0.1', port=0, prefix='/v6'):
+        self.store = store
+        self._prefix = prefix
+        self._sockets = bind_sockets(port, host)
+        self.url = 'http://%s:%s%s' % (host, self._sockets[0].getsockname()[1], prefix)
+        self._loop = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='fake-docstore', daemon=True)
+
+    def _make_server(self):
+        return HTTPServer(make_app(self.store, self._prefix), decompress_request=self.store.gzip)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        server = self._make_server()
+        server.add_sockets(self._sockets)
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            server.stop()
+            self._loop.close()
+
+    def __enter__(self):
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
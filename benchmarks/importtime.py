@@ -0,0 +1,138 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure the import time of the client.
+
+Imports a module in a fresh interpreter with ``python -X importtime``
+and reports the cumulative import time of the module and the slowest
+modules it imported. Exits with status 1 if the import takes longer
+than ``--budget`` milliseconds or imports any of
+:data:`DEFERRED_MODULES`::
+
+    python -m benchmarks.importtime --budget 100
+
+Each measurement is repeated and the fastest run is reported, to even
+out a cold disk cache.
+"""
+import sys
+import argparse
+import subprocess
+from collections import namedtuple
+
+
+#: Module imported by the client entry point.
+DEFAULT_MODULE = 'cdcagg_client.sync'
+#: Budget of the cumulative import time of :data:`DEFAULT_MODULE` in milliseconds.
+DEFAULT_BUDGET_MS = 100
+#: Slow modules that :data:`DEFAULT_MODULE` imports only when the program is run.
+DEFERRED_MODULES = ('kuha_client', 'kuha_common.query', 'cdcagg_common.records', 'cdcagg_common.mappings',
+                    'tornado.httpclient', 'concurrent.futures.process', 'cdcagg_client.batch',
+                    'cdcagg_client.methods')
+
+#: Import time of a module in microseconds.
+ImportTime = namedtuple('ImportTime', ['module', 'self_us', 'cumulative_us'])
+
+
+def parse_importtime(output):
+    """Parse output of ``python -X importtime``.
+
+    :param str output: Standard error of the interpreter.
+    :returns: Import times in import order.
+    :rtype: list
+    """
+    times = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            # Header line.
+            continue
+        times.append(ImportTime(fields[2].strip(), self_us, cumulative_us))
+    return times
+
+
+def measure(module=DEFAULT_MODULE, repeat=3):
+    """Measure import time of a module in fresh interpreters.
+
+    :param str module: Module to import.
+    :param int repeat: Number of measurements.
+    :returns: Import times of the fastest measurement.
+    :rtype: list
+    """
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % (module,)],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+        times = parse_importtime(result.stderr)
+        if best is None or total_us(times, module) < total_us(best, module):
+            best = times
+    return best
+
+
+def loaded_modules(module=DEFAULT_MODULE):
+    """Get modules loaded by importing a module in a fresh interpreter.
+
+    :param str module: Module to import.
+    :returns: Names of modules in :data:`sys.modules` after the import.
+    :rtype: set
+    """
+    result = subprocess.run([sys.executable, '-c', 'import sys, %s; print("\\n".join(sys.modules))' % (module,)],
+                            stdout=subprocess.PIPE, text=True, check=True)
+    return set(result.stdout.split())
+
+
+def total_us(times, module):
+    """Get cumulative import time of a module in microseconds.
+
+    :param list times: Import times.
+    :param str module: Module name.
+    :rtype: int
+    """
+    for item in times:
+        if item.module == module:
+            return item.cumulative_us
+    raise ValueError('Module %s was not imported' % (module,))
+
+
+def imported_modules(times):
+    """Get names of imported modules.
+
+    :param list times: Import times.
+    :rtype: set
+    """
+    return {item.module for item in times}
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default=DEFAULT_MODULE, help='Module to import.')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_MS,
+                        help='Maximum cumulative import time in milliseconds.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of measurements.')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest modules to list.')
+    args = parser.parse_args(argv)
+    times = measure(args.module, repeat=args.repeat)
+    total_ms = total_us(times, args.module) / 1000
+    for item in sorted(times, key=lambda item: item.self_us, reverse=True)[:args.top]:
+        print('%10.1f ms  %s' % (item.self_us / 1000, item.module))
+    print('Importing %s took %.1f ms of %.1f ms budget' % (args.module, total_ms, args.budget))
+    deferred = sorted(imported_modules(times).intersection(DEFERRED_MODULES))
+    if deferred:
+        print('Imported deferred modules: %s' % (', '.join(deferred),))
+    return 0 if total_ms <= args.budget and not deferred else 1
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -0,0 +1,147 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-process stub of an OAI-PMH repository.
+
+Implements ``Identify`` and ``ListRecords`` with resumption tokens,
+``from`` and ``set`` arguments. Records are kept in memory in the
+order they are added and served `page_size` records per page. Served
+requests are counted in :attr:`FakeRepository.requests`.
+
+Serve it with :class:`OAIServerThread`.
+"""
+from collections import namedtuple
+from xml.sax.saxutils import escape, quoteattr
+from tornado.web import Application, RequestHandler
+from tornado.httpserver import HTTPServer
+from benchmarks.docstore import ServerThread
+
+
+#: Record of the repository. ``metadata`` is the XML of the metadata
+#: element content, or None for a deleted record.
+RepositoryRecord = namedtuple('RepositoryRecord', ['identifier', 'datestamp', 'metadata', 'sets'])
+
+_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>{response_date}</responseDate>
+  <request{request_attrs}>{base_url}</request>
+{content}
+</OAI-PMH>
+"""
+
+
+class FakeRepository:
+    """In-memory OAI-PMH repository.
+
+    :param int page_size: Number of records per ListRecords page.
+    :param str granularity: Datestamp granularity reported by Identify.
+    :param str response_date: Response date of all responses.
+    :param tuple metadata_prefixes: Supported metadata prefixes.
+    """
+
+    def __init__(self, page_size=2, granularity='YYYY-MM-DDThh:mm:ssZ', response_date='2026-01-01T00:00:00Z',
+                 metadata_prefixes=('oai_ddi25',)):
+        self.page_size = page_size
+        self.metadata_prefixes = metadata_prefixes
+        self.granularity = granularity
+        self.response_date = response_date
+        self.records = []
+        #: Query arguments of served requests.
+        self.requests = []
+
+    def add(self, identifier, datestamp, metadata=None, sets=()):
+        """Add a record. A record without metadata is deleted."""
+        self.records.append(RepositoryRecord(identifier, datestamp, metadata, tuple(sets)))
+
+    def list_records(self, metadata_prefix, from_date=None, set_spec=None, offset=0):
+        """Get a page of records and the token of the next page or None."""
+        matching = [record for record in self.records
+                    if (from_date is None or record.datestamp[:len(from_date)] >= from_date)
+                    and (set_spec is None or set_spec in record.sets)]
+        page = matching[offset:offset + self.page_size]
+        token = None
+        if offset + self.page_size < len(matching):
+            token = '%s|%s|%s|%s' % (metadata_prefix, from_date or '', set_spec or '', offset + self.page_size)
+        return page, token
+
+
+def _render_record(record):
+    header_attrs = ' status="deleted"' if record.metadata is None else ''
+    sets = ''.join('<setSpec>%s</setSpec>' % (escape(set_spec),) for set_spec in record.sets)
+    header = '<header%s><identifier>%s</identifier><datestamp>%s</datestamp>%s</header>' % (
+        header_attrs, escape(record.identifier), record.datestamp, sets)
+    metadata = '' if record.metadata is None else '<metadata>%s</metadata>' % (record.metadata,)
+    return '<record>%s%s</record>' % (header, metadata)
+
+
+class OAIHandler(RequestHandler):
+
+    def initialize(self, repository):
+        self.repository = repository  # pylint: disable=attribute-defined-outside-init
+
+    def _respond(self, content):
+        args = {key: self.get_argument(key) for key in self.request.arguments}
+        self.repository.requests.append(args)
+        self.set_header('Content-Type', 'text/xml; charset=utf-8')
+        self.write(_RESPONSE.format(
+            response_date=self.repository.response_date, base_url=escape(self.request.full_url().split('?')[0]),
+            request_attrs=''.join(' %s=%s' % (key, quoteattr(value)) for key, value in sorted(args.items())),
+            content=content))
+
+    def _error(self, code, message):
+        self._respond('<error code="%s">%s</error>' % (code, escape(message)))
+
+    def get(self):
+        verb = self.get_argument('verb', None)
+        if verb == 'Identify':
+            self._respond('<Identify><granularity>%s</granularity></Identify>' % (self.repository.granularity,))
+        elif verb == 'ListRecords':
+            self._list_records()
+        else:
+            self._error('badVerb', 'Unsupported verb')
+
+    def _list_records(self):
+        token = self.get_argument('resumptionToken', None)
+        if token is not None:
+            metadata_prefix, from_date, set_spec, offset = token.split('|')
+            from_date, set_spec, offset = from_date or None, set_spec or None, int(offset)
+        else:
+            metadata_prefix = self.get_argument('metadataPrefix')
+            from_date = self.get_argument('from', None)
+            set_spec = self.get_argument('set', None)
+            offset = 0
+        if metadata_prefix not in self.repository.metadata_prefixes:
+            self._error('cannotDisseminateFormat', 'Unsupported metadata prefix')
+            return
+        page, next_token = self.repository.list_records(metadata_prefix, from_date, set_spec, offset)
+        if not page:
+            self._error('noRecordsMatch', 'No records match')
+            return
+        token = '' if next_token is None else '<resumptionToken>%s</resumptionToken>' % (escape(next_token),)
+        self._respond('<ListRecords>%s%s</ListRecords>' % (''.join(_render_record(record) for record in page),
+                                                           token))
+
+
+class OAIServerThread(ServerThread):
+    """Serve a :obj:`FakeRepository` from a background thread.
+
+    :attr:`url` is the base URL of the repository.
+
+    :param repository: Repository.
+    :type repository: :obj:`FakeRepository`
+    """
+
+    def __init__(self, repository, host='127.0.0.1', port=0, prefix='/oai'):
+        super().__init__(repository, host=host, port=port, prefix=prefix)
+
+    def _make_server(self):
+        return HTTPServer(Application([(self._prefix, OAIHandler, {'repository': self.store})]))
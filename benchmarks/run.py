@@ -0,0 +1,184 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure synchronization throughput against a fake DocStore.
+
+Generates a synthetic corpus, starts a :class:`benchmarks.docstore.FakeDocumentStore`
+in this process and runs ``python -m cdcagg_client.sync`` against it
+in three scenarios:
+
+cold
+    Empty DocStore and no file cache. Every record is created.
+warm
+    Same corpus again. Every file is found in the file cache.
+partial
+    A fraction of the records is changed. Changed files are read and
+    their records updated.
+
+For each scenario the number of records in the corpus per second of
+wall time, the peak RSS of the client process and the number of
+requests received by DocStore are reported. Arguments after ``--`` are
+passed to the client, so different options can be compared::
+
+    python -m benchmarks.run --size 20000 --output cold.json -- --concurrency 8
+
+Client output is written to ``<workdir>/<scenario>.log``.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from benchmarks.corpus import Corpus, FORMATS
+from benchmarks.docstore import FakeDocumentStore, ServerThread
+
+
+SCENARIOS = ('cold', 'warm', 'partial')
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_client(docstore_url, paths, client_args=(), log_path=os.devnull):
+    """Run the client in a subprocess.
+
+    :param str docstore_url: DocStore URL.
+    :param list paths: Paths to synchronize.
+    :param client_args: Additional arguments for the client.
+    :param str log_path: File to write client output to.
+    :returns: Tuple of exit code, seconds and peak RSS in kilobytes.
+    :rtype: tuple
+    """
+    cmd = [sys.executable, '-m', 'cdcagg_client.sync', '--document-store-url', docstore_url,
+           *client_args, *paths]
+    with open(log_path, 'wb') as log_file:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+        # wait4() gives the resource usage of this child only.
+        _, status, rusage = os.wait4(proc.pid, 0)
+        seconds = time.perf_counter() - start
+    proc.returncode = _exit_code(status)
+    return proc.returncode, seconds, rusage.ru_maxrss
+
+
+def run_scenario(name, corpus, server, client_args, workdir):
+    """Run a single scenario and collect results.
+
+    :rtype: dict
+    """
+    before = server.store.counters.copy()
+    returncode, seconds, peak_rss_kb = run_client(server.url, [corpus.path], client_args,
+                                                  os.path.join(workdir, '%s.log' % (name,)))
+    requests = dict(server.store.counters - before)
+    return {'scenario': name,
+            'returncode': returncode,
+            'records': corpus.size,
+            'seconds': round(seconds, 3),
+            'records_per_second': round(corpus.size / seconds, 1) if seconds else None,
+            'peak_rss_kb': peak_rss_kb,
+            'requests': requests}
+
+
+def run_benchmark(size, workdir, formats=FORMATS, change_rate=0.1, latency=0, seed=0, client_args=(), gzip=False):
+    """Run all scenarios.
+
+    :param int size: Number of records in the corpus.
+    :param str workdir: Folder for the corpus, caches and logs.
+    :param tuple formats: DDI formats to generate.
+    :param float change_rate: Fraction of records changed for the partial scenario.
+    :param float latency: DocStore latency in seconds.
+    :param int seed: Seed for generated content.
+    :param client_args: Additional arguments for the client.
+    :param bool gzip: DocStore accepts compressed requests and compresses responses.
+    :returns: Results of each scenario.
+    :rtype: list
+    """
+    corpus = Corpus(os.path.join(workdir, 'corpus'), size, formats=formats, seed=seed)
+    file_cache = os.path.join(workdir, 'file_cache')
+    # Leftovers of a previous run would turn the cold run warm.
+    shutil.rmtree(corpus.path, ignore_errors=True)
+    if os.path.exists(file_cache):
+        os.remove(file_cache)
+    corpus.generate()
+    client_args = ['--file-cache', file_cache, *client_args]
+    results = []
+    with ServerThread(FakeDocumentStore(latency=latency, gzip=gzip)) as server:
+        for name in SCENARIOS:
+            if name == 'partial':
+                corpus.mutate(change_rate)
+            result = run_scenario(name, corpus, server, client_args, workdir)
+            result['stored_records'] = sum(len(records) for records in server.store.collections.values())
+            results.append(result)
+    return results
+
+
+def format_results(results):
+    """Format results as a table.
+
+    :param list results: Results of :func:`run_benchmark`.
+    :rtype: str
+    """
+    rows = [('scenario', 'rc', 'seconds', 'records/s', 'peak RSS MiB', 'requests')]
+    for result in results:
+        rows.append((result['scenario'], str(result['returncode']), '%.2f' % (result['seconds'],),
+                     str(result['records_per_second']), '%.1f' % (result['peak_rss_kb'] / 1024,),
+                     ' '.join('%s=%s' % item for item in sorted(result['requests'].items()))))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]) - 1)]
+    return '\n'.join('  '.join(value.ljust(width) for value, width in zip(row, widths)) + '  ' + row[-1]
+                     for row in rows)
+
+
+def cli():
+    """Run the benchmark from command line."""
+    argv = sys.argv[1:]
+    client_args = []
+    if '--' in argv:
+        argv, client_args = argv[:argv.index('--')], argv[argv.index('--') + 1:]
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=1000, help='Number of records in the corpus')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS),
+                        help='DDI formats to generate')
+    parser.add_argument('--change-rate', type=float, default=0.1,
+                        help='Fraction of records changed for the partial scenario')
+    parser.add_argument('--latency', type=float, default=0, help='DocStore latency in milliseconds')
+    parser.add_argument('--gzip', action='store_true',
+                        help='DocStore accepts compressed requests and compresses responses')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for generated content')
+    parser.add_argument('--workdir', help='Folder for the corpus, caches and logs. '
+                        'Defaults to a temporary folder that is removed afterwards.')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='cdcagg-benchmark-')
+    try:
+        results = run_benchmark(args.size, workdir, formats=args.formats, change_rate=args.change_rate,
+                                latency=args.latency / 1000, seed=args.seed, client_args=client_args,
+                                gzip=args.gzip)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+    print(format_results(results))
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file_obj:
+            json.dump({'size': args.size, 'formats': args.formats, 'change_rate': args.change_rate,
+                       'latency_ms': args.latency, 'client_args': client_args, 'results': results},
+                      file_obj, indent=2)
+    return 0 if all(result['returncode'] == 0 for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
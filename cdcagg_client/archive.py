@@ -0,0 +1,356 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Read compressed and archived source files.
+
+Besides plain '.xml' files, records can be read from
+
+- '.xml.gz' files compressed with gzip,
+- '.xml.zst' files compressed with Zstandard, if the zstandard
+  package is installed,
+- '.zip', '.tar', '.tar.gz' and '.tgz' archives, whose '.xml'
+  members are read as separate sources.
+
+Nothing is extracted to disk. Compressed files are decompressed as
+they are read. An archive member is identified by a member path
+``<archive path>!/<member name>``, see :func:`member_path`, and has a
+signature of its own, so the file cache detects changes per member.
+The signature of a member is its modification time in nanoseconds and
+its uncompressed size, like the signature of a file. Zip archives
+record modification times in local time without a timezone, so they
+are read as local time of this host.
+
+Members are read through a single open archive per process that is
+kept open between reads. Reading the members of a compressed tar
+archive in archive order therefore decompresses it only once. Call
+:func:`close_archives` when done.
+
+Plain files are mapped to memory with :mod:`mmap` when read whole,
+so hashing and incremental parsing do not copy them to buffers first.
+A mapped file must not be truncated while it is read.
+"""
+import io
+import os
+import gzip
+import mmap
+import tarfile
+import zipfile
+import functools
+import threading
+import importlib.util
+from contextlib import contextmanager
+from datetime import datetime
+
+
+#: Suffix of plain XML files.
+XML_SUFFIX = '.xml'
+#: Suffix of gzip compressed XML files.
+GZIP_SUFFIX = '.xml.gz'
+#: Suffix of Zstandard compressed XML files. Requires the zstandard package.
+ZSTD_SUFFIX = '.xml.zst'
+#: Suffix of zip archives.
+ZIP_SUFFIX = '.zip'
+#: Suffixes of tar archives, with or without compression.
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz')
+#: Suffixes of all supported source files.
+SOURCE_SUFFIXES = (XML_SUFFIX, GZIP_SUFFIX, ZSTD_SUFFIX, ZIP_SUFFIX) + TAR_SUFFIXES
+#: Separates the archive path from the member name in a member path.
+MEMBER_SEPARATOR = '!/'
+
+_READ_SIZE = 64 * 1024
+
+
+class ArchiveError(Exception):
+    """Archive could not be read."""
+
+
+@functools.lru_cache(maxsize=1)
+def zstd_available():
+    """Return True if the zstandard package is installed.
+
+    :rtype: bool
+    """
+    return importlib.util.find_spec('zstandard') is not None
+
+
+def source_suffixes(archives=False):
+    """Get suffixes of source files.
+
+    :param bool archives: Include compressed files and archives.
+                          '.xml.zst' is included only if
+                          :func:`zstd_available`.
+    :rtype: tuple
+    """
+    if not archives:
+        return (XML_SUFFIX,)
+    if zstd_available():
+        return SOURCE_SUFFIXES
+    return tuple(suffix for suffix in SOURCE_SUFFIXES if suffix != ZSTD_SUFFIX)
+
+
+def is_archive(path):
+    """Return True if path names a zip or tar archive.
+
+    :param str path: Path to a file.
+    :rtype: bool
+    """
+    return path.endswith((ZIP_SUFFIX,) + TAR_SUFFIXES)
+
+
+def member_path(archive_path, name):
+    """Get path of an archive member.
+
+    :param str archive_path: Path to the archive.
+    :param str name: Name of the member in the archive.
+    :rtype: str
+    """
+    return archive_path + MEMBER_SEPARATOR + name
+
+
+def split_member_path(path):
+    """Split a member path to archive path and member name.
+
+    :param str path: Path to a file or an archive member.
+    :returns: (archive path, member name), or (path, None) if `path`
+              is not a member path.
+    :rtype: tuple
+    """
+    start = 0
+    while True:
+        index = path.find(MEMBER_SEPARATOR, start)
+        if index == -1:
+            return path, None
+        if is_archive(path[:index]):
+            return path[:index], path[index + len(MEMBER_SEPARATOR):]
+        start = index + 1
+
+
+def is_plain(path):
+    """Return True if path is an uncompressed file rather than an archive member.
+
+    :param str path: Path to a file or an archive member.
+    :rtype: bool
+    """
+    return not path.endswith((GZIP_SUFFIX, ZSTD_SUFFIX)) and split_member_path(path)[1] is None
+
+
+def _seconds_to_ns(seconds):
+    # Tar archives may record fractions of a second.
+    return round(seconds * 10**9)
+
+
+def _iterate_zip_members(archive_path):
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and info.filename.endswith(XML_SUFFIX):
+                mtime = datetime(*info.date_time).timestamp()
+                yield member_path(archive_path, info.filename), (_seconds_to_ns(mtime), info.file_size)
+
+
+def _iterate_tar_members(archive_path):
+    with tarfile.open(archive_path) as archive:
+        for info in iter(archive.next, None):
+            # Do not keep all members of a large archive in memory.
+            archive.members.clear()
+            if info.isfile() and info.name.endswith(XML_SUFFIX):
+                yield member_path(archive_path, info.name), (_seconds_to_ns(info.mtime), info.size)
+
+
+def iterate_members(archive_path):
+    """Iterate '.xml' members of an archive and their signatures.
+
+    :param str archive_path: Path to a zip or tar archive.
+    :returns: Generator yielding tuples of member path and
+              (mtime_ns, size) in archive order.
+    :raises: :exc:`ArchiveError` if the archive cannot be read.
+    """
+    iterate = _iterate_zip_members if archive_path.endswith(ZIP_SUFFIX) else _iterate_tar_members
+    try:
+        yield from iterate(archive_path)
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError) as exc:
+        raise ArchiveError("Unable to read archive '%s': %s" % (archive_path, exc)) from exc
+
+
+class _ArchiveReader:
+    """Archive kept open for reading members.
+
+    Members of a tar archive are looked up by reading headers forward
+    from the previous member. The last member read is kept, since it is
+    usually read again for parsing after it has been sniffed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stat_key = _stat_key(path)
+        self._zip = None
+        self._tar = None
+        # Tar member name -> TarInfo of members passed so far.
+        self._members = {}
+        self._last = (None, None)
+        if path.endswith(ZIP_SUFFIX):
+            self._zip = zipfile.ZipFile(path)
+        else:
+            self._tar = tarfile.open(path)
+
+    def _tar_member(self, name):
+        info = self._members.get(name)
+        while info is None:
+            info = self._tar.next()
+            if info is None:
+                raise KeyError("No member '%s' in archive '%s'" % (name, self.path))
+            self._tar.members.clear()
+            if not info.isfile():
+                info = None
+                continue
+            self._members[info.name] = info
+            if info.name != name:
+                info = None
+        return info
+
+    def read(self, name):
+        if self._last[0] == name:
+            return self._last[1]
+        if self._zip is not None:
+            data = self._zip.read(name)
+        else:
+            data = self._tar.extractfile(self._tar_member(name)).read()
+        self._last = (name, data)
+        return data
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+
+def _stat_key(path):
+    stat_result = os.stat(path)
+    return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def read_member(archive_path, name):
+    """Read an archive member.
+
+    :param str archive_path: Path to the archive.
+    :param str name: Name of the member.
+    :returns: Content of the member.
+    :rtype: bytes
+    :raises: :exc:`KeyError` if there is no such member.
+    """
+    global _reader  # pylint: disable=global-statement
+    with _reader_lock:
+        if _reader is not None and (_reader.path != archive_path or _reader.stat_key != _stat_key(archive_path)):
+            # Another archive, or the archive was replaced.
+            _reader.close()
+            _reader = None
+        if _reader is None:
+            _reader = _ArchiveReader(archive_path)
+        return _reader.read(name)
+
+
+def _forget_reader():
+    global _reader, _reader_lock  # pylint: disable=global-statement
+    # A forked worker must not share the file offsets of the parent.
+    _reader = None
+    _reader_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_reader)
+
+
+def close_archives():
+    """Close the archive kept open for reading members."""
+    global _reader  # pylint: disable=global-statement
+    with _reader_lock:
+        if _reader is not None:
+            _reader.close()
+            _reader = None
+
+
+def _open_zstd(path):
+    try:
+        import zstandard  # pylint: disable=import-outside-toplevel
+    except ImportError as exc:
+        raise ImportError("Reading '%s' requires zstandard" % (path,)) from exc
+    file_obj = open(path, 'rb')  # pylint: disable=consider-using-with
+    return zstandard.ZstdDecompressor().stream_reader(file_obj, closefd=True)
+
+
+def open_source(path):
+    """Open a source file or archive member for reading.
+
+    :param str path: Path to a file or an archive member.
+    :returns: Binary file object yielding uncompressed content.
+    """
+    archive_path, name = split_member_path(path)
+    if name is not None:
+        return io.BytesIO(read_member(archive_path, name))
+    if path.endswith(GZIP_SUFFIX):
+        return gzip.open(path, 'rb')
+    if path.endswith(ZSTD_SUFFIX):
+        return _open_zstd(path)
+    return open(path, 'rb')  # pylint: disable=consider-using-with
+
+
+def read_source(path):
+    """Read uncompressed content of a source file or archive member.
+
+    :param str path: Path to a file or an archive member.
+    :rtype: bytes
+    """
+    archive_path, name = split_member_path(path)
+    if name is not None:
+        return read_member(archive_path, name)
+    with open_source(path) as file_obj:
+        return file_obj.read()
+
+
+@contextmanager
+def map_file(path):
+    """Map a plain file to memory for reading.
+
+    :param str path: Path to the file.
+    :returns: Context manager of a bytes-like object. Empty files are
+              not mapped.
+    """
+    with open(path, 'rb') as file_obj:
+        if os.fstat(file_obj.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def iterate_chunks(path, read_size=_READ_SIZE):
+    """Iterate uncompressed content of a source file or archive member in chunks.
+
+    Plain files are mapped to memory and chunks are views of the
+    mapping. A chunk is valid only until the next one is requested.
+
+    :param str path: Path to a file or an archive member.
+    :param int read_size: Size of a chunk.
+    :returns: Generator yielding bytes-like objects.
+    """
+    if not is_plain(path):
+        with open_source(path) as file_obj:
+            yield from iter(lambda: file_obj.read(read_size), b'')
+        return
+    with map_file(path) as mapped, memoryview(mapped) as view:
+        for offset in range(0, len(view), read_size):
+            with view[offset:offset + read_size] as chunk:
+                yield chunk
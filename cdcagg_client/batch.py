@@ -0,0 +1,1071 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Batch processing with concurrent upserts.
+
+:class:`BatchProcessor` reads records from XML files and upserts them
+to DocStore keeping up to `concurrency` upserts in flight. Records
+sharing a provenance key are never upserted concurrently, nor are
+records that resolve to the same DocStore record. Records that were
+not seen in the batch are removed afterwards, exactly as with
+:class:`kuha_client.BatchProcessor`.
+
+Parsing is CPU-bound. With `parse_workers`, files are parsed in
+worker processes that send records back as exported dictionaries,
+while the main process keeps upserting. Files are still handled in
+the order they are discovered.
+
+Files are discovered with :func:`cdcagg_client.discovery.discover_xml_files`
+in a background thread, so listing directories and stat'ing files
+does not block upserts in flight.
+
+With `archives`, compressed files and the '.xml' members of zip and
+tar archives are read too, see :mod:`cdcagg_client.archive`. Each
+member is a source of its own, cached and checkpointed by its member
+path.
+
+With `format_parsers`, the DDI format of each changed file is detected
+by :func:`cdcagg_client.sniff.sniff_file` from the root element, so
+the matching parser is tried first and files that cannot contain a
+study are skipped without parsing them. Skipped files are not parse
+failures. They are stored to the file cache without records, so they
+are sniffed again only after they change.
+
+A record is released as soon as its upsert has finished. Of handled
+records, only their IDs are kept until the file they came from is
+complete, and only if the IDs are needed for the file cache or the
+checkpoint. Memory use therefore does not grow with the number of
+records in a file or in the batch.
+
+With `deduplicate`, records sharing provenance keys with a record
+upserted earlier in the batch are coalesced into that upsert by
+:class:`BatchDeduplicator` instead of being queried and upserted again,
+unless they are newer. The same study found in several harvest sets is
+therefore sent to DocStore once. Coalesced records are counted as
+``coalesced``. The provenance keys and IDs of upserted records are
+kept until the batch ends, so memory use grows with the number of
+records in the batch.
+
+Absent records are deleted with up to `concurrency` deletes in flight.
+If `max_remove_fraction` is set and a larger share of the existing
+records would be deleted, for example because files are missing from the
+batch, the removal is aborted with :exc:`RemovalAborted` before anything
+is deleted.
+
+With `shard_count` greater than one, only files of shard `shard_index`
+are handled, see :mod:`cdcagg_client.shard`. Absent records are then
+not removed. Instead the IDs seen in the batch are written to
+`seen_ids_path`, and :meth:`BatchProcessor.remove_unseen` removes the
+records no shard has seen once all shards are done.
+
+With a `checkpoint`, completed files are journaled during the batch,
+see :mod:`cdcagg_client.checkpoint`. A resumed batch does not read
+files completed before a crash, but still counts their records as
+seen. The journal is removed when the batch finishes successfully.
+
+:meth:`BatchProcessor.upsert_harvest` upserts records harvested
+directly from an OAI-PMH repository with
+:class:`cdcagg_client.oai.ListRecordsHarvester` instead of reading
+files. Records deleted in the repository are deleted from DocStore.
+
+Files of at least `stream_min_size` bytes that contain an OAI-PMH
+``ListRecords`` response are read one record at a time with
+:func:`cdcagg_client.oai.iterate_file_records`, and each record is
+upserted as soon as it is parsed. Memory use stays at about one record
+regardless of the size of the file. Streamed files are always parsed in
+the main process.
+
+The collection methods used with this processor must implement
+``query_record(record)``, ``query_distinct_ids()`` and
+``upsert_record(record, old)`` coroutines. The last one receives the
+result of ``query_record`` and returns a tuple of record ID and one of
+:data:`UPSERT_CREATED`, :data:`UPSERT_UPDATED` or
+:data:`UPSERT_UNCHANGED`.
+"""
+import os
+import time
+import asyncio
+import functools
+import itertools
+import logging
+# ProcessPoolExecutor is resolved on first use, since multiprocessing
+# takes a while to import and most runs do not need it.
+import concurrent.futures
+from collections import deque, namedtuple
+from contextlib import asynccontextmanager
+from kuha_common.document_store.mappings.exceptions import UnknownXMLRoot
+import kuha_client
+from cdcagg_common.records import Study
+from cdcagg_client import (
+    archive,
+    oai,
+    stats
+)
+from cdcagg_client.index import provenance_keys
+from cdcagg_client.cache import file_digest
+from cdcagg_client.discovery import discover_xml_files
+from cdcagg_client.sniff import sniff_file
+from cdcagg_client.idset import CompactIdSet
+from cdcagg_client.shard import (
+    shard_of,
+    write_seen_ids
+)
+
+
+_logger = logging.getLogger(__name__)
+
+
+#: Record did not exist and was created.
+UPSERT_CREATED = 'created'
+#: Record existed and was updated.
+UPSERT_UPDATED = 'updated'
+#: Record existed and did not need updating.
+UPSERT_UNCHANGED = 'unchanged'
+
+
+class RemovalAborted(Exception):
+    """Too large a share of the collection would be removed."""
+
+
+class UnsupportedFile(Exception):
+    """None of the parsers accept the file."""
+
+
+#: Changed file to parse. ``parsers`` are the parser classes to try in order.
+#: ``streamed`` is True if records are read from the file one at a time.
+#: For harvested records ``path`` is the OAI-PMH identifier and ``signature`` is None.
+#: ``content_hash`` is set if the file cache stores content hashes.
+SourceFile = namedtuple('SourceFile', ['path', 'signature', 'file_format', 'parsers', 'streamed', 'content_hash'],
+                        defaults=(None,))
+
+
+def iterate_xml_files(paths):
+    """Iterate paths to XML files.
+
+    Paths pointing to files are yielded as is. Folders and their
+    subfolders are searched for '.xml'-suffixed files.
+
+    :param list paths: Paths to files and folders.
+    :returns: Generator yielding file paths.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith('.xml'):
+                    yield os.path.join(dirpath, filename)
+
+
+def parse_records(parsers, path):
+    """Parse records from file with the first parser accepting the file.
+
+    Compressed files and archive members are read to memory and
+    parsed from there.
+
+    :param list parsers: Parser classes.
+    :param str path: Path to the file or archive member.
+    :returns: Parsed records.
+    :rtype: list
+    :raises: :exc:`UnsupportedFile` if no parser accepts the file.
+    """
+    document = None if archive.is_plain(path) else archive.read_source(path)
+    for parser_class in parsers:
+        try:
+            if document is None:
+                parser = parser_class.from_file(path)
+            else:
+                parser = parser_class.from_string(document)
+        except UnknownXMLRoot:
+            continue
+        return list(parser.studies)
+    raise UnsupportedFile(path)
+
+
+def parse_document(parsers, document):
+    """Parse records from an XML document with the first parser accepting it.
+
+    :param list parsers: Parser classes.
+    :param bytes document: XML document.
+    :returns: Parsed records.
+    :rtype: list
+    :raises: :exc:`UnsupportedFile` if no parser accepts the document.
+    """
+    for parser_class in parsers:
+        try:
+            parser = parser_class.from_string(document)
+        except UnknownXMLRoot:
+            continue
+        return list(parser.studies)
+    raise UnsupportedFile('document')
+
+
+def parse_record_dicts(parsers, path):
+    """Parse records from file and export them to dictionaries.
+
+    Called in worker processes. Dictionaries are cheap to send
+    between processes and are loaded back to records with
+    :meth:`cdcagg_common.records.Study`.
+
+    :param list parsers: Parser classes.
+    :param str path: Path to the file.
+    :returns: Exported records.
+    :rtype: list
+    """
+    return [record.export_dict() for record in parse_records(parsers, path)]
+
+
+class StreamedRecords:
+    """Records of a ListRecords file parsed one record at a time.
+
+    Iterating parses the next record only when the previous one has
+    been consumed. If the file cannot be read to the end, `on_failure`
+    is called with the path, :attr:`failed` is set and iteration stops,
+    unless `fail_on_parse` is True, in which case the error is raised.
+
+    :param source: File to read.
+    :type source: :obj:`SourceFile`
+    :param on_failure: Called with the path if the file cannot be parsed.
+    :param bool fail_on_parse: Raise if the file cannot be parsed.
+    """
+
+    def __init__(self, source, on_failure, fail_on_parse=False):
+        self._source = source
+        self._on_failure = on_failure
+        self._fail_on_parse = fail_on_parse
+        self.failed = False
+
+    def __iter__(self):
+        harvested_records = oai.iterate_file_records(self._source.path)
+        try:
+            while True:
+                with stats.current().stage('parse'):
+                    harvested = next(harvested_records, None)
+                    if harvested is None:
+                        return
+                    if harvested.deleted:
+                        continue
+                    records = parse_document(self._source.parsers, harvested.document)
+                yield from records
+        except Exception:
+            self.failed = True
+            self._on_failure(self._source.path)
+            if self._fail_on_parse:
+                raise
+        finally:
+            harvested_records.close()
+
+
+def _drain(records):
+    """Iterate a list of records, dropping each from the list as it is handed out."""
+    records.reverse()
+    while records:
+        yield records.pop()
+
+
+class _PendingFile:
+    """Upserts of a file that are in flight.
+
+    :attr:`record_ids` collects IDs of upserted records in record order,
+    or is None if the IDs are not needed.
+    """
+
+    __slots__ = ('source', 'record_ids', 'pending', 'scheduled', 'failed')
+
+    def __init__(self, source, keep_ids):
+        self.source = source
+        self.record_ids = [] if keep_ids else None
+        self.pending = 0
+        self.scheduled = False
+        self.failed = False
+
+
+class KeyedLocks:
+    """Asyncio locks identified by hashable keys.
+
+    Locks are created on demand and discarded when no longer
+    held or waited for.
+    """
+
+    def __init__(self):
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    def locked(self, key):
+        """Return True if lock for `key` is held.
+
+        :param key: Lock key.
+        :rtype: bool
+        """
+        lock_users = self._locks.get(key)
+        return lock_users is not None and lock_users[0].locked()
+
+    async def _acquire(self, key):
+        lock_users = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        lock_users[1] += 1
+        try:
+            await lock_users[0].acquire()
+        except BaseException:
+            self._release_user(key)
+            raise
+
+    def _release_user(self, key):
+        lock_users = self._locks[key]
+        lock_users[1] -= 1
+        if lock_users[1] == 0:
+            del self._locks[key]
+
+    def _release(self, key):
+        self._locks[key][0].release()
+        self._release_user(key)
+
+    @asynccontextmanager
+    async def hold(self, keys):
+        """Hold locks of all `keys`.
+
+        Locks are acquired in a deterministic order to avoid
+        deadlocks between callers holding overlapping keys.
+
+        :param keys: Keys to lock.
+        :type keys: iterable
+        """
+        acquired = []
+        try:
+            for key in sorted(set(keys), key=repr):
+                await self._acquire(key)
+                acquired.append(key)
+            yield
+        finally:
+            for key in reversed(acquired):
+                self._release(key)
+
+
+def record_datestamp(record):
+    """Get the latest provenance datestamp of a record.
+
+    The datestamp is the datestamp attribute of a provenance item, not
+    its value, which is the harvest date.
+
+    :param record: Record to get the datestamp of.
+    :type record: :obj:`cdcagg_common.records.Study`
+    :returns: Datestamp or empty string if there is none.
+    :rtype: str
+    """
+    return max((prov.attr_datestamp.get_value() or '' for prov in record._provenance), default='')
+
+
+class _Winner:
+    """Record upserted in the batch.
+
+    :attr:`result` is the upsert task until it succeeds, then the record ID.
+    """
+
+    __slots__ = ('keys', 'datestamp', 'result')
+
+    def __init__(self, keys, datestamp, result):
+        self.keys = keys
+        self.datestamp = datestamp
+        self.result = result
+
+    def resolve(self, task):
+        """Replace a successful upsert task by the record ID."""
+        if not task.cancelled() and task.exception() is None:
+            self.result = task.result()
+
+
+class BatchDeduplicator:
+    """Index of provenance keys of records upserted in a batch.
+
+    The first record of the batch with a provenance key wins the key.
+    A later record is a duplicate of the winner if all its provenance
+    keys are keys of the winner and its :func:`record_datestamp` is not
+    newer. Duplicates are coalesced into the upsert of the winner
+    instead of being upserted again. A newer record is upserted and
+    wins its keys, so the newest record is stored, and of equally new
+    records the first one in batch order.
+    """
+
+    def __init__(self):
+        self._winners = {}
+
+    def __len__(self):
+        return len(self._winners)
+
+    def winner(self, record):
+        """Get the upsert of the record `record` duplicates.
+
+        Keys are looked up in provenance order.
+
+        :param record: Record to look up.
+        :type record: :obj:`cdcagg_common.records.Study`
+        :returns: Upsert task of the winner if it is in flight, ID of
+                  the winner if it has been upserted, or None if
+                  `record` is not a duplicate.
+        :rtype: :obj:`asyncio.Task`, str or None
+        """
+        keys = provenance_keys(record)
+        for key in keys:
+            winner = self._winners.get(key)
+            if winner is not None:
+                if winner.keys.issuperset(keys) and record_datestamp(record) <= winner.datestamp:
+                    return winner.result
+                return None
+        return None
+
+    def add(self, record, task):
+        """Make `record` the winner of its provenance keys.
+
+        :param record: Upserted record.
+        :type record: :obj:`cdcagg_common.records.Study`
+        :param task: Upsert task of the record.
+        :type task: :obj:`asyncio.Task`
+        """
+        keys = provenance_keys(record)
+        winner = _Winner(frozenset(keys), record_datestamp(record), task)
+        task.add_done_callback(winner.resolve)
+        for key in keys:
+            self._winners[key] = winner
+
+    def discard(self, keys):
+        """Forget winners of provenance keys.
+
+        :param keys: Provenance keys.
+        :type keys: iterable
+        """
+        for key in keys:
+            winner = self._winners.pop(key, None)
+            if winner is not None:
+                for other in winner.keys:
+                    if self._winners.get(other) is winner:
+                        del self._winners[other]
+
+
+class BatchProcessor:
+    """Synchronize a batch of files to DocStore with bounded concurrency.
+
+    :param methods: Collection methods class. Instantiated on the first
+                    call to :meth:`upsert_paths` and kept for later calls,
+                    so state cached by the methods outlives a single batch.
+                    Its `forget_record` method is called with the ID of
+                    each deleted record.
+    :param list parsers: Parser classes. The first parser accepting the file root is used.
+    :param cache: Optional file cache.
+    :type cache: :obj:`cdcagg_client.cache.FileCache`
+    :param bool fail_on_parse: Raise if a file cannot be parsed.
+    :param int concurrency: Maximum number of upserts in flight.
+    :param int parse_workers: Number of worker processes used for parsing.
+                              Zero parses files in the main process.
+    :param int id_page_size: If set, IDs of existing records are queried with
+                             ``query_distinct_id_set(id_page_size)`` in pages
+                             and stored compactly. Otherwise they are queried
+                             with ``query_distinct_ids()``.
+    :param int discovery_workers: Number of threads used to discover files.
+    :param manifest: Optional manifest of directory listings.
+    :type manifest: :obj:`cdcagg_client.discovery.DirectoryManifest`
+    :param dict format_parsers: Optional mapping of formats detected by
+                                :func:`cdcagg_client.sniff.sniff_file` to
+                                parser classes. If given, files are sniffed
+                                before parsing and the parser of the detected
+                                format is tried first. Files the sniffer finds
+                                unsupported are counted as unsupported and
+                                not parsed. Detected formats are stored to
+                                the file cache.
+    :param float max_remove_fraction: Maximum share of existing records that
+                                      may be removed as absent. None means no
+                                      limit.
+    :param int shard_index: Index of the shard to handle.
+    :param int shard_count: Number of shards.
+    :param str seen_ids_path: File to write seen IDs to when absent records
+                              would be removed in a sharded run.
+    :param checkpoint: Optional journal of completed files.
+    :type checkpoint: :obj:`cdcagg_client.checkpoint.Checkpoint`
+    :param int stream_min_size: Read ListRecords files of at least this
+                                many bytes one record at a time. Zero
+                                reads all files whole.
+    :param bool archives: Also read compressed files and archives.
+    :param bool deduplicate: Coalesce records of the batch sharing
+                             provenance keys with :obj:`BatchDeduplicator`.
+    """
+
+    #: Number of files submitted to parse workers ahead of upserts, per worker.
+    parse_prefetch = 4
+    #: Number of discovered files handed from the discovery thread at once.
+    discovery_chunk_size = 64
+    #: Seconds between progress reports of the removal.
+    remove_progress_interval = 10
+
+    def __init__(self, methods, parsers, cache=None, fail_on_parse=False, concurrency=1,
+                 parse_workers=0, id_page_size=0, discovery_workers=1, manifest=None, format_parsers=None,
+                 max_remove_fraction=None, shard_index=0, shard_count=1, seen_ids_path=None,
+                 checkpoint=None, stream_min_size=0, archives=False, deduplicate=False):
+        if concurrency < 1:
+            raise ValueError('concurrency must be a positive integer, got %r' % (concurrency,))
+        if parse_workers < 0:
+            raise ValueError('parse_workers must not be negative, got %r' % (parse_workers,))
+        if discovery_workers < 1:
+            raise ValueError('discovery_workers must be a positive integer, got %r' % (discovery_workers,))
+        if not 0 <= shard_index < shard_count:
+            raise ValueError('shard_index must be between 0 and shard_count - 1, got %r of %r'
+                             % (shard_index, shard_count))
+        if stream_min_size < 0:
+            raise ValueError('stream_min_size must not be negative, got %r' % (stream_min_size,))
+        if max_remove_fraction is not None and not 0 <= max_remove_fraction <= 1:
+            raise ValueError('max_remove_fraction must be between 0 and 1, got %r' % (max_remove_fraction,))
+        self._methods_class = methods
+        self._parsers = parsers
+        self._cache = cache
+        self._fail_on_parse = fail_on_parse
+        self._concurrency = concurrency
+        self._parse_workers = parse_workers
+        self._id_page_size = id_page_size
+        self._discovery_workers = discovery_workers
+        self._manifest = manifest
+        self._format_parsers = format_parsers
+        self._methods = None
+        self._max_remove_fraction = max_remove_fraction
+        self._shard_index = shard_index
+        self._shard_count = shard_count
+        self._seen_ids_path = seen_ids_path
+        self._checkpoint = checkpoint
+        self._stream_min_size = stream_min_size
+        self._archives = archives
+        self._deduplicate = deduplicate
+        self.counters = {}
+        self._reset()
+
+    def _reset(self):
+        self._semaphore = None
+        self._key_locks = None
+        self._id_locks = None
+        self._deduplicator = None
+        self._tasks = set()
+        self._error = None
+        # IDs of existing records not seen so far in the batch.
+        self._absent_ids = None
+        self._existing_count = 0
+        # IDs seen in the batch of a shard.
+        self._seen_ids = None
+        self.counters = {UPSERT_CREATED: 0, UPSERT_UPDATED: 0, UPSERT_UNCHANGED: 0, 'coalesced': 0,
+                         'cached_files': 0, 'resumed_files': 0, 'streamed_files': 0, 'failed_files': 0,
+                         'unsupported_files': 0, 'removed': 0}
+
+    def _parse_failed(self, path):
+        self.counters['failed_files'] += 1
+        stats.current().increment('failed_files')
+        _logger.exception("Unable to parse file '%s'. Is the file valid?", path)
+
+    def parse_file(self, path, parsers=None):
+        """Parse records from file.
+
+        :param str path: Path to the file.
+        :param list parsers: Parser classes to try. Defaults to all parsers.
+        :returns: Parsed records or None if the file could not be parsed.
+        :rtype: list or None
+        :raises: Exceptions raised by the parser if `fail_on_parse` is True.
+        """
+        try:
+            with stats.current().stage('parse'):
+                return parse_records(self._parsers if parsers is None else parsers, path)
+        except Exception:
+            self._parse_failed(path)
+            if self._fail_on_parse:
+                raise
+        return None
+
+    async def _await_parsed(self, path, future):
+        try:
+            with stats.current().stage('parse_wait'):
+                record_dicts = await future
+        except Exception:
+            self._parse_failed(path)
+            if self._fail_on_parse:
+                raise
+            return None
+        return [Study(record_dict) for record_dict in record_dicts]
+
+    def _cached(self, path, signature, content_hash=None):
+        if self._cache is not None and self._cache.is_unchanged(path, signature, content_hash=content_hash):
+            self.counters['cached_files'] += 1
+            stats.current().increment('cached_files')
+            for record_id in self._cache.get(path).record_ids:
+                self._seen(record_id)
+            return True
+        return False
+
+    def _resumed(self, path, signature):
+        if self._checkpoint is None:
+            return False
+        entry = self._checkpoint.completed(path, signature)
+        if entry is None:
+            return False
+        self.counters['resumed_files'] += 1
+        stats.current().increment('resumed_files')
+        for record_id in entry.record_ids:
+            self._seen(record_id)
+        self._complete(path, signature, entry.record_ids, entry.file_format)
+        return True
+
+    def _complete(self, path, signature, record_ids, file_format, content_hash=None):
+        if signature is None:
+            # Harvested, not read from a file.
+            return
+        if self._cache is not None:
+            self._cache.set(path, signature, record_ids, file_format=file_format, content_hash=content_hash)
+        if self._checkpoint is not None:
+            self._checkpoint.add(path, signature, record_ids, file_format=file_format)
+
+    async def _content_hash(self, path):
+        """Hash file content in the default executor if the file cache stores content hashes."""
+        if self._cache is None or not self._cache.stores_content_hash:
+            return None
+        with stats.current().stage('hash'):
+            return await asyncio.get_running_loop().run_in_executor(None, file_digest, path)
+
+    def _unsupported(self, path, signature, file_format, content_hash):
+        self.counters['unsupported_files'] += 1
+        stats.current().increment('unsupported_files')
+        _logger.warning("Skipping file '%s'. It does not contain a study in a supported format.", path)
+        # Not sniffed again until the file changes.
+        self._complete(path, signature, (), file_format, content_hash)
+
+    async def _resolve_parsers(self, path, signature, content_hash=None):
+        """Get (file_format, parsers) for a changed file, or None if the file is unsupported."""
+        if self._format_parsers is None:
+            return None, self._parsers
+        with stats.current().stage('sniff'):
+            sniffed = await asyncio.get_running_loop().run_in_executor(None, sniff_file, path)
+        if not sniffed.supported:
+            self._unsupported(path, signature, sniffed.file_format, content_hash)
+            return None
+        return sniffed.file_format, self._ordered_parsers(sniffed.file_format)
+
+    def _ordered_parsers(self, file_format):
+        parser = None if self._format_parsers is None else self._format_parsers.get(file_format)
+        if parser is None:
+            return self._parsers
+        # Other parsers are tried only if the parser of the detected format rejects the file.
+        return [parser] + [other for other in self._parsers if other is not parser]
+
+    async def _is_streamed(self, path, signature):
+        if not self._stream_min_size or signature[1] < self._stream_min_size:
+            return False
+        return await asyncio.get_running_loop().run_in_executor(None, oai.is_list_records_file, path)
+
+    def _stream(self, source):
+        self.counters['streamed_files'] += 1
+        stats.current().increment('streamed_files')
+        return StreamedRecords(source, self._parse_failed, fail_on_parse=self._fail_on_parse)
+
+    def _next_discovered(self, discovered):
+        return list(itertools.islice(discovered, self.discovery_chunk_size))
+
+    async def _changed_files(self, paths):
+        loop = asyncio.get_running_loop()
+        discovered = discover_xml_files(paths, workers=self._discovery_workers, manifest=self._manifest,
+                                        archives=self._archives)
+        future = None
+        try:
+            while True:
+                future = loop.run_in_executor(None, self._next_discovered, discovered)
+                with stats.current().stage('discovery'):
+                    chunk = await future
+                if not chunk:
+                    break
+                for path, signature in chunk:
+                    if self._shard_count > 1 and shard_of(path, self._shard_count) != self._shard_index:
+                        continue
+                    if self._cached(path, signature) or self._resumed(path, signature):
+                        continue
+                    content_hash = await self._content_hash(path)
+                    if content_hash is not None and self._cached(path, signature, content_hash):
+                        # Touched but not modified.
+                        continue
+                    resolved = await self._resolve_parsers(path, signature, content_hash)
+                    if resolved is not None:
+                        yield SourceFile(path, signature, *resolved, await self._is_streamed(path, signature),
+                                         content_hash)
+        finally:
+            if future is not None and not future.done():
+                # The generator cannot be closed while it is running.
+                await asyncio.wait([future])
+            discovered.close()
+
+    async def _iterate_parsed(self, paths):
+        """Yield (source, records) for changed files in discovery order."""
+        changed = self._changed_files(paths)
+        parsed = None
+        try:
+            if self._parse_workers == 0:
+                async for source in changed:
+                    if source.streamed:
+                        yield source, self._stream(source)
+                    else:
+                        yield source, self.parse_file(source.path, source.parsers)
+            else:
+                parsed = self._iterate_parsed_in_workers(changed)
+                async for item in parsed:
+                    yield item
+        finally:
+            if parsed is not None:
+                await parsed.aclose()
+            await changed.aclose()
+
+    def _parse_document(self, source, document):
+        try:
+            with stats.current().stage('parse'):
+                return parse_document(source.parsers, document)
+        except Exception:
+            self._parse_failed(source.path)
+            if self._fail_on_parse:
+                raise
+        return None
+
+    async def _delete_harvested(self, base_url, harvested):
+        record = Study()
+        record._provenance.add_value(harvested.datestamp, base_url=base_url, identifier=harvested.identifier)
+        async with self._key_locks.hold(provenance_keys(record)):
+            old = await self._methods.query_record(record)
+            if old is None:
+                return
+            record_id = old.get_id()
+            await self._delete(record_id)
+        if self._deduplicator is not None:
+            self._deduplicator.discard(provenance_keys(record))
+        if self._absent_ids is not None:
+            self._absent_ids.discard(record_id)
+
+    async def _iterate_harvested(self, harvester):
+        """Yield (source, records) for harvested records in repository order."""
+        async for harvested in harvester.iterate():
+            stats.current().increment('harvested_records')
+            if harvested.deleted:
+                await self._delete_harvested(harvester.base_url, harvested)
+                continue
+            source = SourceFile(harvested.identifier, None, harvested.file_format,
+                                self._ordered_parsers(harvested.file_format), False)
+            yield source, self._parse_document(source, harvested.document)
+
+    async def _iterate_parsed_in_workers(self, changed):
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self._parse_workers) as pool:
+            try:
+                async for source in changed:
+                    if source.streamed:
+                        # Keep discovery order. Streamed files are parsed as they are upserted.
+                        while pending:
+                            pending_source, future = pending.popleft()
+                            yield pending_source, await self._await_parsed(pending_source.path, future)
+                        yield source, self._stream(source)
+                        continue
+                    pending.append((source, loop.run_in_executor(
+                        pool, parse_record_dicts, source.parsers, source.path)))
+                    if len(pending) >= self._parse_workers * self.parse_prefetch:
+                        source, future = pending.popleft()
+                        yield source, await self._await_parsed(source.path, future)
+                while pending:
+                    source, future = pending.popleft()
+                    yield source, await self._await_parsed(source.path, future)
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    async def _upsert(self, record):
+        async with self._key_locks.hold(provenance_keys(record)):
+            record_id, outcome = await self._upsert_resolved(record)
+        self.counters[outcome] += 1
+        self._seen(record_id)
+        return record_id
+
+    def _seen(self, record_id):
+        if self._absent_ids is not None:
+            self._absent_ids.discard(record_id)
+        if self._seen_ids is not None:
+            self._seen_ids.add(record_id)
+
+    async def _upsert_resolved(self, record):
+        while True:
+            old = await self._methods.query_record(record)
+            if old is None:
+                return await self._methods.upsert_record(record, None)
+            # Records that share no provenance key may still resolve to the
+            # same DocStore record. Serialize those by record ID and query
+            # again if another upsert got there first.
+            record_id = old.get_id()
+            contended = self._id_locks.locked(record_id)
+            async with self._id_locks.hold([record_id]):
+                if contended:
+                    old = await self._methods.query_record(record)
+                if old is None or old.get_id() == record_id:
+                    return await self._methods.upsert_record(record, old)
+
+    def _on_task_done(self, task):
+        self._tasks.discard(task)
+        self._semaphore.release()
+        if not task.cancelled() and task.exception() is not None and self._error is None:
+            self._error = task.exception()
+
+    async def _schedule(self, record):
+        await self._semaphore.acquire()
+        if self._error is not None:
+            self._semaphore.release()
+            raise self._error
+        task = asyncio.ensure_future(self._upsert(record))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+        return task
+
+    def _track(self, pending_file, task):
+        pending_file.pending += 1
+        index = None
+        if pending_file.record_ids is not None:
+            index = len(pending_file.record_ids)
+            pending_file.record_ids.append(None)
+        task.add_done_callback(functools.partial(self._on_file_task_done, pending_file, index))
+
+    def _on_file_task_done(self, pending_file, index, task):
+        pending_file.pending -= 1
+        if task.cancelled() or task.exception() is not None:
+            # Reported through _on_task_done. The file is not completed.
+            pending_file.failed = True
+        elif index is not None:
+            pending_file.record_ids[index] = task.result()
+        self._complete_file(pending_file)
+
+    def _complete_file(self, pending_file):
+        if not pending_file.scheduled or pending_file.pending or pending_file.failed:
+            return
+        source = pending_file.source
+        try:
+            self._complete(source.path, source.signature, pending_file.record_ids or (), source.file_format,
+                           source.content_hash)
+        except Exception as exc:  # pylint: disable=broad-except
+            # Called back from a finished upsert. Fail the batch.
+            if self._error is None:
+                self._error = exc
+
+    async def _process_file(self, source, records):
+        if records is None:
+            return
+        keep_ids = source.signature is not None and (self._cache is not None or self._checkpoint is not None)
+        pending_file = _PendingFile(source, keep_ids)
+        for record in _drain(records) if isinstance(records, list) else records:
+            winner = self._deduplicator.winner(record) if self._deduplicator is not None else None
+            if winner is not None:
+                # The ID of the winner is the ID of the duplicate.
+                self.counters['coalesced'] += 1
+                stats.current().increment('coalesced')
+                if isinstance(winner, asyncio.Future):
+                    self._track(pending_file, winner)
+                elif pending_file.record_ids is not None:
+                    pending_file.record_ids.append(winner)
+                continue
+            task = await self._schedule(record)
+            if self._deduplicator is not None:
+                self._deduplicator.add(record, task)
+            self._track(pending_file, task)
+        if isinstance(records, StreamedRecords) and records.failed:
+            # Upserted records count as seen, but the file is read again next time.
+            return
+        pending_file.scheduled = True
+        self._complete_file(pending_file)
+
+    async def _query_existing_ids(self, base_url=None):
+        kwargs = {} if base_url is None else {'base_url': base_url}
+        with stats.current().stage('query_existing_ids'):
+            if self._id_page_size:
+                return await self._methods.query_distinct_id_set(self._id_page_size, **kwargs)
+            return await self._methods.query_distinct_ids(**kwargs)
+
+    async def _delete(self, record_id):
+        with stats.current().request('delete'):
+            await kuha_client.send_delete_record_request(self._methods.collection, record_id=record_id)
+        self._methods.forget_record(record_id)
+        self.counters['removed'] += 1
+        stats.current().increment('deleted')
+
+    def _check_remove_fraction(self, absent_count):
+        if self._max_remove_fraction is None or absent_count == 0:
+            return
+        fraction = absent_count / self._existing_count
+        if fraction > self._max_remove_fraction:
+            raise RemovalAborted('Refusing to remove %s of %s records (%.1f%%), which exceeds the maximum of '
+                                 '%.1f%%. Check that all files were found.'
+                                 % (absent_count, self._existing_count, fraction * 100,
+                                    self._max_remove_fraction * 100))
+
+    @staticmethod
+    def _raise_failed(tasks):
+        # Retrieve all exceptions, raise the first one.
+        errors = [task.exception() for task in tasks]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    async def _remove_absent(self):
+        absent = self._absent_ids
+        total = len(absent)
+        self._check_remove_fraction(total)
+        _logger.info('Removing %s records that were not found in this batch', total)
+        pending = set()
+        next_report = time.monotonic() + self.remove_progress_interval
+        with stats.current().stage('remove'):
+            try:
+                for record_id in absent:
+                    if len(pending) >= self._concurrency:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        self._raise_failed(done)
+                    pending.add(asyncio.ensure_future(self._delete(record_id)))
+                    if time.monotonic() >= next_report:
+                        _logger.info('Removed %s of %s records', self.counters['removed'], total)
+                        next_report = time.monotonic() + self.remove_progress_interval
+                if pending:
+                    done, pending = await asyncio.wait(pending)
+                    self._raise_failed(done)
+            except BaseException:
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                raise
+        _logger.info('Removed %s records', self.counters['removed'])
+
+    def _start(self):
+        self._reset()
+        if self._methods is None:
+            self._methods = self._methods_class(None)
+
+    def _start_shard(self):
+        self._seen_ids = CompactIdSet()
+        if self._seen_ids_path is None:
+            _logger.warning('Records not found in the batch are not removed, since this is shard %s of %s',
+                            self._shard_index, self._shard_count)
+            return
+        try:
+            # Make sure the final step does not use IDs of an earlier run, should this one fail.
+            os.remove(self._seen_ids_path)
+        except FileNotFoundError:
+            pass
+
+    async def upsert_paths(self, paths, remove_absent=False):
+        """Upsert records from paths and optionally remove absent records.
+
+        In a sharded run absent records are not removed. If
+        `remove_absent` is True, seen IDs are written to
+        `seen_ids_path` instead.
+
+        :param list paths: Paths to files and folders.
+        :param bool remove_absent: Remove records that were not found in this batch.
+        """
+        await self._upsert_batch(self._iterate_parsed(paths), remove_absent)
+
+    async def upsert_harvest(self, harvester, remove_absent=False):
+        """Upsert records harvested from an OAI-PMH repository.
+
+        Records deleted in the repository are deleted from DocStore.
+        Use `remove_absent` only when harvesting all records, since an
+        incremental harvest does not see unchanged records. Only
+        records with a provenance item of the base URL of the
+        repository are removed, so records of other repositories and
+        files are kept.
+
+        :param harvester: Harvester of the repository.
+        :type harvester: :obj:`cdcagg_client.oai.ListRecordsHarvester`
+        :param bool remove_absent: Remove records of the repository
+                                   that were not harvested.
+        """
+        await self._upsert_batch(self._iterate_harvested(harvester), remove_absent, base_url=harvester.base_url)
+        _logger.info('Harvested %s pages from %s', harvester.pages, harvester.base_url)
+
+    async def _upsert_batch(self, parsed, remove_absent, base_url=None):
+        self._start()
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+        self._key_locks = KeyedLocks()
+        self._id_locks = KeyedLocks()
+        if self._deduplicate:
+            self._deduplicator = BatchDeduplicator()
+        if remove_absent and self._shard_count > 1:
+            self._start_shard()
+            remove_absent = False
+        if remove_absent:
+            self._absent_ids = await self._query_existing_ids(base_url)
+            self._existing_count = len(self._absent_ids)
+        if self._checkpoint is not None:
+            self._checkpoint.open()
+        success = False
+        try:
+            try:
+                async for source, records in parsed:
+                    await self._process_file(source, records)
+                await asyncio.gather(*self._tasks)
+                if self._error is not None:
+                    raise self._error
+            except BaseException:
+                await parsed.aclose()
+                pending = set(self._tasks)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                raise
+            if remove_absent:
+                await self._remove_absent()
+            if self._seen_ids is not None and self._seen_ids_path is not None:
+                write_seen_ids(self._seen_ids_path, self._seen_ids)
+            success = True
+        finally:
+            archive.close_archives()
+            if self._checkpoint is not None:
+                if success:
+                    self._checkpoint.remove()
+                else:
+                    self._checkpoint.close()
+        _logger.info('Batch finished: %s', ', '.join('%s=%s' % item for item in self.counters.items()))
+
+    async def remove_unseen(self, seen_ids):
+        """Remove records that were not seen by any shard.
+
+        :param iterable seen_ids: IDs seen by all shards of the run.
+        """
+        self._start()
+        self._absent_ids = await self._query_existing_ids()
+        self._existing_count = len(self._absent_ids)
+        for record_id in seen_ids:
+            self._absent_ids.discard(record_id)
+        await self._remove_absent()
+
+    def remove_unseen_run(self, seen_ids):
+        """Run :meth:`remove_unseen` in a new event loop.
+
+        :param iterable seen_ids: IDs seen by all shards of the run.
+        """
+        asyncio.run(self.remove_unseen(seen_ids))
+
+    def upsert_harvest_run(self, harvester, remove_absent=False):
+        """Run :meth:`upsert_harvest` in a new event loop.
+
+        :param harvester: Harvester of the repository.
+        :type harvester: :obj:`cdcagg_client.oai.ListRecordsHarvester`
+        :param bool remove_absent: Remove records of the repository
+                                   that were not harvested.
+        """
+        asyncio.run(self.upsert_harvest(harvester, remove_absent=remove_absent))
+
+    def upsert_run(self, paths, remove_absent=False):
+        """Run :meth:`upsert_paths` in a new event loop.
+
+        :param list paths: Paths to files and folders.
+        :param bool remove_absent: Remove records that were not found in this batch.
+        """
+        asyncio.run(self.upsert_paths(paths, remove_absent=remove_absent))
@@ -0,0 +1,419 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""File caches used by :class:`cdcagg_client.batch.BatchProcessor`.
+
+A file cache keeps track of source files that have been successfully
+synchronized, along with the IDs of the records read from them. On
+consecutive runs unchanged files are not parsed again, but their
+record IDs are still considered seen, so that they are not removed
+from DocStore.
+
+Two backends are available. :class:`FileCache` is a pickle that is
+loaded whole at startup and written whole at the end.
+:class:`SQLiteFileCache` keeps the cache in an indexed SQLite table,
+commits in batches during the run and also stores a content hash of
+each file, so files that are touched but not modified are not parsed
+again. It migrates an existing pickle cache on first use. The cache
+never reads files itself: content hashes are computed by the caller,
+outside of the event loop, and passed in.
+
+A cache written by :class:`kuha_client.FileLoggingCache` is not in
+a supported format and is not migrated. Both backends keep such a
+file with an ``.unsupported`` suffix before writing the cache, and
+start with an empty cache, so all files are read again.
+"""
+import os
+import shutil
+import pickle
+import sqlite3
+import hashlib
+import logging
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+from cdcagg_client.archive import iterate_chunks
+
+
+_logger = logging.getLogger(__name__)
+
+
+#: Cached state of a single file. ``record_ids`` is a tuple of record IDs.
+#: ``file_format`` is the format detected by :mod:`cdcagg_client.sniff`
+#: or None.
+CacheEntry = namedtuple('CacheEntry', ['mtime_ns', 'size', 'record_ids', 'file_format'], defaults=(None,))
+
+#: Pickle backend.
+BACKEND_PICKLE = 'pickle'
+#: SQLite backend.
+BACKEND_SQLITE = 'sqlite'
+#: Available backends.
+BACKENDS = (BACKEND_PICKLE, BACKEND_SQLITE)
+
+_SQLITE_HEADER = b'SQLite format 3\x00'
+#: Suffix of the copy kept of a cache file that is not in a supported format.
+_UNSUPPORTED_SUFFIX = '.unsupported'
+
+
+def file_signature(path, stat_result=None):
+    """Get (mtime_ns, size) of a file.
+
+    :param str path: Path to the file.
+    :param stat_result: Optional result of :func:`os.stat` for `path`.
+    :returns: Modification time in nanoseconds and size in bytes.
+    :rtype: tuple
+    """
+    if stat_result is None:
+        stat_result = os.stat(path)
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
+def file_digest(path):
+    """Compute SHA-256 hexdigest of file content.
+
+    Compressed files and archive members are hashed uncompressed.
+
+    :param str path: Path to the file or archive member.
+    :returns: Hexdigest
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    for chunk in iterate_chunks(path, 1 << 20):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_pickle_cache(path):
+    """Read entries of a pickle cache file.
+
+    Only caches written by :class:`FileCache` are supported. Other
+    files, such as caches written by
+    :class:`kuha_client.FileLoggingCache`, are not read.
+
+    :param str path: Path to the cache file.
+    :returns: Dictionary of path to :obj:`CacheEntry` or None if the
+              format is not supported.
+    :rtype: dict or None
+    """
+    with open(path, 'rb') as file_obj:
+        try:
+            content = pickle.load(file_obj)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError, ValueError):
+            return None
+    if isinstance(content, dict) and content.get('version') == FileCache.version:
+        return {file_path: CacheEntry(*entry) for file_path, entry in content['files'].items()}
+    return None
+
+
+class FileCache:
+    """Pickle-backed file cache.
+
+
+    The whole cache is loaded by :meth:`load` and written by
+    :meth:`save`.
+
+    :param str path: Path to the cache file.
+    """
+
+    #: Format version stored in the cache file.
+    version = 1
+    #: Content hashes are not stored.
+    stores_content_hash = False
+
+    def __init__(self, path):
+        self._path = path
+        self._files = {}
+        self._changed = False
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, path):
+        return path in self._files
+
+    def get(self, path):
+        """Get cache entry of a file.
+
+        :param str path: Path to the file.
+        :returns: Entry or None.
+        :rtype: :obj:`CacheEntry` or None
+        """
+        return self._files.get(path)
+
+    def is_unchanged(self, path, signature, content_hash=None):
+        """Return True if file has not changed since it was cached.
+
+        :param str path: Path to the file.
+        :param tuple signature: Current (mtime_ns, size) of the file.
+        :param str content_hash: Ignored.
+        :rtype: bool
+        """
+        entry = self._files.get(path)
+        return entry is not None and (entry.mtime_ns, entry.size) == tuple(signature)
+
+    def set(self, path, signature, record_ids, file_format=None, content_hash=None):
+        """Store file to cache.
+
+        :param str path: Path to the file.
+        :param tuple signature: (mtime_ns, size) of the file.
+        :param record_ids: IDs of the records read from the file.
+        :type record_ids: iterable
+        :param str file_format: Detected format of the file.
+        :param str content_hash: Ignored.
+        """
+        mtime_ns, size = signature
+        self._files[path] = CacheEntry(mtime_ns, size, tuple(record_ids), file_format)
+        self._changed = True
+
+    def discard(self, path):
+        """Remove file from cache if it exists.
+
+        :param str path: Path to the file.
+        """
+        if self._files.pop(path, None) is not None:
+            self._changed = True
+
+    def items(self):
+        """Iterate cached (path, entry) pairs.
+
+        :returns: Iterator of tuples.
+        """
+        return iter(self._files.items())
+
+    def load(self):
+        """Load cache from file."""
+        if not os.path.exists(self._path):
+            _logger.info("File cache '%s' does not exist. It will be created.", self._path)
+            return
+        files = _read_pickle_cache(self._path)
+        if files is None:
+            backup_path = self._path + _UNSUPPORTED_SUFFIX
+            shutil.copyfile(self._path, backup_path)
+            _logger.warning("File cache '%s' is not in a supported format. It is kept at '%s'. Starting with "
+                            "an empty cache. All files will be read.", self._path, backup_path)
+            return
+        self._files = files
+        _logger.info("Loaded %s files from cache '%s'", len(self), self._path)
+
+    def commit(self):
+        """Save changes made so far. Same as :meth:`save`."""
+        self.save()
+
+    def save(self):
+        """Save cache to file if it has changed."""
+        if not self._changed:
+            return
+        content = {'version': self.version,
+                   'files': {path: tuple(entry) for path, entry in self._files.items()}}
+        dirname = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.filecache-')
+        try:
+            with os.fdopen(fd, 'wb') as file_obj:
+                pickle.dump(content, file_obj, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._changed = False
+        _logger.info("Saved %s files to cache '%s'", len(self), self._path)
+
+
+class SQLiteFileCache:
+    """SQLite-backed file cache.
+
+    Changes are committed every `commit_interval` changed files and
+    on :meth:`save`, so a crash loses at most `commit_interval`
+    files worth of progress.
+
+    :param str path: Path to the SQLite database.
+    :param int commit_interval: Number of changes to commit at once.
+    """
+
+    #: Content hashes are stored and used to recognize touched files.
+    stores_content_hash = True
+
+    def __init__(self, path, commit_interval=1000):
+        self._path = path
+        self._commit_interval = commit_interval
+        self._connection = None
+        self._uncommitted = 0
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def __contains__(self, path):
+        return self._select(path) is not None
+
+    def _select(self, path):
+        return self._connection.execute(
+            'SELECT mtime_ns, size, content_hash, record_ids, file_format FROM files WHERE path = ?',
+            (path,)).fetchone()
+
+    @staticmethod
+    def _entry(row):
+        mtime_ns, size, _, record_ids, file_format = row
+        return CacheEntry(mtime_ns, size, tuple(record_ids.split()) if record_ids else (), file_format)
+
+    def _changed(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self._commit_interval:
+            self.commit()
+
+    def get(self, path):
+        """Get cache entry of a file.
+
+        :param str path: Path to the file.
+        :returns: Entry or None.
+        :rtype: :obj:`CacheEntry` or None
+        """
+        row = self._select(path)
+        return None if row is None else self._entry(row)
+
+    def is_unchanged(self, path, signature, content_hash=None):
+        """Return True if file has not changed since it was cached.
+
+        If the signature differs and `content_hash` is given, it is
+        compared to the cached one. If the content is the same, the
+        cached signature is updated and the file is considered
+        unchanged.
+
+        :param str path: Path to the file.
+        :param tuple signature: Current (mtime_ns, size) of the file.
+        :param str content_hash: Current :func:`file_digest` of the file.
+        :rtype: bool
+        """
+        row = self._select(path)
+        if row is None:
+            return False
+        mtime_ns, size, cached_hash, _, _ = row
+        if (mtime_ns, size) == tuple(signature):
+            return True
+        if size != signature[1] or content_hash is None or cached_hash != content_hash:
+            return False
+        self._connection.execute('UPDATE files SET mtime_ns = ? WHERE path = ?', (signature[0], path))
+        self._changed()
+        return True
+
+    def set(self, path, signature, record_ids, file_format=None, content_hash=None):
+        """Store file to cache.
+
+        :param str path: Path to the file.
+        :param tuple signature: (mtime_ns, size) of the file.
+        :param record_ids: IDs of the records read from the file.
+        :type record_ids: iterable
+        :param str file_format: Detected format of the file.
+        :param str content_hash: :func:`file_digest` of the file. Touched
+                                 files are not recognized without it.
+        """
+        mtime_ns, size = signature
+        self._connection.execute(
+            'INSERT OR REPLACE INTO files (path, mtime_ns, size, content_hash, record_ids, file_format) '
+            'VALUES (?, ?, ?, ?, ?, ?)', (path, mtime_ns, size, content_hash, ' '.join(record_ids), file_format))
+        self._changed()
+
+    def discard(self, path):
+        """Remove file from cache if it exists.
+
+        :param str path: Path to the file.
+        """
+        if self._connection.execute('DELETE FROM files WHERE path = ?', (path,)).rowcount:
+            self._changed()
+
+    def items(self):
+        """Iterate cached (path, entry) pairs.
+
+        :returns: Iterator of tuples.
+        """
+        for path, *row in self._connection.execute(
+                'SELECT path, mtime_ns, size, content_hash, record_ids, file_format FROM files ORDER BY path'):
+            yield path, self._entry(row)
+
+    def _is_pickle(self):
+        if not os.path.exists(self._path):
+            return False
+        with open(self._path, 'rb') as file_obj:
+            return file_obj.read(len(_SQLITE_HEADER)) not in (_SQLITE_HEADER, b'')
+
+    def _migrate_pickle(self):
+        files = _read_pickle_cache(self._path)
+        if files is None:
+            backup_path = self._path + _UNSUPPORTED_SUFFIX
+            os.replace(self._path, backup_path)
+            _logger.warning("File cache '%s' is not in a supported format. It is kept at '%s'. Starting with "
+                            "an empty cache. All files will be read.", self._path, backup_path)
+            return None
+        backup_path = self._path + '.pickle'
+        os.replace(self._path, backup_path)
+        _logger.info("Migrating %s files from pickle cache to SQLite cache '%s'. Old cache is kept at '%s'.",
+                     len(files), self._path, backup_path)
+        return files
+
+    def load(self):
+        """Open the database and create the table if needed.
+
+        If `path` points to a pickle cache, it is migrated to SQLite.
+        Content hashes are not known for migrated files. A file in any
+        other format is moved aside and an empty cache is created.
+        """
+        migrated = self._migrate_pickle() if self._is_pickle() else None
+        self._connection = sqlite3.connect(self._path)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS files ('
+                                 'path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, '
+                                 'size INTEGER NOT NULL, content_hash TEXT, record_ids TEXT NOT NULL, '
+                                 'file_format TEXT)')
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(files)')]
+        if 'file_format' not in columns:
+            # Created by a version that did not store file formats.
+            self._connection.execute('ALTER TABLE files ADD COLUMN file_format TEXT')
+        if migrated is not None:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO files (path, mtime_ns, size, content_hash, record_ids, file_format) '
+                'VALUES (?, ?, ?, NULL, ?, ?)',
+                ((path, entry.mtime_ns, entry.size, ' '.join(entry.record_ids), entry.file_format)
+                 for path, entry in migrated.items()))
+        self.commit()
+        _logger.info("Opened SQLite file cache '%s' with %s files", self._path, len(self))
+
+    def commit(self):
+        """Commit pending changes."""
+        self._connection.commit()
+        self._uncommitted = 0
+
+    def save(self):
+        """Commit pending changes and close the database."""
+        if self._connection is None:
+            return
+        self.commit()
+        self._connection.close()
+        self._connection = None
+
+
+@contextmanager
+def open_file_cache(path, backend=BACKEND_PICKLE):
+    """Context manager that loads a file cache and saves it on exit.
+
+    :param str path: Path to the cache file.
+    :param str backend: One of :data:`BACKENDS`.
+    :returns: Loaded cache.
+    :rtype: :obj:`FileCache` or :obj:`SQLiteFileCache`
+    """
+    if backend == BACKEND_SQLITE:
+        cache = SQLiteFileCache(path)
+    elif backend == BACKEND_PICKLE:
+        cache = FileCache(path)
+    else:
+        raise ValueError('Unknown file cache backend %r' % (backend,))
+    cache.load()
+    try:
+        yield cache
+    finally:
+        cache.save()
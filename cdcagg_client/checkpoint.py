@@ -0,0 +1,152 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Checkpoints of a running batch.
+
+A :class:`Checkpoint` is a journal of source files whose records have
+all been upserted, along with the IDs of those records. Each file is
+appended as a single JSON line, and the journal is flushed to disk
+every `interval` seconds, so a crash loses at most `interval` seconds
+worth of progress. A line cut short by a crash is ignored.
+
+When a batch is resumed, files found in the journal with an unchanged
+signature are not read again, and their record IDs are considered
+seen, so absent records are still removed correctly at the end. The
+journal is removed once the batch has finished successfully.
+"""
+import os
+import json
+import time
+import logging
+import tempfile
+from cdcagg_client.cache import CacheEntry
+
+
+_logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Journal of completed files of a batch.
+
+    :param str path: Path to the journal file.
+    :param bool resume: Continue from an existing journal. If False,
+                        an existing journal is discarded.
+    :param float interval: Seconds between flushes to disk.
+    """
+
+    def __init__(self, path, resume=False, interval=60):
+        self._path = path
+        self._resume = resume
+        self.interval = interval
+        # Path -> CacheEntry of files completed in an earlier run.
+        self._completed = {}
+        self._file_obj = None
+        self._next_sync = None
+
+    def __len__(self):
+        return len(self._completed)
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            _logger.info("Checkpoint '%s' does not exist. Starting from the beginning.", self._path)
+            return
+        with open(self._path, encoding='utf8') as file_obj:
+            for line in file_obj:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    # Written partially before a crash.
+                    _logger.warning("Ignoring truncated line in checkpoint '%s'", self._path)
+                    break
+                self._completed[item['path']] = CacheEntry(item['mtime_ns'], item['size'],
+                                                           tuple(item['record_ids']), item.get('file_format'))
+        _logger.info("Resuming from checkpoint '%s' with %s completed files", self._path, len(self))
+
+    def open(self):
+        """Open the journal for writing.
+
+        Loads completed files first if resuming.
+        """
+        if self._resume:
+            self._load()
+        # Rewrite the journal atomically, so a truncated line does not end up in the middle.
+        dirname = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.checkpoint-')
+        try:
+            self._file_obj = os.fdopen(fd, 'w', encoding='utf8')
+            for path, entry in self._completed.items():
+                self._write(path, entry)
+            self.sync()
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            self._file_obj.close()
+            self._file_obj = None
+            os.unlink(tmp_path)
+            raise
+
+    def completed(self, path, signature):
+        """Get record IDs of a file completed in an earlier run.
+
+        :param str path: Path to the file.
+        :param tuple signature: Current (mtime_ns, size) of the file.
+        :returns: Cache entry or None if the file has not been
+                  completed or has changed since.
+        :rtype: :obj:`cdcagg_client.cache.CacheEntry` or None
+        """
+        entry = self._completed.get(path)
+        if entry is None or (entry.mtime_ns, entry.size) != tuple(signature):
+            return None
+        return entry
+
+    def _write(self, path, entry):
+        self._file_obj.write(json.dumps({'path': path, 'mtime_ns': entry.mtime_ns, 'size': entry.size,
+                                         'file_format': entry.file_format,
+                                         'record_ids': list(entry.record_ids)}) + '\n')
+
+    def add(self, path, signature, record_ids, file_format=None):
+        """Record a completed file.
+
+        :param str path: Path to the file.
+        :param tuple signature: (mtime_ns, size) of the file.
+        :param record_ids: IDs of the records read from the file.
+        :type record_ids: iterable
+        :param str file_format: Detected format of the file.
+        """
+        mtime_ns, size = signature
+        self._write(path, CacheEntry(mtime_ns, size, tuple(record_ids), file_format))
+        if time.monotonic() >= self._next_sync:
+            self.sync()
+
+    def sync(self):
+        """Flush the journal to disk."""
+        self._file_obj.flush()
+        os.fsync(self._file_obj.fileno())
+        self._next_sync = time.monotonic() + self.interval
+
+    def close(self):
+        """Flush and close the journal. Keeps the file for resuming."""
+        if self._file_obj is None:
+            return
+        self.sync()
+        self._file_obj.close()
+        self._file_obj = None
+
+    def remove(self):
+        """Close and remove the journal once the batch has finished."""
+        if self._file_obj is not None:
+            self._file_obj.close()
+            self._file_obj = None
+        self._completed.clear()
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,299 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Discovery of source files.
+
+:func:`discover_xml_files` searches folders for '.xml'-suffixed files
+like :func:`cdcagg_client.batch.iterate_xml_files`, but lists
+directories and stats files in a thread pool. Directories are listed
+ahead of consumption, and files are yielded lazily in the same order
+:func:`os.walk` with sorted entries would yield them.
+
+A :class:`DirectoryManifest` records the modification time and
+entries of each listed directory. On the next run directories whose
+modification time is unchanged are not listed again. Adding, removing
+or renaming an entry changes the modification time of the directory,
+but modifying a file in place does not, so files are always stat'ed
+and their signatures are compared against the file cache.
+
+Unchanged subtrees are not pruned. A change deep in the tree does not
+change the modification time of the directories above it, so every
+directory is stat'ed and descended into, and only the listing of an
+unchanged directory is reused.
+
+With `archives`, compressed files and archives are discovered too, see
+:mod:`cdcagg_client.archive`. Archives are replaced by their '.xml'
+members and the signatures of the members. Listings record all
+supported names, so a manifest can be shared by runs with and without
+`archives`. The manifest also records the members of each archive
+under the signature of the archive, so an unchanged archive is not
+read again. Listing the members of a compressed tar archive requires
+decompressing all of it.
+"""
+import os
+import json
+import time
+import logging
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from cdcagg_client import archive
+from cdcagg_client.cache import file_signature
+
+
+_logger = logging.getLogger(__name__)
+
+
+#: Directory listing. ``files`` and ``subdirs`` are sorted lists of entry names.
+Listing = namedtuple('Listing', ['mtime_ns', 'files', 'subdirs'])
+
+#: Directories modified this recently are not recorded to the manifest,
+#: since further changes within the timestamp granularity would go unnoticed.
+RACY_INTERVAL_NS = 2 * 10**9
+
+#: Version of the manifest format. Manifests of other versions are ignored.
+MANIFEST_VERSION = 2
+
+
+class DirectoryManifest:
+    """Persistent listings of directories and members of archives keyed by path.
+
+    The manifest is a JSON file that is read by :meth:`load` and
+    atomically replaced by :meth:`save`. Only directories listed or
+    reused since the previous save are saved.
+
+    :param str path: Path to the manifest file.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._previous = {}
+        self._current = {}
+        # Archive path -> [mtime_ns, size, [[member name, mtime_ns, size], ...]]
+        self._previous_archives = {}
+        self._current_archives = {}
+
+    def __len__(self):
+        return len(self._current)
+
+    def get(self, dirpath, mtime_ns):
+        """Get listing recorded on the previous run if directory is unchanged.
+
+        :param str dirpath: Path to the directory.
+        :param int mtime_ns: Current modification time of the directory.
+        :returns: Listing or None.
+        :rtype: :obj:`Listing` or None
+        """
+        listing = self._previous.get(dirpath)
+        if listing is None or listing.mtime_ns != mtime_ns:
+            return None
+        return listing
+
+    def set(self, dirpath, listing):
+        """Record listing of a directory.
+
+        :param str dirpath: Path to the directory.
+        :param listing: Listing of the directory.
+        :type listing: :obj:`Listing`
+        """
+        self._current[dirpath] = listing
+
+    def get_members(self, archive_path, signature):
+        """Get members of an archive recorded on the previous run if archive is unchanged.
+
+        :param str archive_path: Path to the archive.
+        :param tuple signature: Current (mtime_ns, size) of the archive.
+        :returns: Tuples of member path and (mtime_ns, size), or None.
+        :rtype: list or None
+        """
+        entry = self._previous_archives.get(archive_path)
+        if entry is None or (entry[0], entry[1]) != tuple(signature):
+            return None
+        return [(archive.member_path(archive_path, name), (mtime_ns, size)) for name, mtime_ns, size in entry[2]]
+
+    def set_members(self, archive_path, signature, members):
+        """Record members of an archive.
+
+        :param str archive_path: Path to the archive.
+        :param tuple signature: (mtime_ns, size) of the archive.
+        :param list members: Tuples of member path and (mtime_ns, size).
+        """
+        start = len(archive_path) + len(archive.MEMBER_SEPARATOR)
+        self._current_archives[archive_path] = [
+            signature[0], signature[1], [[path[start:], mtime_ns, size] for path, (mtime_ns, size) in members]]
+
+    def load(self):
+        """Load manifest from file if the file exists."""
+        if not os.path.exists(self._path):
+            _logger.info("Directory manifest '%s' does not exist. It will be created.", self._path)
+            return
+        with open(self._path, 'r', encoding='utf8') as file_obj:
+            content = json.load(file_obj)
+        if content.get('version') != MANIFEST_VERSION:
+            _logger.info("Directory manifest '%s' was written by another version. All directories are listed.",
+                         self._path)
+            return
+        self._previous = {dirpath: Listing(*listing) for dirpath, listing in content['directories'].items()}
+        self._previous_archives = content.get('archives', {})
+        _logger.info("Loaded %s directories from manifest '%s'", len(self._previous), self._path)
+
+    def save(self):
+        """Save listings recorded since the previous save to file.
+
+        The saved listings are used by :meth:`get` and
+        :meth:`get_members` from then on, so listings of directories
+        removed since are dropped on each save, for example between
+        passes in watch mode. If no directory was listed since the
+        previous save, as when only changed files are synchronized,
+        the previous listings are kept and the recorded archive members
+        are added to them.
+        """
+        if self._current:
+            directories, archives = self._current, self._current_archives
+        else:
+            directories, archives = self._previous, dict(self._previous_archives, **self._current_archives)
+        dirname = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.manifest-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8') as file_obj:
+                json.dump({'version': MANIFEST_VERSION, 'directories': directories,
+                           'archives': archives}, file_obj, separators=(',', ':'))
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._previous, self._previous_archives = directories, archives
+        self._current, self._current_archives = {}, {}
+        _logger.info("Saved %s directories to manifest '%s'", len(directories), self._path)
+
+
+@contextmanager
+def open_directory_manifest(path):
+    """Context manager that loads a :obj:`DirectoryManifest` and saves it on successful exit.
+
+    :param str path: Path to the manifest file.
+    :returns: Loaded manifest.
+    :rtype: :obj:`DirectoryManifest`
+    """
+    manifest = DirectoryManifest(path)
+    manifest.load()
+    yield manifest
+    manifest.save()
+
+
+def _scan_directory(dirpath, mtime_ns):
+    files, subdirs = [], []
+    with os.scandir(dirpath) as entries:
+        for entry in entries:
+            # Symbolic links to directories are not followed, as in os.walk().
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.name)
+            elif entry.name.endswith(archive.SOURCE_SUFFIXES):
+                files.append(entry.name)
+    return Listing(mtime_ns, sorted(files), sorted(subdirs))
+
+
+def _file_signatures(path, archives, manifest=None):
+    """Get signatures of a file, or of the members of an archive."""
+    if not (archives and archive.is_archive(path)):
+        return [(path, file_signature(path))]
+    signature = file_signature(path)
+    members = None if manifest is None else manifest.get_members(path, signature)
+    if members is None:
+        try:
+            members = list(archive.iterate_members(path))
+        except archive.ArchiveError:
+            _logger.warning("Skipping archive '%s'", path, exc_info=True)
+            return []
+    if manifest is not None and time.time_ns() - signature[0] > RACY_INTERVAL_NS:
+        manifest.set_members(path, signature, members)
+    return members
+
+
+def _list_directory(dirpath, manifest, archives=False):
+    """Runs in a worker thread. Returns (listing, reused, signatures)."""
+    try:
+        mtime_ns = os.stat(dirpath).st_mtime_ns
+        listing = None if manifest is None else manifest.get(dirpath, mtime_ns)
+        reused = listing is not None
+        if listing is None:
+            listing = _scan_directory(dirpath, mtime_ns)
+    except OSError:
+        _logger.warning("Unable to list directory '%s'", dirpath, exc_info=True)
+        return None, False, []
+    suffixes = archive.source_suffixes(archives)
+    signatures = []
+    for filename in listing.files:
+        if not filename.endswith(suffixes):
+            continue
+        path = os.path.join(dirpath, filename)
+        try:
+            signatures.extend(_file_signatures(path, archives, manifest))
+        except FileNotFoundError:
+            # Removed after the directory was listed.
+            continue
+    return listing, reused, signatures
+
+
+def discover_xml_files(paths, workers=1, manifest=None, prefetch=None, archives=False):
+    """Discover XML files and their signatures.
+
+    Paths pointing to files are yielded as is. Folders and their
+    subfolders are searched for '.xml'-suffixed files.
+
+    :param list paths: Paths to files and folders.
+    :param int workers: Number of threads listing directories.
+    :param manifest: Optional manifest of directory listings. Listings
+                     of unchanged directories are reused instead of
+                     listing the directories again.
+    :type manifest: :obj:`DirectoryManifest`
+    :param int prefetch: Maximum number of directories listed ahead of
+                         consumption. Defaults to four per worker.
+    :param bool archives: Also discover compressed files and archives.
+                          Archives, including those given as paths, are
+                          replaced by their members. Archives that cannot
+                          be read are logged and skipped.
+    :returns: Generator yielding tuples of path and (mtime_ns, size).
+    """
+    if prefetch is None:
+        prefetch = workers * 4
+    counts = {'listed': 0, 'reused': 0}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='discovery') as pool:
+        for path in paths:
+            if not os.path.isdir(path):
+                yield from _file_signatures(path, archives, manifest)
+                continue
+            # Stack of [dirpath, future]. The top is consumed next.
+            stack = [[path, None]]
+            try:
+                while stack:
+                    for pending in stack[:-prefetch - 1:-1]:
+                        if pending[1] is None:
+                            pending[1] = pool.submit(_list_directory, pending[0], manifest, archives)
+                    dirpath, future = stack.pop()
+                    listing, reused, signatures = future.result()
+                    if listing is None:
+                        continue
+                    counts['reused' if reused else 'listed'] += 1
+                    if manifest is not None and time.time_ns() - listing.mtime_ns > RACY_INTERVAL_NS:
+                        manifest.set(dirpath, listing)
+                    stack.extend([os.path.join(dirpath, subdir), None]
+                                 for subdir in reversed(listing.subdirs))
+                    yield from signatures
+            finally:
+                for _, future in stack:
+                    if future is not None:
+                        future.cancel()
+    _logger.info('Discovery listed %s directories and reused %s listings from manifest',
+                 counts['listed'], counts['reused'])
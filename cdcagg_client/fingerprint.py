@@ -0,0 +1,162 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content fingerprints of records.
+
+A fingerprint is a SHA-256 hexdigest computed from a canonical JSON
+serialization of the record content. Provenance, metadata and ID are
+left out, so two records get the same fingerprint if and only if
+:meth:`cdcagg_client.methods.StudyMethods.update_record` would consider
+them equal.
+
+Fingerprints of records stored to DocStore are persisted between runs
+in a :class:`FingerprintStore`. The store assumes this client is the
+only writer of the records it knows about. If records are modified by
+other means, the store should be removed.
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+
+
+_logger = logging.getLogger(__name__)
+
+
+def dict_fingerprint(record_dict):
+    """Compute fingerprint of an exported record dictionary.
+
+    :param dict record_dict: Record exported to dictionary.
+    :returns: Fingerprint
+    :rtype: str
+    """
+    payload = json.dumps(record_dict, sort_keys=True, separators=(',', ':'),
+                         ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+
+def export_content_dict(record):
+    """Export record content without provenance, metadata or ID.
+
+    :param record: Record to export.
+    :type record: :obj:`cdcagg_common.records.Study`
+    :returns: Exported record content.
+    :rtype: dict
+    """
+    return record.export_dict(include_provenance=False, include_metadata=False, include_id=False)
+
+
+def record_fingerprint(record):
+    """Compute fingerprint of a record.
+
+    :param record: Record to fingerprint.
+    :type record: :obj:`cdcagg_common.records.Study`
+    :returns: Fingerprint
+    :rtype: str
+    """
+    return dict_fingerprint(export_content_dict(record))
+
+
+class FingerprintStore:
+    """Persistent mapping of record IDs to content fingerprints.
+
+    The store is a JSON file that is read by :meth:`load` and
+    atomically replaced by :meth:`save`.
+
+    :param str path: Path to the store file.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._fingerprints = {}
+        self._changed = False
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+    def __contains__(self, record_id):
+        return record_id in self._fingerprints
+
+    def get(self, record_id):
+        """Get fingerprint of a record.
+
+        :param str record_id: ID of the record.
+        :returns: Fingerprint or None if not known.
+        :rtype: str or None
+        """
+        return self._fingerprints.get(record_id)
+
+    def set(self, record_id, fingerprint):
+        """Set fingerprint of a record.
+
+        :param str record_id: ID of the record.
+        :param str fingerprint: Fingerprint of record content.
+        """
+        if self._fingerprints.get(record_id) != fingerprint:
+            self._fingerprints[record_id] = fingerprint
+            self._changed = True
+
+    def discard(self, record_id):
+        """Remove fingerprint of a record if it exists.
+
+        :param str record_id: ID of the record.
+        """
+        if self._fingerprints.pop(record_id, None) is not None:
+            self._changed = True
+
+    def load(self):
+        """Load fingerprints from file if the file exists."""
+        if not os.path.exists(self._path):
+            _logger.info("Fingerprint store '%s' does not exist. It will be created.", self._path)
+            return
+        with open(self._path, 'r', encoding='utf8') as file_obj:
+            self._fingerprints = json.load(file_obj)
+        self._changed = False
+        _logger.info("Loaded %s fingerprints from '%s'", len(self), self._path)
+
+    def save(self):
+        """Save fingerprints to file if they have changed."""
+        if not self._changed:
+            return
+        dirname = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.fingerprints-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8') as file_obj:
+                json.dump(self._fingerprints, file_obj, separators=(',', ':'))
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._changed = False
+        _logger.info("Saved %s fingerprints to '%s'", len(self), self._path)
+
+
+@contextmanager
+def open_fingerprint_store(path):
+    """Context manager that loads a :obj:`FingerprintStore` and saves it on exit.
+
+    The store is saved even if an exception is raised, since it
+    only contains fingerprints of records that were successfully
+    stored to DocStore.
+
+    :param str path: Path to the store file.
+    :returns: Loaded store.
+    :rtype: :obj:`FingerprintStore`
+    """
+    store = FingerprintStore(path)
+    store.load()
+    try:
+        yield store
+    finally:
+        store.save()
@@ -0,0 +1,335 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Configuration of the HTTP client used for DocStore requests.
+
+All DocStore requests, including those sent by :mod:`kuha_client` and
+:mod:`kuha_common`, go through :class:`tornado.httpclient.AsyncHTTPClient`.
+:func:`configure` selects its implementation for the whole process:
+
+- :data:`CLIENT_SIMPLE` is the default tornado client. It opens a new
+  connection for each request.
+- :data:`CLIENT_CURL` uses libcurl through pycurl, which is installed
+  with the ``curl`` extra of the package. Each of the `max_clients` curl handles keeps
+  its connection alive and reuses it for later requests, so the
+  connections form a pool of `max_clients` connections.
+
+`max_clients` limits the number of requests in flight. Further
+requests are queued by the client.
+
+Both clients ask for gzip-compressed responses and decompress them.
+With `gzip_requests`, request bodies of at least :data:`GZIP_MIN_SIZE`
+bytes are sent compressed with ``Content-Encoding: gzip``. DocStore
+must accept compressed requests, for example by running its tornado
+server with ``decompress_request=True``.
+
+Requests that time out, fail to connect or are answered with 429 or a
+5xx server error are considered signs of overload. Idempotent requests
+are retried up to `max_retries` times after a randomized exponential
+backoff. These are GET, PUT and DELETE requests and DocStore queries.
+Creates are never retried, since they may have been carried out
+although the response was lost.
+
+With `adaptive`, an :class:`AdaptiveLimiter` adjusts the number of
+requests in flight between one and `max_clients` by additive increase
+and multiplicative decrease (AIMD). Further requests wait for the
+limiter, which slows down the callers.
+"""
+import gzip
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+from tornado.httputil import HTTPHeaders
+from tornado.iostream import StreamClosedError
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+from cdcagg_client import stats
+
+
+_logger = logging.getLogger(__name__)
+
+
+#: Default tornado client.
+CLIENT_SIMPLE = 'simple'
+#: libcurl client with keep-alive connections. Requires pycurl.
+CLIENT_CURL = 'curl'
+#: Available clients.
+CLIENTS = (CLIENT_SIMPLE, CLIENT_CURL)
+
+#: Request bodies smaller than this are not compressed.
+GZIP_MIN_SIZE = 1024
+#: Compression level of request bodies.
+GZIP_LEVEL = 6
+
+#: Methods that can be retried safely.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+#: POST requests to URLs containing one of these are read-only queries.
+QUERY_PATHS = ('/query/',)
+#: Response codes that do not tell of overload, although they are server errors.
+NOT_OVERLOAD_CODES = (501, 505)
+
+
+def is_idempotent(request):
+    """Return True if request can be retried safely.
+
+    :param request: Request.
+    :type request: :obj:`tornado.httpclient.HTTPRequest`
+    :rtype: bool
+    """
+    if request.method in IDEMPOTENT_METHODS:
+        return True
+    return request.method == 'POST' and any(path in request.url for path in QUERY_PATHS)
+
+
+def is_overload(code):
+    """Return True if response code tells that the server is overloaded.
+
+    :param int code: Response code. 599 stands for timeouts and
+                     connection errors.
+    :rtype: bool
+    """
+    return code == 429 or (500 <= code <= 599 and code not in NOT_OVERLOAD_CODES)
+
+
+class AdaptiveLimiter:
+    """Limit of requests in flight adjusted by AIMD.
+
+    The limit starts at `minimum` and grows by one for each successful
+    request until the first sign of overload. From then on it grows by
+    ``1 / limit`` for each successful request, which is one per round
+    trip of a full window. On overload the limit is multiplied by
+    `decrease_factor`, at most once per smoothed latency, so a burst of
+    failures of the same window counts once.
+
+    A request is considered a sign of overload if it failed, or if the
+    smoothed latency of recent requests exceeds `latency_tolerance`
+    times the long-term smoothed latency.
+
+    :param int maximum: Maximum limit.
+    :param int minimum: Minimum limit.
+    :param float decrease_factor: Factor the limit is multiplied with on overload.
+    :param float latency_tolerance: Allowed growth of latency before decreasing.
+    """
+
+    #: Smoothing factor of the latency of recent requests.
+    short_alpha = 0.2
+    #: Smoothing factor of the long-term latency.
+    long_alpha = 0.01
+
+    def __init__(self, maximum, minimum=1, decrease_factor=0.5, latency_tolerance=3.0):
+        if not 1 <= minimum <= maximum:
+            raise ValueError('Limits must satisfy 1 <= minimum <= maximum, got %r and %r' % (minimum, maximum))
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.limit = float(minimum)
+        self.in_flight = 0
+        self._slow_start = True
+        self._short_latency = None
+        self._long_latency = None
+        self._last_decrease = None
+        self._waiters = deque()
+
+    async def acquire(self):
+        """Wait for a free slot and take it."""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    # Woken up but cancelled. Pass the free slot on.
+                    self._wake()
+                raise
+        self.in_flight += 1
+
+    def release(self):
+        """Free a slot taken by :meth:`acquire`."""
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def _smooth(self, latency):
+        if self._short_latency is None:
+            self._short_latency = self._long_latency = latency
+            return
+        self._short_latency += self.short_alpha * (latency - self._short_latency)
+        self._long_latency += self.long_alpha * (latency - self._long_latency)
+
+    def succeeded(self, latency):
+        """Record a successful request.
+
+        :param float latency: Seconds the request took.
+        """
+        self._smooth(latency)
+        if self._short_latency > self._long_latency * self.latency_tolerance:
+            self._decrease()
+            return
+        self.limit = min(self.maximum, self.limit + (1 if self._slow_start else 1 / self.limit))
+        self._wake()
+
+    def failed(self):
+        """Record a request that failed due to overload."""
+        self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if self._last_decrease is not None and now - self._last_decrease < (self._short_latency or 0):
+            return
+        self._last_decrease = now
+        self._slow_start = False
+        self.limit = max(self.minimum, self.limit * self.decrease_factor)
+        stats.current().increment('rate_decreases')
+        _logger.info('Decreased Document Store requests in flight to %s', int(self.limit))
+
+
+class GzipRequestsMixin:
+    """Compress request bodies of an :class:`AsyncHTTPClient` with gzip.
+
+    Mix in before the client implementation.
+    """
+
+    def initialize(self, gzip_min_size=GZIP_MIN_SIZE, **kwargs):  # pylint: disable=arguments-differ
+        super().initialize(**kwargs)
+        self.gzip_min_size = gzip_min_size
+
+    def fetch_impl(self, request, callback):
+        body = request.body
+        if body is not None and len(body) >= self.gzip_min_size and 'Content-Encoding' not in request.headers:
+            compressed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            stats.current().increment('gzip_request_bytes_saved', len(body) - len(compressed))
+            # The request is a proxy of the caller's request. Set attributes
+            # on the proxy, so the caller's request is left intact for retries.
+            headers = HTTPHeaders(request.headers)
+            headers['Content-Encoding'] = 'gzip'
+            request.headers = headers
+            request.body = compressed
+        super().fetch_impl(request, callback)
+
+
+class AdaptiveMixin:
+    """Retry requests and limit requests in flight of an :class:`AsyncHTTPClient`.
+
+    Mix in before the client implementation.
+    """
+
+    #: Backoff before the first retry in seconds. Doubled for each retry.
+    retry_backoff = 0.1
+    #: Maximum backoff in seconds.
+    max_retry_backoff = 10.0
+
+    def initialize(self, max_clients=10, max_retries=0, adaptive=False, **kwargs):  # pylint: disable=arguments-differ
+        super().initialize(max_clients=max_clients, **kwargs)
+        self.max_retries = max_retries
+        self.limiter = AdaptiveLimiter(max_clients) if adaptive else None
+
+    def fetch(self, request, raise_error=True, **kwargs):
+        if not isinstance(request, HTTPRequest):
+            request = HTTPRequest(url=request, **kwargs)
+        elif kwargs:
+            raise ValueError("kwargs can't be used if request is an HTTPRequest object")
+        return asyncio.ensure_future(self._fetch_retrying(request, raise_error))
+
+    def _backoff(self, attempt):
+        # Full jitter spreads the retries of concurrent requests.
+        return random.uniform(0, min(self.max_retry_backoff, self.retry_backoff * 2 ** (attempt - 1)))
+
+    async def _fetch_once(self, request):
+        """Fetch once. Returns (response, error, latency)."""
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        started = time.monotonic()
+        try:
+            return await super().fetch(request, raise_error=False), None, time.monotonic() - started
+        except (HTTPClientError, OSError, StreamClosedError) as exc:
+            return None, exc, time.monotonic() - started
+        finally:
+            if self.limiter is not None:
+                self.limiter.release()
+
+    async def _fetch_retrying(self, request, raise_error):
+        attempt = 0
+        while True:
+            response, error, latency = await self._fetch_once(request)
+            code = response.code if response is not None else getattr(error, 'code', 599)
+            if not is_overload(code):
+                if self.limiter is not None:
+                    self.limiter.succeeded(latency)
+                break
+            if self.limiter is not None:
+                self.limiter.failed()
+            if attempt >= self.max_retries or not is_idempotent(request):
+                break
+            attempt += 1
+            delay = self._backoff(attempt)
+            stats.current().increment('request_retries')
+            _logger.warning('%s %s failed with %s. Retrying in %.2f seconds (%s of %s).', request.method,
+                            request.url, error or code, delay, attempt, self.max_retries)
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        if raise_error and response.error:
+            raise response.error
+        return response
+
+
+def _client_class(client):
+    if client == CLIENT_SIMPLE:
+        return SimpleAsyncHTTPClient
+    if client == CLIENT_CURL:
+        try:
+            from tornado.curl_httpclient import CurlAsyncHTTPClient  # pylint: disable=import-outside-toplevel
+        except ImportError as exc:
+            raise ImportError("HTTP client '%s' requires pycurl. Install it with the 'curl' extra: "
+                              "pip install 'cdcagg_client[curl]'" % (client,)) from exc
+        return CurlAsyncHTTPClient
+    raise ValueError('Unknown HTTP client %r' % (client,))
+
+
+def configure(client=CLIENT_SIMPLE, max_clients=10, gzip_requests=False, max_retries=0, adaptive=False):
+    """Configure :class:`AsyncHTTPClient` for the process.
+
+    Must be called before the client is first used in an event loop.
+
+    :param str client: One of :data:`CLIENTS`.
+    :param int max_clients: Maximum number of requests in flight, and
+                            the size of the connection pool of
+                            :data:`CLIENT_CURL`.
+    :param bool gzip_requests: Send request bodies compressed.
+    :param int max_retries: Maximum number of retries of idempotent requests.
+    :param bool adaptive: Adjust the number of requests in flight by AIMD.
+    """
+    if max_clients < 1:
+        raise ValueError('max_clients must be a positive integer, got %r' % (max_clients,))
+    if max_retries < 0:
+        raise ValueError('max_retries must not be negative, got %r' % (max_retries,))
+    impl = _client_class(client)
+    kwargs = {'max_clients': max_clients}
+    if max_retries or adaptive:
+        impl = type('Adaptive' + impl.__name__, (AdaptiveMixin, impl), {})
+        kwargs.update(max_retries=max_retries, adaptive=adaptive)
+    if gzip_requests:
+        impl = type('Gzip' + impl.__name__, (GzipRequestsMixin, impl), {})
+    AsyncHTTPClient.configure(impl, **kwargs)
@@ -0,0 +1,157 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compact set of record IDs.
+
+DocStore record IDs are MongoDB ObjectIds, which are 12 bytes long
+and serialized as 24 hexadecimal characters. :class:`CompactIdSet`
+stores them as sorted fixed-width binary values in a single
+:obj:`bytearray` and keeps a bitmap of discarded IDs. This takes
+about 12 bytes per ID instead of the hundred or so bytes a :obj:`str`
+in a :obj:`set` takes.
+
+The set is meant for the removal of absent records: it is filled with
+the IDs of existing records, IDs seen during the batch are discarded,
+and the remaining IDs are the ones to remove.
+"""
+import logging
+
+
+_logger = logging.getLogger(__name__)
+
+
+#: Width of a binary ObjectId in bytes.
+OBJECTID_WIDTH = 12
+
+
+def _objectid_bytes(record_id):
+    if not isinstance(record_id, str) or len(record_id) != OBJECTID_WIDTH * 2:
+        return None
+    try:
+        return bytes.fromhex(record_id)
+    except ValueError:
+        return None
+
+
+class CompactIdSet:
+    """Memory efficient set of record IDs supporting add, discard and iteration.
+
+    IDs are expected to be added in ascending order, which is the order
+    DocStore returns them when sorted by ID. IDs added out of order are
+    sorted on first lookup. IDs that are not ObjectIds are kept in a
+    regular :obj:`set`.
+
+    :param iterable record_ids: Optional initial IDs.
+    """
+
+    def __init__(self, record_ids=()):
+        self._buffer = bytearray()
+        self._discarded = bytearray()
+        self._size = 0
+        self._discarded_count = 0
+        self._last = b''
+        self._sorted = True
+        self._others = set()
+        for record_id in record_ids:
+            self.add(record_id)
+
+    def __len__(self):
+        if not self._sorted:
+            self._sort()
+        return self._size - self._discarded_count + len(self._others)
+
+    def __contains__(self, record_id):
+        raw = _objectid_bytes(record_id)
+        if raw is None:
+            return record_id in self._others
+        position = self._find(raw)
+        return position is not None and not self._is_discarded(position)
+
+    def __iter__(self):
+        if not self._sorted:
+            self._sort()
+        for position in range(self._size):
+            if not self._is_discarded(position):
+                yield self._item(position).hex()
+        yield from self._others
+
+    @property
+    def nbytes(self):
+        """Approximate memory used for storing ObjectIds in bytes."""
+        return len(self._buffer) + len(self._discarded)
+
+    def _item(self, position):
+        start = position * OBJECTID_WIDTH
+        return bytes(self._buffer[start:start + OBJECTID_WIDTH])
+
+    def _is_discarded(self, position):
+        return self._discarded[position >> 3] & (1 << (position & 7)) != 0
+
+    def _sort(self):
+        _logger.debug('Sorting %s IDs added out of order', self._size)
+        items = sorted(set(self._item(position) for position in range(self._size)
+                           if not self._is_discarded(position)))
+        self._buffer = bytearray(b''.join(items))
+        self._size = len(items)
+        self._discarded = bytearray((self._size + 7) >> 3)
+        self._discarded_count = 0
+        self._last = items[-1] if items else b''
+        self._sorted = True
+
+    def _find(self, raw):
+        if not self._sorted:
+            self._sort()
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) >> 1
+            item = self._item(middle)
+            if item < raw:
+                low = middle + 1
+            elif item > raw:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def add(self, record_id):
+        """Add record ID.
+
+        :param str record_id: ID to add.
+        """
+        raw = _objectid_bytes(record_id)
+        if raw is None:
+            self._others.add(record_id)
+            return
+        if raw == self._last:
+            return
+        if raw < self._last:
+            self._sorted = False
+        if self._size & 7 == 0:
+            self._discarded.append(0)
+        self._buffer.extend(raw)
+        self._size += 1
+        self._last = max(raw, self._last)
+
+    def discard(self, record_id):
+        """Discard record ID if it is in the set.
+
+        :param str record_id: ID to discard.
+        """
+        raw = _objectid_bytes(record_id)
+        if raw is None:
+            self._others.discard(record_id)
+            return
+        position = self._find(raw)
+        if position is None or self._is_discarded(position):
+            return
+        self._discarded[position >> 3] |= 1 << (position & 7)
+        self._discarded_count += 1
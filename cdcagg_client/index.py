@@ -0,0 +1,184 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-memory index of Study provenance keys.
+
+A provenance key is the ``(base_url, identifier)`` pair of a single
+provenance item. Records sharing a provenance key are considered to
+be the same record (see :mod:`cdcagg_client.methods`). The index maps
+each known provenance key to the ID and content fingerprint of the
+DocStore record it belongs to. This allows
+:meth:`cdcagg_client.methods.StudyMethods.query_record` to resolve
+records without querying DocStore for every provenance item.
+"""
+import logging
+from collections import namedtuple
+from kuha_common.query import QueryController
+from kuha_common.document_store.constants import REC_STATUS_DELETED
+from cdcagg_common.records import Study
+from cdcagg_client import stats
+
+
+_logger = logging.getLogger(__name__)
+
+
+#: Value stored in the index. ``record_id`` is None for records created
+#: during the current run whose DocStore ID is not known yet.
+IndexEntry = namedtuple('IndexEntry', ['record_id', 'fingerprint'])
+
+
+def provenance_keys(record):
+    """Get provenance keys of a record in provenance order.
+
+    :param record: Record to get keys from.
+    :type record: :obj:`cdcagg_common.records.Study`
+    :returns: List of (base_url, identifier) tuples.
+    :rtype: list
+    """
+    return [(prov.attr_base_url.get_value(), prov.attr_identifier.get_value())
+            for prov in record._provenance]
+
+
+async def iterate_record_pages(page_size, _filter=None, **query_kwargs):
+    """Query Study records in pages sorted by ID.
+
+    Pages are selected by ID range rather than by skipping records,
+    so DocStore does not scan the records of earlier pages again for
+    every page. Each query after the first asks for records with an
+    ID at least the last ID seen, and the repeated record is dropped.
+
+    :param int page_size: Number of records per query.
+    :param dict _filter: Query filter. Combined with the ID range.
+    :param query_kwargs: Keyword arguments passed to
+                         :meth:`kuha_common.query.QueryController.query_multiple`.
+    :returns: Async generator yielding lists of records.
+    """
+    last_id = None
+    while True:
+        page = []
+        page_filter = dict(_filter or {})
+        limit = page_size
+        if last_id is not None:
+            page_filter[Study._id] = {QueryController.fk_constants.from_: last_id}
+            # The range includes the last record of the previous page.
+            limit += 1
+
+        if page_filter:
+            query_kwargs['_filter'] = page_filter
+
+        async def _on_record(record, _page=page):
+            _page.append(record)
+
+        with stats.current().request('query'):
+            await QueryController().query_multiple(Study, _on_record, sort_by=Study._id,
+                                                   limit=limit, **query_kwargs)
+        received = len(page)
+        if page and last_id is not None and page[0].get_id() == last_id:
+            del page[0]
+        if page:
+            yield page
+            last_id = page[-1].get_id()
+        if received < limit:
+            break
+
+
+class ProvenanceIndex:
+    """Map provenance keys to DocStore records.
+
+    Load the index from DocStore with :meth:`load` and keep it
+    up-to-date by calling :meth:`add_record` after records get
+    created or updated.
+
+    :param int page_size: Number of records to request per query when loading.
+    """
+
+    page_size = 1000
+
+    def __init__(self, page_size=None):
+        if page_size is not None:
+            self.page_size = page_size
+        self._entries = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def add(self, key, record_id, fingerprint=None):
+        """Add or replace single provenance key.
+
+        :param tuple key: (base_url, identifier)
+        :param str or None record_id: ID of the DocStore record.
+        :param str or None fingerprint: Content fingerprint of the record.
+        """
+        self._entries[key] = IndexEntry(record_id, fingerprint)
+
+    def add_record(self, record, record_id, fingerprint=None):
+        """Add all provenance keys of a record.
+
+        :param record: Record to add.
+        :type record: :obj:`cdcagg_common.records.Study`
+        :param str or None record_id: ID of the DocStore record.
+        :param str or None fingerprint: Content fingerprint of the record.
+        """
+        # Keys of a record share a single entry.
+        entry = IndexEntry(record_id, fingerprint)
+        for key in provenance_keys(record):
+            self._entries[key] = entry
+
+    def lookup(self, record):
+        """Lookup entry for record.
+
+        Provenance items are looked up in order and the entry of
+        the first matching provenance key is returned.
+
+        :param record: Record to lookup.
+        :type record: :obj:`cdcagg_common.records.Study`
+        :returns: Matching entry or None.
+        :rtype: :obj:`IndexEntry` or None
+        """
+        for key in provenance_keys(record):
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+        return None
+
+    async def load(self, fingerprints=None):
+        """Load index from DocStore.
+
+        Query only IDs, provenance and metadata of all records,
+        including deleted ones, using paged queries. Fingerprints of
+        records that are not deleted are looked up from `fingerprints`.
+        Deleted records never get a fingerprint, since they must be
+        updated even if their content is unchanged.
+
+        :param fingerprints: Optional store of known fingerprints.
+        :type fingerprints: :obj:`cdcagg_client.fingerprint.FingerprintStore`
+        """
+        count = 0
+        async for page in iterate_record_pages(self.page_size,
+                                               fields=[Study._id, Study._provenance, Study._metadata]):
+            count += len(page)
+            for record in page:
+                record_id = record.get_id()
+                fingerprint = None
+                if fingerprints is not None and \
+                   record._metadata.attr_status.get_value() != REC_STATUS_DELETED:
+                    fingerprint = fingerprints.get(record_id)
+                entry = IndexEntry(record_id, fingerprint)
+                for key in provenance_keys(record):
+                    # Keep the first record if multiple records share a key.
+                    self._entries.setdefault(key, entry)
+        self.loaded = True
+        _logger.info('Loaded %s provenance keys of %s records to index', len(self), count)
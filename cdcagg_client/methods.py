@@ -0,0 +1,376 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Document Store collection methods for studies.
+
+Records are deduplicated based on provenance information. If two
+records share the same baseUrl + identifier combination in one of
+their provenance items, they are considered to be the same record. In
+that case the new record always overwrites the old one. Records
+coalesced by :class:`cdcagg_client.batch.BatchDeduplicator` are not
+passed to these methods at all.
+
+These classes are kept apart from :mod:`cdcagg_client.sync`, which
+imports this module only when the program is run, since importing
+Kuha Client and the record classes is slow.
+"""
+import asyncio
+import logging
+from kuha_common.query import QueryController
+from kuha_common.document_store.constants import REC_STATUS_DELETED
+import kuha_client
+from cdcagg_common.records import Study
+from cdcagg_client import (
+    batch,
+    profiling,
+    stats
+)
+from cdcagg_client.idset import CompactIdSet
+from cdcagg_client.index import (
+    ProvenanceIndex,
+    iterate_record_pages,
+    provenance_keys
+)
+from cdcagg_client.fingerprint import (
+    dict_fingerprint,
+    export_content_dict,
+    record_fingerprint
+)
+
+
+_logger = logging.getLogger(__name__)
+#: Key of the affected record ID in Document Store responses.
+DS_RESPONSE_AFFECTED_RESOURCE = 'affected_resource'
+
+
+class StudyMethods(kuha_client.CollectionMethods):
+    """Implement StudyMethods subclass of CollectionMethods
+
+    Implement methods :meth:`query_record` and :meth:`query_distinct_ids` that
+    are abstract in base class.
+    Override method :meth:`update_record` to correctly handle provenance info.
+
+    If :attr:`preload_index` is True, a :obj:`ProvenanceIndex` is loaded
+    on first call to :meth:`query_record` and used to resolve records
+    for the rest of the run.
+
+    If :attr:`fingerprints` is set, content fingerprints of stored
+    records are kept in it. Records whose fingerprint matches the
+    stored one are not compared field by field. Together with the
+    provenance index, unchanged records are skipped without querying
+    them from Document Store at all.
+    """
+
+    collection = Study.get_collection()
+    #: Resolve records by using a preloaded :obj:`ProvenanceIndex`.
+    preload_index = False
+    #: :obj:`cdcagg_client.fingerprint.FingerprintStore` or None.
+    fingerprints = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._index = ProvenanceIndex() if self.preload_index else None
+        self._index_lock = None
+        # Record ID -> fingerprint of records found unchanged by query_record.
+        self._unchanged = {}
+        # IDs of records deleted during the run.
+        self._deleted = set()
+
+    async def _get_index(self):
+        if self._index is None:
+            return None
+        if self._index.loaded is False:
+            if self._index_lock is None:
+                self._index_lock = asyncio.Lock()
+            async with self._index_lock:
+                if self._index.loaded is False:
+                    with stats.current().stage('index_load'):
+                        await self._index.load(fingerprints=self.fingerprints)
+        return self._index
+
+    def _remember(self, record, record_id, fingerprint):
+        self._deleted.discard(record_id)
+        if self._index is not None:
+            self._index.add_record(record, record_id, fingerprint)
+        if self.fingerprints is not None and record_id is not None:
+            self.fingerprints.set(record_id, fingerprint)
+
+    async def _query_record_from_index(self, index, record):
+        entry = index.lookup(record)
+        if entry is None:
+            return None
+        if entry.record_id is None:
+            # Created during this run. ID is resolved from DocStore.
+            return await self._query_record_by_provenance(record)
+        if entry.fingerprint is not None and entry.record_id not in self._deleted:
+            fingerprint = record_fingerprint(record)
+            if fingerprint == entry.fingerprint:
+                # Content is unchanged. Skip downloading the old record
+                # and let update_record() know about it.
+                unchanged = Study()
+                unchanged._id.set_value(entry.record_id)
+                self._unchanged[entry.record_id] = fingerprint
+                return unchanged
+        with stats.current().request('query'):
+            return await QueryController().query_single(Study, _filter={Study._id: entry.record_id})
+
+    @staticmethod
+    def _provenance_filter(base_url, identifier):
+        # This query uses elemMatch to make sure the identifier and base_url are
+        # within the same provenance item. Direct attribute here is not needed
+        # since we're interested in indirect records as well.
+        return {Study._provenance: {
+            QueryController.fk_constants.elem_match: {
+                Study._provenance.attr_base_url: base_url,
+                Study._provenance.attr_identifier: identifier}}}
+
+    async def _query_single_by_provenance(self, key):
+        with stats.current().request('query'):
+            return await QueryController().query_single(Study, _filter=self._provenance_filter(*key))
+
+    @staticmethod
+    def _provenance_keys_filter(keys):
+        # Matches records that have a provenance item with any of the
+        # base_urls and any of the identifiers. The result may contain
+        # combinations that are not in keys.
+        base_urls = list(dict.fromkeys(base_url for base_url, _ in keys))
+        identifiers = list(dict.fromkeys(identifier for _, identifier in keys))
+        return {Study._provenance: {
+            QueryController.fk_constants.elem_match: {
+                Study._provenance.attr_base_url: {QueryController.fk_constants.in_: base_urls},
+                Study._provenance.attr_identifier: {QueryController.fk_constants.in_: identifiers}}}}
+
+    async def _query_record_by_provenance(self, record):
+        keys = provenance_keys(record)
+        if not keys:
+            return None
+        if len(keys) == 1:
+            return await self._query_single_by_provenance(keys[0])
+        # Query all provenance items with a single query and prefer
+        # the match for the earliest provenance item.
+        candidates = []
+
+        async def _on_record(rec):
+            candidates.append(rec)
+
+        with stats.current().request('query'):
+            await QueryController().query_multiple(Study, _on_record, _filter=self._provenance_keys_filter(keys))
+        for key in keys:
+            for candidate in candidates:
+                if key in provenance_keys(candidate):
+                    return candidate
+        return None
+
+    @profiling.timed('query_record')
+    async def query_record(self, record):
+        """Query record from Document Store.
+
+        This method is called from upsert() method. If this method
+        returns None, then the upsert() will never call
+        update_record(), but will call create_record() instead.
+
+        This query uses elemMatch to look for the identifier and
+        base_url from within the same provenance item. All provenance
+        items of `record` are queried with a single query for a
+        record with matching provenance base_url + identifier
+        combination. If multiple records match, the one matching
+        the earliest provenance item of `record` is returned.
+
+        If provenance index is in use, the index is consulted
+        first and the record is queried by its ID only if the
+        index contains a matching provenance key.
+
+        :param record: Study to query for.
+        :type record: :obj:`cdcagg_common.records.Study`
+        :returns: Result of the query.
+        :rtype: Instance of Study or None.
+        """
+        index = await self._get_index()
+        with stats.current().stage('query_record'):
+            if index is not None:
+                return await self._query_record_from_index(index, record)
+            return await self._query_record_by_provenance(record)
+
+    def forget_record(self, record_id):
+        """Forget content fingerprint of a deleted record.
+
+        Called after the record has been deleted, so that it gets
+        updated even if its content is unchanged when it is found
+        again.
+
+        :param str record_id: ID of the deleted record.
+        """
+        if self._index is not None:
+            self._deleted.add(record_id)
+        if self.fingerprints is not None:
+            self.fingerprints.discard(record_id)
+
+    @staticmethod
+    def _existing_filter(base_url=None):
+        _filter = {Study._metadata.attr_status: {QueryController.fk_constants.not_equal: REC_STATUS_DELETED}}
+        if base_url is not None:
+            _filter[Study._provenance.attr_base_url] = base_url
+        return _filter
+
+    async def query_distinct_ids(self, base_url=None):
+        """Query distinct IDs from collection that are not deleted.
+
+        :param str base_url: Only query records with a provenance
+                             item of this base URL.
+        :returns: Distinct ids
+        :rtype: set
+        """
+        with stats.current().request('query'):
+            ids = await QueryController().query_distinct(
+                Study, fieldname=Study._id, _filter=self._existing_filter(base_url))
+        return set(ids[Study._id.path])
+
+    async def query_distinct_id_set(self, page_size, base_url=None):
+        """Query distinct IDs from collection that are not deleted using paged queries.
+
+        Unlike :meth:`query_distinct_ids`, IDs are streamed in
+        pages and stored compactly, so memory use stays low with
+        large collections.
+
+        :param int page_size: Number of IDs to query per page.
+        :param str base_url: Only query records with a provenance
+                             item of this base URL.
+        :returns: Distinct ids
+        :rtype: :obj:`cdcagg_client.idset.CompactIdSet`
+        """
+        ids = CompactIdSet()
+        async for page in iterate_record_pages(page_size, fields=[Study._id],
+                                               _filter=self._existing_filter(base_url)):
+            for record in page:
+                ids.add(record.get_id())
+        _logger.info('Queried %s distinct IDs using %s bytes', len(ids), ids.nbytes)
+        return ids
+
+    @profiling.timed('send_create')
+    async def _send_create(self, document):
+        with stats.current().request('create'):
+            return await kuha_client.send_create_record_request(self.collection, document)
+
+    @profiling.timed('send_update')
+    async def _send_update(self, collection, document, record_id):
+        with stats.current().request('update'):
+            return await kuha_client.send_update_record_request(collection, document, record_id)
+
+    @profiling.timed('create_record')
+    async def create_record(self, record):
+        """Create new Document Store record.
+
+        Extend :meth:`kuha_client.CollectionMethods.create_record`
+        to keep the provenance index up-to-date.
+
+        :param record: Record to create.
+        :type record: :obj:`cdcagg_common.records.Study`
+        """
+        with stats.current().request('create'):
+            rval = await super().create_record(record)
+        stats.current().increment('created')
+        if self._index is not None:
+            self._remember(record, None, record_fingerprint(record))
+        return rval
+
+    async def upsert_record(self, record, old):
+        """Create or update record.
+
+        Used by :class:`cdcagg_client.batch.BatchProcessor`, which
+        queries the old record with :meth:`query_record` and passes
+        it here. Unlike :meth:`create_record`, the ID of a created
+        record is read from the Document Store response, so the ID is
+        known for every upserted record.
+
+        :param record: Record to upsert.
+        :type record: :obj:`cdcagg_common.records.Study`
+        :param old: Result of :meth:`query_record` for `record`.
+        :type old: :obj:`cdcagg_common.records.Study` or None
+        :returns: Record ID and outcome.
+        :rtype: tuple
+        """
+        if old is not None:
+            updated = await self.update_record(record, old)
+            return old.get_id(), batch.UPSERT_UPDATED if updated else batch.UPSERT_UNCHANGED
+        response = await self._send_create(record.export_dict(include_metadata=False, include_id=False))
+        stats.current().increment('created')
+        record_id = response[DS_RESPONSE_AFFECTED_RESOURCE]
+        if self._index is not None or self.fingerprints is not None:
+            self._remember(record, record_id, record_fingerprint(record))
+        return record_id, batch.UPSERT_CREATED
+
+    @profiling.timed('update_record')
+    async def update_record(self, new, old):
+        """Update existing Document Store record.
+
+        Override :meth:`kuha_client.CollectionMethods.update_record`
+        to handle provenance data correctly.
+
+        If the content fingerprint of `new` matches the stored
+        fingerprint of `old`, the records are considered equal
+        without exporting `old`.
+
+        :param new: New record.
+        :type new: :obj:`cdcagg_common.records.Study`
+        :param old: Old record.
+        :type old: :obj:`cdcagg_common.records.Study`
+        :returns: False if record does not need updating.
+        :rtype: bool
+        """
+        old_id = old.get_id()
+        if old_id in self._unchanged:
+            # query_record() found the content unchanged.
+            self._remember(new, old_id, self._unchanged.pop(old_id))
+            stats.current().increment('unchanged')
+            return False
+        with stats.current().stage('compare'):
+            new_dict = export_content_dict(new)
+            fingerprint = None
+            if self._index is not None or self.fingerprints is not None:
+                fingerprint = dict_fingerprint(new_dict)
+            if self.fingerprints is not None and self.fingerprints.get(old_id) == fingerprint:
+                # Content is unchanged. No need to export the old record.
+                records_differ = False
+            else:
+                records_differ = new_dict != export_content_dict(old)
+        if records_differ:
+            # Records differ. Send new record to docstore
+            new_dict.update(new.export_provenance_dict())
+            # Use old aggregator identifier.
+            # Disabling pylint protected access -rule for the next row.
+            # Attribute _aggregator_identifier is prefixed with a single
+            # underscore since it reflects the underlying payload schema.
+            # pylint: disable-next=protected-access
+            new_dict.update(old._aggregator_identifier.export_dict())
+            await self._send_update(new.get_collection(), new_dict, old_id)
+            updated = True
+        elif await self._update_metadata_if_deleted(old) is True:
+            # Records match, but old record is deleted. Update metadata to docstore.
+            await self._send_update(new.get_collection(),
+                                    old.export_dict(include_provenance=True,
+                                                    include_metadata=True,
+                                                    include_id=False),
+                                    old_id)
+            updated = True
+        else:
+            # Records match. No need to update.
+            updated = False
+        if fingerprint is not None:
+            self._remember(new, old_id, fingerprint)
+        stats.current().increment('updated' if updated else 'unchanged')
+        return updated
+
+
+class IndexedStudyMethods(StudyMethods):
+    """StudyMethods that resolve records using a preloaded :obj:`ProvenanceIndex`."""
+
+    preload_index = True
@@ -0,0 +1,341 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Harvest records directly from an OAI-PMH repository.
+
+:class:`ListRecordsHarvester` pages through the ``ListRecords`` verb
+following resumption tokens. Each page is read with a pull parser and
+every record is handed out as soon as it ends, wrapped in an OAI-PMH
+``GetRecord`` envelope like the files written by the harvester, so the
+DDI parsers read it exactly as they would read a harvested file.
+Nothing is written to disk.
+
+An incremental harvest asks only for records changed since the given
+`from_date`. :class:`HarvestState` stores the response date of the
+first page of each successful harvest, so the next harvest continues
+from the repository's clock rather than the client's.
+
+ListRecords responses saved to files can be read the same way with
+:func:`iterate_file_records`, one record at a time, so memory use does
+not grow with the size of the file. Files are read with
+:mod:`cdcagg_client.archive`, so they may be compressed or archive
+members.
+"""
+import os
+import json
+import logging
+import tempfile
+from collections import namedtuple
+from urllib.parse import urlencode
+from xml.etree import ElementTree
+from xml.etree.ElementTree import ParseError
+from tornado.httpclient import AsyncHTTPClient
+from cdcagg_client import (
+    archive,
+    stats
+)
+from cdcagg_client.sniff import (
+    OAI_NS,
+    ROOT_FORMATS,
+    split_tag
+)
+
+
+_logger = logging.getLogger(__name__)
+
+
+#: Granularity of datestamps with seconds.
+GRANULARITY_SECONDS = 'YYYY-MM-DDThh:mm:ssZ'
+#: Granularity of datestamps with days.
+GRANULARITY_DAYS = 'YYYY-MM-DD'
+
+#: Error code telling that the harvest matched no records.
+NO_RECORDS_MATCH = 'noRecordsMatch'
+
+_READ_SIZE = 64 * 1024
+
+
+def _oai(tag):
+    return '{%s}%s' % (OAI_NS, tag)
+
+
+class OAIError(Exception):
+    """OAI-PMH repository responded with an error.
+
+    :param str code: OAI-PMH error code.
+    :param str message: Error message.
+    """
+
+    def __init__(self, code, message):
+        self.code = code
+        super().__init__('%s: %s' % (code, message))
+
+
+#: Harvested record. ``document`` is the record in a GetRecord envelope
+#: as bytes, or None if the record is deleted. ``file_format`` is one of
+#: the :mod:`cdcagg_client.sniff` formats or None.
+HarvestedRecord = namedtuple('HarvestedRecord', ['identifier', 'datestamp', 'deleted', 'document',
+                                                 'file_format'])
+
+
+class _PageReader:
+    """Pull records from a ListRecords response.
+
+    Without `base_url` and `metadata_prefix`, they are read from the
+    ``request`` element of the response.
+    """
+
+    def __init__(self, base_url=None, metadata_prefix=None):
+        self._base_url = base_url
+        self._metadata_prefix = metadata_prefix
+        self._parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        self._list_records = None
+        self.response_date = None
+        self.resumption_token = None
+        self.error = None
+
+    def _envelope(self, record):
+        identifier = record.findtext('%s/%s' % (_oai('header'), _oai('identifier')))
+        attrs = {'verb': 'GetRecord', 'identifier': identifier}
+        if self._metadata_prefix:
+            attrs['metadataPrefix'] = self._metadata_prefix
+        root = ElementTree.Element(_oai('OAI-PMH'))
+        ElementTree.SubElement(root, _oai('responseDate')).text = self.response_date
+        ElementTree.SubElement(root, _oai('request'), attrs).text = self._base_url
+        ElementTree.SubElement(root, _oai('GetRecord')).append(record)
+        return ElementTree.tostring(root, encoding='utf-8')
+
+    def _record(self, record):
+        header = record.find(_oai('header'))
+        identifier = header.findtext(_oai('identifier'))
+        datestamp = header.findtext(_oai('datestamp'))
+        if header.get('status') == 'deleted':
+            return HarvestedRecord(identifier, datestamp, True, None, None)
+        file_format = None
+        metadata = record.find(_oai('metadata'))
+        if metadata is not None and len(metadata):
+            file_format = ROOT_FORMATS.get(split_tag(metadata[0].tag))
+        return HarvestedRecord(identifier, datestamp, False, self._envelope(record), file_format)
+
+    def feed(self, data):
+        """Feed response data and return records that ended in it."""
+        records = []
+        self._parser.feed(data)
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                if element.tag == _oai('ListRecords'):
+                    self._list_records = element
+                continue
+            if element.tag == _oai('responseDate'):
+                self.response_date = element.text
+            elif element.tag == _oai('request') and self._base_url is None:
+                self._base_url = (element.text or '').strip()
+                self._metadata_prefix = element.get('metadataPrefix')
+            elif element.tag == _oai('error'):
+                self.error = OAIError(element.get('code'), element.text)
+            elif element.tag == _oai('record') and self._list_records is not None:
+                records.append(self._record(element))
+                # Free the record before the rest of the page is read.
+                self._list_records.remove(element)
+            elif element.tag == _oai('resumptionToken'):
+                self.resumption_token = (element.text or '').strip() or None
+        return records
+
+    def close(self):
+        self._parser.close()
+
+
+def is_list_records_file(path, read_size=8192, max_bytes=65536):
+    """Check whether a file is an OAI-PMH ListRecords response.
+
+    Reads the file only until the element following ``request``.
+
+    :param str path: Path to the file or archive member.
+    :param int read_size: Number of bytes to read at a time.
+    :param int max_bytes: Maximum number of bytes to read.
+    :rtype: bool
+    """
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    depth = 0
+    read = 0
+    with archive.open_source(path) as file_obj:
+        while read < max_bytes:
+            data = file_obj.read(min(read_size, max_bytes - read))
+            if not data:
+                break
+            read += len(data)
+            try:
+                parser.feed(data)
+                for event, element in parser.read_events():
+                    if event == 'end':
+                        depth -= 1
+                        element.clear()
+                        continue
+                    depth += 1
+                    if depth == 1 and element.tag != _oai('OAI-PMH'):
+                        return False
+                    if depth == 2 and element.tag not in (_oai('responseDate'), _oai('request')):
+                        return element.tag == _oai('ListRecords')
+            except ParseError:
+                # Let the parser report the error.
+                return False
+    return False
+
+
+def iterate_file_records(path, read_size=_READ_SIZE):
+    """Read records of a ListRecords response file one at a time.
+
+    Each record is freed from the document as soon as it is handed
+    out, so memory use is bounded by the largest record rather than
+    the size of the file. Archive members are read to memory whole.
+    Base URL and metadata prefix of the records are read from the
+    ``request`` element.
+
+    :param str path: Path to the file or archive member.
+    :param int read_size: Number of bytes to read at a time.
+    :returns: Generator yielding :obj:`HarvestedRecord` in file order.
+    :raises: :exc:`OAIError` if the file contains an error other than
+             ``noRecordsMatch``.
+    """
+    reader = _PageReader()
+    for data in archive.iterate_chunks(path, read_size):
+        yield from reader.feed(data)
+    reader.close()
+    if reader.error is not None and reader.error.code != NO_RECORDS_MATCH:
+        raise reader.error
+
+
+class ListRecordsHarvester:
+    """Harvest records of an OAI-PMH repository with ListRecords.
+
+    :param str base_url: Base URL of the repository.
+    :param str metadata_prefix: Metadata prefix to harvest.
+    :param str set_spec: Optional set to harvest.
+    :param str from_date: Harvest records changed since this UTC
+                          datestamp. None harvests all records.
+    """
+
+    def __init__(self, base_url, metadata_prefix, set_spec=None, from_date=None):
+        self.base_url = base_url
+        self.metadata_prefix = metadata_prefix
+        self.set_spec = set_spec
+        self.from_date = from_date
+        #: Response date of the first page. Set once harvesting has started.
+        self.response_date = None
+        self.pages = 0
+
+    async def _get(self, params):
+        with stats.current().request('oai'):
+            response = await AsyncHTTPClient().fetch(self.base_url + '?' + urlencode(params))
+        return response.body
+
+    async def granularity(self):
+        """Query datestamp granularity of the repository with Identify.
+
+        :returns: :data:`GRANULARITY_SECONDS` or :data:`GRANULARITY_DAYS`.
+        :rtype: str
+        """
+        root = ElementTree.fromstring(await self._get({'verb': 'Identify'}))
+        error = root.find(_oai('error'))
+        if error is not None:
+            raise OAIError(error.get('code'), error.text)
+        granularity = root.findtext('%s/%s' % (_oai('Identify'), _oai('granularity')))
+        return GRANULARITY_DAYS if granularity == GRANULARITY_DAYS else GRANULARITY_SECONDS
+
+    async def _from_param(self):
+        if await self.granularity() == GRANULARITY_DAYS:
+            return self.from_date[:len('YYYY-MM-DD')]
+        return self.from_date
+
+    async def iterate(self):
+        """Harvest records.
+
+        :returns: Async generator yielding :obj:`HarvestedRecord` in
+                  repository order.
+        :raises: :exc:`OAIError` if the repository responds with an
+                 error other than ``noRecordsMatch``.
+        """
+        params = {'verb': 'ListRecords', 'metadataPrefix': self.metadata_prefix}
+        if self.set_spec:
+            params['set'] = self.set_spec
+        if self.from_date:
+            params['from'] = await self._from_param()
+        while params is not None:
+            body = await self._get(params)
+            reader = _PageReader(self.base_url, self.metadata_prefix)
+            for offset in range(0, len(body), _READ_SIZE):
+                for record in reader.feed(body[offset:offset + _READ_SIZE]):
+                    yield record
+            reader.close()
+            self.pages += 1
+            if self.response_date is None:
+                self.response_date = reader.response_date
+            if reader.error is not None:
+                if reader.error.code == NO_RECORDS_MATCH:
+                    _logger.info('No records to harvest from %s', self.base_url)
+                    return
+                raise reader.error
+            stats.current().increment('harvested_pages')
+            if reader.resumption_token:
+                params = {'verb': 'ListRecords', 'resumptionToken': reader.resumption_token}
+            else:
+                params = None
+
+
+class HarvestState:
+    """Response dates of successful harvests keyed by repository.
+
+    The state is a JSON file that is read by :meth:`load` and
+    atomically replaced by :meth:`save`.
+
+    :param str path: Path to the state file.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._dates = {}
+
+    @staticmethod
+    def key(base_url, metadata_prefix, set_spec=None):
+        """Get key of a harvest.
+
+        :rtype: str
+        """
+        return ' '.join((base_url, metadata_prefix, set_spec or ''))
+
+    def get(self, key):
+        """Get response date of the last successful harvest or None."""
+        return self._dates.get(key)
+
+    def set(self, key, response_date):
+        """Set response date of a successful harvest."""
+        self._dates[key] = response_date
+
+    def load(self):
+        """Load state from file if the file exists."""
+        if not os.path.exists(self._path):
+            _logger.info("Harvest state '%s' does not exist. Harvesting all records.", self._path)
+            return
+        with open(self._path, encoding='utf8') as file_obj:
+            self._dates = json.load(file_obj)
+
+    def save(self):
+        """Save state to file."""
+        dirname = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.harvest-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8') as file_obj:
+                json.dump(self._dates, file_obj, indent=1, sort_keys=True)
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
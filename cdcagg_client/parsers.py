@@ -0,0 +1,117 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""DDI record parsers imported on first use.
+
+Importing :mod:`cdcagg_common.mappings` loads the mappings of all DDI
+formats and takes a large share of the startup time of the client. A
+:class:`LazyParser` stands in for a parser class and imports the
+mappings only when a file is actually parsed. Printing help or the
+configuration, or a run that finds every file cached, does not import
+them at all.
+
+Lazy parsers can be given to :class:`cdcagg_client.batch.BatchProcessor`
+in place of parser classes. They are picklable, so they can be sent to
+parse workers, which import the mappings on their own.
+"""
+import importlib
+from cdcagg_client.sniff import (
+    FORMAT_DDI122,
+    FORMAT_DDI25,
+    FORMAT_DDI31,
+    FORMAT_DDI32,
+    FORMAT_DDI33
+)
+
+
+#: Module containing the parser classes.
+MAPPINGS_MODULE = 'cdcagg_common.mappings'
+
+#: Format -> name of the parser class in :data:`MAPPINGS_MODULE`, in the
+#: order parsers are tried.
+PARSER_NAMES = {
+    FORMAT_DDI122: 'DDI122NesstarRecordParser',
+    FORMAT_DDI25: 'DDI25RecordParser',
+    FORMAT_DDI31: 'DDI31RecordParser',
+    FORMAT_DDI32: 'DDI32RecordParser',
+    FORMAT_DDI33: 'DDI33RecordParser',
+}
+
+
+def import_parser(name):
+    """Import a parser class by name.
+
+    :param str name: Name of the class in :data:`MAPPINGS_MODULE`.
+    :returns: Parser class.
+    """
+    return getattr(importlib.import_module(MAPPINGS_MODULE), name)
+
+
+class LazyParser:
+    """Parser class that is imported on first use.
+
+    Supports the class methods used by the batch processor. Lazy parsers
+    are equal if they stand in for the same class.
+
+    :param str name: Name of the class in :data:`MAPPINGS_MODULE`.
+    """
+
+    __slots__ = ('name', '_parser_class')
+
+    def __init__(self, name):
+        self.name = name
+        self._parser_class = None
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.name)
+
+    def __eq__(self, other):
+        if not isinstance(other, LazyParser):
+            return NotImplemented
+        return self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __getstate__(self):
+        # Workers import the class on their own.
+        return self.name
+
+    def __setstate__(self, state):
+        self.name = state
+        self._parser_class = None
+
+    def resolve(self):
+        """Import the parser class.
+
+        :returns: Parser class.
+        """
+        if self._parser_class is None:
+            self._parser_class = import_parser(self.name)
+        return self._parser_class
+
+    def from_file(self, path):
+        """Parse a file with :meth:`from_file` of the parser class."""
+        return self.resolve().from_file(path)
+
+    def from_string(self, document):
+        """Parse a document with :meth:`from_string` of the parser class."""
+        return self.resolve().from_string(document)
+
+
+def lazy_format_parsers():
+    """Get lazy parsers of all formats.
+
+    :returns: Format -> :obj:`LazyParser`, in the order parsers are tried.
+    :rtype: dict
+    """
+    return {file_format: LazyParser(name) for file_format, name in PARSER_NAMES.items()}
@@ -0,0 +1,268 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Profile synchronization runs.
+
+:func:`profile` profiles the enclosed code in one of three modes:
+
+- :data:`PROFILE_CPU` profiles the main thread with :mod:`cProfile`
+  and writes the statistics to :data:`CPU_PROFILE_FILE`. Read them with
+  ``python -m pstats``.
+- :data:`PROFILE_MEMORY` traces allocations with :mod:`tracemalloc`
+  and writes a snapshot at the start and end of each stage in
+  :data:`SNAPSHOT_STAGES`. The largest differences of each stage are
+  logged. Load the snapshots with :meth:`tracemalloc.Snapshot.load`.
+- :data:`PROFILE_ASYNC` runs event loops in debug mode, which logs
+  callbacks blocking the loop longer than `slow_callback_duration`,
+  and logs timings of coroutines decorated with :func:`timed`.
+
+When not profiling, :func:`timed` coroutines and stage timing check
+a single module variable, so the hooks can stay in production code.
+Worker processes and threads are not profiled.
+"""
+import os
+import time
+import asyncio
+import cProfile
+import logging
+import functools
+import tracemalloc
+from contextlib import contextmanager
+from cdcagg_client import stats
+
+
+_logger = logging.getLogger(__name__)
+
+
+#: Profile CPU time.
+PROFILE_CPU = 'cpu'
+#: Profile memory allocations.
+PROFILE_MEMORY = 'memory'
+#: Profile the event loop and coroutines.
+PROFILE_ASYNC = 'async'
+#: Available profiles.
+PROFILES = (PROFILE_CPU, PROFILE_MEMORY, PROFILE_ASYNC)
+
+#: File name of the CPU profile.
+CPU_PROFILE_FILE = 'cpu.pstats'
+#: Stages whose boundaries are snapshotted. Stages timed once per
+#: record or file would produce too many snapshots.
+SNAPSHOT_STAGES = ('discovery', 'index_load', 'query_existing_ids', 'upsert_run', 'remove')
+#: Number of frames stored per traced allocation.
+TRACE_FRAMES = 10
+#: Number of allocation differences logged per stage.
+TOP_ALLOCATIONS = 10
+#: Callbacks blocking the event loop longer than this many seconds are logged.
+SLOW_CALLBACK_DURATION = 0.1
+
+_SNAPSHOT_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),
+                     tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                     tracemalloc.Filter(False, '<unknown>'))
+
+
+class CoroutineTimings:
+    """Wall time of coroutine calls by name."""
+
+    def __init__(self):
+        #: Name -> [seconds, calls, max seconds]
+        self.timings = {}
+
+    def add(self, name, seconds):
+        """Add duration of a call.
+
+        :param str name: Coroutine name.
+        :param float seconds: Seconds taken.
+        """
+        timing = self.timings.setdefault(name, [0.0, 0, 0.0])
+        timing[0] += seconds
+        timing[1] += 1
+        timing[2] = max(timing[2], seconds)
+
+    def log_summary(self):
+        """Log timings, slowest total first."""
+        for name, (seconds, calls, max_seconds) in sorted(self.timings.items(), key=lambda item: -item[1][0]):
+            _logger.info('Coroutine %s: %s calls taking %.3f seconds, mean %.1f ms, max %.1f ms',
+                         name, calls, seconds, seconds / calls * 1000, max_seconds * 1000)
+
+
+_timings = None
+
+
+def timed(name):
+    """Decorate a coroutine function to be timed when profiling async.
+
+    :param str name: Name of the timing.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            timings = _timings
+            if timings is None:
+                return await func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                timings.add(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profile_cpu(directory):
+    """Profile CPU time of the main thread.
+
+    The profile is written also if the enclosed code fails.
+
+    :param str directory: Folder to write :data:`CPU_PROFILE_FILE` to.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        path = os.path.join(directory, CPU_PROFILE_FILE)
+        profiler.dump_stats(path)
+        _logger.info('Wrote CPU profile to %s', path)
+
+
+class SnapshotWriter:
+    """Write memory snapshots at stage boundaries.
+
+    Used as a stage listener of :mod:`cdcagg_client.stats`.
+
+    :param str directory: Folder to write snapshots to.
+    :param tuple stages: Names of stages to snapshot.
+    """
+
+    def __init__(self, directory, stages=SNAPSHOT_STAGES):
+        self._directory = directory
+        self._stages = stages
+        self._started = {}
+        #: Paths of written snapshots.
+        self.paths = []
+
+    def __call__(self, name, start):
+        if name in self._stages:
+            self.snapshot(name, start)
+
+    def snapshot(self, name, start):
+        """Write a snapshot.
+
+        At the end of a stage, log the largest differences to the
+        snapshot taken at its start.
+
+        :param str name: Stage name.
+        :param bool start: True at the start of the stage.
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        path = os.path.join(self._directory, 'memory-%03d-%s-%s.snapshot' % (
+            len(self.paths), name, 'start' if start else 'end'))
+        snapshot.dump(path)
+        self.paths.append(path)
+        if start:
+            self._started[name] = snapshot
+            return
+        started = self._started.pop(name, None)
+        if started is None:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        _logger.info('Stage %s ended with %.1f MiB traced, peak %.1f MiB. Snapshot %s',
+                     name, current / 2**20, peak / 2**20, path)
+        for diff in snapshot.compare_to(started, 'lineno')[:TOP_ALLOCATIONS]:
+            _logger.info('Stage %s: %s', name, diff)
+
+
+@contextmanager
+def profile_memory(directory, stages=SNAPSHOT_STAGES):
+    """Trace memory allocations and snapshot stage boundaries.
+
+    Snapshots are also written at the start and end of the enclosed
+    code as stage 'run'.
+
+    :param str directory: Folder to write snapshots to.
+    :param tuple stages: Names of stages to snapshot.
+    """
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(TRACE_FRAMES)
+    writer = SnapshotWriter(directory, stages)
+    writer.snapshot('run', True)
+    stats.set_stage_listener(writer)
+    try:
+        yield writer
+    finally:
+        stats.set_stage_listener(None)
+        writer.snapshot('run', False)
+        if started_tracing:
+            tracemalloc.stop()
+
+
+class _DebugEventLoopPolicy(asyncio.DefaultEventLoopPolicy):
+    """Create event loops in debug mode."""
+
+    def __init__(self, slow_callback_duration):
+        super().__init__()
+        self._slow_callback_duration = slow_callback_duration
+
+    def new_event_loop(self):
+        loop = super().new_event_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = self._slow_callback_duration
+        return loop
+
+
+@contextmanager
+def profile_async(slow_callback_duration=SLOW_CALLBACK_DURATION):
+    """Log slow callbacks and time coroutines decorated with :func:`timed`.
+
+    Applies to event loops created in the enclosed code, such as those
+    of :func:`asyncio.run`.
+
+    :param float slow_callback_duration: Log callbacks blocking the
+                                         event loop longer than this
+                                         many seconds.
+    """
+    global _timings  # pylint: disable=global-statement
+    policy = asyncio.get_event_loop_policy()
+    asyncio.set_event_loop_policy(_DebugEventLoopPolicy(slow_callback_duration))
+    _timings = timings = CoroutineTimings()
+    try:
+        yield timings
+    finally:
+        _timings = None
+        asyncio.set_event_loop_policy(policy)
+        timings.log_summary()
+
+
+@contextmanager
+def profile(mode, directory='.'):
+    """Profile the enclosed code.
+
+    :param str mode: One of :data:`PROFILES` or None to not profile.
+    :param str directory: Folder to write profiles to. Created if it
+                          does not exist.
+    """
+    if mode is None:
+        yield
+        return
+    if mode not in PROFILES:
+        raise ValueError('Invalid profile %s. Use one of %s' % (mode, ', '.join(PROFILES)))
+    if mode == PROFILE_ASYNC:
+        context = profile_async()
+    else:
+        os.makedirs(directory, exist_ok=True)
+        context = profile_cpu(directory) if mode == PROFILE_CPU else profile_memory(directory)
+    _logger.info('Profiling %s', mode)
+    with context:
+        yield
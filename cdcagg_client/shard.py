@@ -0,0 +1,124 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Sharding of a synchronization run.
+
+A run is split into `shard_count` shards by a stable hash of the path
+of each discovered file, so every process given the same paths
+handles a distinct set of files. :func:`shard_of` uses CRC-32, which
+unlike :func:`hash` does not change between processes.
+
+A shard cannot remove absent records by itself, since records of
+files in other shards are absent from its batch. Instead each shard
+writes the IDs it has seen to a seen-ID file in a shared folder with
+:func:`write_seen_ids`. Once all shards have finished, a final step
+reads the files of all shards with :func:`read_seen_ids` and removes
+records that no shard has seen.
+"""
+import os
+import zlib
+import logging
+import tempfile
+
+
+_logger = logging.getLogger(__name__)
+
+
+class IncompleteShards(Exception):
+    """Seen-ID files are missing for some shards."""
+
+
+def shard_of(path, shard_count):
+    """Get the shard a file belongs to.
+
+    :param str path: Path to the file.
+    :param int shard_count: Number of shards.
+    :returns: Shard index.
+    :rtype: int
+    """
+    return zlib.crc32(os.fsencode(path)) % shard_count
+
+
+def seen_ids_path(directory, shard_index, shard_count):
+    """Get path to the seen-ID file of a shard.
+
+    :param str directory: Folder of seen-ID files.
+    :param int shard_index: Shard index.
+    :param int shard_count: Number of shards.
+    :rtype: str
+    """
+    return os.path.join(directory, 'seen-%s-of-%s.ids' % (shard_index, shard_count))
+
+
+def write_seen_ids(path, record_ids):
+    """Write seen IDs of a shard.
+
+    The file is replaced atomically, so a partially written file is
+    never read.
+
+    :param str path: Path to the seen-ID file.
+    :param iterable record_ids: IDs seen by the shard.
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.seen-')
+    count = 0
+    try:
+        with os.fdopen(fd, 'w', encoding='utf8') as file_obj:
+            for record_id in record_ids:
+                file_obj.write(record_id + '\n')
+                count += 1
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    _logger.info("Wrote %s seen IDs to '%s'", count, path)
+
+
+def _check_complete(directory, shard_count):
+    paths = [seen_ids_path(directory, index, shard_count) for index in range(shard_count)]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise IncompleteShards('Seen-ID files of %s of %s shards are missing: %s'
+                               % (len(missing), shard_count, ', '.join(missing)))
+    return paths
+
+
+def read_seen_ids(directory, shard_count):
+    """Read seen IDs of all shards.
+
+    :param str directory: Folder of seen-ID files.
+    :param int shard_count: Number of shards.
+    :returns: Generator yielding IDs seen by any shard.
+    :raises: :exc:`IncompleteShards` if a file is missing. Raised before
+             any ID is yielded.
+    """
+    paths = _check_complete(directory, shard_count)
+
+    def _iterate():
+        for path in paths:
+            with open(path, encoding='utf8') as file_obj:
+                for line in file_obj:
+                    yield line.rstrip('\n')
+    return _iterate()
+
+
+def remove_seen_ids(directory, shard_count):
+    """Remove seen-ID files of all shards.
+
+    :param str directory: Folder of seen-ID files.
+    :param int shard_count: Number of shards.
+    """
+    for index in range(shard_count):
+        try:
+            os.remove(seen_ids_path(directory, index, shard_count))
+        except FileNotFoundError:
+            pass
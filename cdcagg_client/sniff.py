@@ -0,0 +1,157 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Detect the DDI format of a file from its beginning.
+
+:func:`sniff_file` reads the file incrementally with a pull parser
+until it finds the DDI root element, either at the document root or
+below the ``metadata`` element of an OAI-PMH envelope. The namespace
+and name of the DDI root element determine the format.
+
+The sniffer also looks for the element a parser needs to find a
+study: ``stdyDscr`` below ``codeBook`` or ``StudyUnit`` below
+``DDIInstance``. If the DDI root element ends without it, the file is
+unsupported. Reading stops at `max_bytes`, in which case the file is
+considered supported and the parser gets to decide.
+"""
+import logging
+from collections import namedtuple
+from xml.etree.ElementTree import XMLPullParser, ParseError
+from cdcagg_client.archive import open_source
+
+
+_logger = logging.getLogger(__name__)
+
+
+FORMAT_DDI122 = 'ddi122'
+FORMAT_DDI25 = 'ddi25'
+FORMAT_DDI31 = 'ddi31'
+FORMAT_DDI32 = 'ddi32'
+FORMAT_DDI33 = 'ddi33'
+
+OAI_NS = 'http://www.openarchives.org/OAI/2.0/'
+
+#: (namespace, local name) of DDI root element -> format.
+ROOT_FORMATS = {
+    ('http://www.icpsr.umich.edu/DDI', 'codeBook'): FORMAT_DDI122,
+    ('ddi:codebook:2_5', 'codeBook'): FORMAT_DDI25,
+    ('ddi:instance:3_1', 'DDIInstance'): FORMAT_DDI31,
+    ('ddi:instance:3_2', 'DDIInstance'): FORMAT_DDI32,
+    ('ddi:instance:3_3', 'DDIInstance'): FORMAT_DDI33,
+}
+
+#: Local name of DDI root element -> local name of the element containing a study.
+STUDY_ELEMENTS = {
+    'codeBook': 'stdyDscr',
+    'DDIInstance': 'StudyUnit',
+}
+
+
+#: Result of sniffing. ``file_format`` is one of the FORMAT_* constants or
+#: None if not recognized. ``supported`` is False only if the file
+#: certainly cannot be parsed.
+SniffResult = namedtuple('SniffResult', ['file_format', 'supported'])
+
+
+def split_tag(tag):
+    """Split element tag to namespace and local name.
+
+    :param str tag: Element tag.
+    :returns: (namespace, local name). Namespace is empty if there is none.
+    :rtype: tuple
+    """
+    if tag.startswith('{'):
+        namespace, _, local = tag[1:].partition('}')
+        return namespace, local
+    return '', tag
+
+
+class _Sniffer:
+
+    def __init__(self):
+        self._parser = XMLPullParser(events=('start', 'end'))
+        self._stack = []
+        # Depth of DDI root element.
+        self._ddi_root = None
+        self._format = None
+        self._study_element = None
+        self.result = None
+
+    def _start(self, element):
+        parent = self._stack[-1] if self._stack else None
+        self._stack.append(element.tag)
+        if self._ddi_root is None:
+            if parent is None and element.tag == '{%s}OAI-PMH' % (OAI_NS,):
+                return
+            if parent is not None and parent != '{%s}metadata' % (OAI_NS,):
+                return
+            self._ddi_root = len(self._stack)
+            namespace, local = split_tag(element.tag)
+            self._format = ROOT_FORMATS.get((namespace, local))
+            self._study_element = STUDY_ELEMENTS.get(local)
+            if self._study_element is None:
+                # Not DDI at all.
+                self.result = SniffResult(None, False)
+        elif split_tag(element.tag)[1] == self._study_element:
+            self.result = SniffResult(self._format, True)
+
+    def _end(self, element):
+        depth = len(self._stack)
+        self._stack.pop()
+        element.clear()
+        if self._ddi_root == depth:
+            # DDI root ended without a study.
+            self.result = SniffResult(self._format, False)
+        elif depth == 1 and self._ddi_root is None:
+            # OAI-PMH envelope without metadata.
+            self.result = SniffResult(None, False)
+
+    def feed(self, data):
+        self._parser.feed(data)
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                self._start(element)
+            else:
+                self._end(element)
+            if self.result is not None:
+                break
+
+    def undecided(self):
+        return SniffResult(self._format if self._ddi_root is not None else None, True)
+
+
+def sniff_file(path, read_size=8192, max_bytes=65536):
+    """Detect the DDI format of a file.
+
+    :param str path: Path to the file or archive member.
+    :param int read_size: Number of bytes to read at a time.
+    :param int max_bytes: Maximum number of uncompressed bytes to read.
+    :returns: Detected format and whether the file is supported.
+    :rtype: :obj:`SniffResult`
+    """
+    sniffer = _Sniffer()
+    read = 0
+    with open_source(path) as file_obj:
+        while read < max_bytes:
+            data = file_obj.read(min(read_size, max_bytes - read))
+            if not data:
+                break
+            read += len(data)
+            try:
+                sniffer.feed(data)
+            except ParseError:
+                # Let the parser report the error.
+                _logger.debug("Unable to sniff file '%s'", path, exc_info=True)
+                return SniffResult(None, True)
+            if sniffer.result is not None:
+                return sniffer.result
+    return sniffer.undecided()
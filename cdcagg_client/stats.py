@@ -0,0 +1,315 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Run statistics.
+
+A :class:`RunStats` collects wall time spent in each stage of a
+synchronization run, counters of record and file outcomes and latency
+histograms of Document Store requests. The statistics of the current
+run are available from :func:`current` and started over with
+:func:`reset`.
+
+Stage time is the sum of the durations of each timed call. When
+records are upserted concurrently, calls overlap and the stage time
+may exceed the wall time of the run.
+
+At the end of the run the statistics can be written as a JSON report
+with :func:`write_json` and as a Prometheus textfile for the
+node_exporter textfile collector with :func:`write_prometheus`.
+
+A listener set with :func:`set_stage_listener` is called when a timed
+stage starts and ends. :mod:`cdcagg_client.profiling` uses it to take
+memory snapshots at stage boundaries.
+"""
+import os
+import json
+import time
+import logging
+import tempfile
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+_logger = logging.getLogger(__name__)
+
+
+#: Upper bounds of latency histogram buckets in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: Counters of records.
+RECORD_COUNTERS = ('created', 'updated', 'unchanged', 'deleted', 'coalesced')
+#: Counters of files.
+FILE_COUNTERS = ('cached_files', 'resumed_files', 'failed_files', 'unsupported_files')
+
+#: Prefix of Prometheus metric names.
+METRIC_PREFIX = 'cdcagg_client'
+
+
+class Histogram:
+    """Histogram of observed values.
+
+    :param tuple buckets: Sorted upper bounds of buckets.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Add observed value.
+
+        :param float value: Value to add.
+        """
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Get cumulative counts of each bucket.
+
+        :returns: List of (upper bound, count) tuples. The last upper
+                  bound is ``float('inf')``.
+        :rtype: list
+        """
+        result, total = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), self._counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+class RunStats:
+    """Statistics of a single run."""
+
+    def __init__(self):
+        self.counters = Counter()
+        #: Stage name -> [seconds, calls]
+        self.stages = {}
+        #: Request kind -> :obj:`Histogram`
+        self.requests = {}
+        self.started = time.time()
+        self._started_perf = time.perf_counter()
+        self.wall_seconds = None
+        self.success = None
+
+    def increment(self, name, amount=1):
+        """Increment counter.
+
+        :param str name: Counter name.
+        :param int amount: Amount to add.
+        """
+        self.counters[name] += amount
+
+    def add_stage_time(self, name, seconds):
+        """Add time spent in a stage.
+
+        :param str name: Stage name.
+        :param float seconds: Seconds spent.
+        """
+        stage = self.stages.setdefault(name, [0.0, 0])
+        stage[0] += seconds
+        stage[1] += 1
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager timing a stage.
+
+        :param str name: Stage name.
+        """
+        listener = _stage_listener
+        if listener is not None:
+            listener(name, True)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - start)
+            if listener is not None:
+                listener(name, False)
+
+    @contextmanager
+    def request(self, kind):
+        """Context manager timing a Document Store request.
+
+        Failed requests are timed too and counted in
+        ``request_errors``.
+
+        :param str kind: Request kind, such as 'query' or 'update'.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.increment('request_errors')
+            raise
+        finally:
+            self.requests.setdefault(kind, Histogram()).observe(time.perf_counter() - start)
+
+    def finish(self, success):
+        """Mark the run finished.
+
+        :param bool success: True if the run finished without errors.
+        """
+        self.wall_seconds = time.perf_counter() - self._started_perf
+        self.success = success
+
+    def _elapsed(self):
+        if self.wall_seconds is not None:
+            return self.wall_seconds
+        return time.perf_counter() - self._started_perf
+
+    def report(self):
+        """Get statistics as a dictionary.
+
+        :rtype: dict
+        """
+        wall_seconds = self._elapsed()
+        records = sum(self.counters[name] for name in ('created', 'updated', 'unchanged', 'coalesced'))
+        return {
+            'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            'wall_seconds': round(wall_seconds, 6),
+            'success': self.success,
+            'records_per_second': round(records / wall_seconds, 3) if wall_seconds else None,
+            'counters': dict(sorted(self.counters.items())),
+            'stages': {name: {'seconds': round(seconds, 6), 'calls': calls}
+                       for name, (seconds, calls) in sorted(self.stages.items())},
+            'requests': {kind: {'count': histogram.count, 'sum': round(histogram.sum, 6),
+                                'buckets': {_format_bound(bound): count
+                                            for bound, count in histogram.cumulative()}}
+                         for kind, histogram in sorted(self.requests.items())}}
+
+    def prometheus_text(self):
+        """Get statistics in Prometheus text exposition format.
+
+        :rtype: str
+        """
+        lines = []
+
+        def _metric(name, metric_type, help_text, samples):
+            name = '%s_%s' % (METRIC_PREFIX, name)
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            for suffix, labels, value in samples:
+                label_str = ','.join('%s="%s"' % item for item in labels)
+                lines.append('%s%s%s %s' % (name, suffix, '{%s}' % (label_str,) if label_str else '', value))
+
+        _metric('last_run_timestamp_seconds', 'gauge', 'Start time of the last run.',
+                [('', (), self.started)])
+        _metric('last_run_duration_seconds', 'gauge', 'Wall time of the last run.',
+                [('', (), self._elapsed())])
+        _metric('last_run_success', 'gauge', '1 if the last run finished without errors.',
+                [('', (), int(bool(self.success)))])
+        _metric('records', 'gauge', 'Records handled in the last run by outcome.',
+                [('', (('outcome', name),), self.counters[name]) for name in RECORD_COUNTERS])
+        _metric('files', 'gauge', 'Files handled in the last run by outcome.',
+                [('', (('outcome', name[:-len('_files')]),), self.counters[name]) for name in FILE_COUNTERS])
+        _metric('stage_seconds', 'gauge', 'Time spent in each stage of the last run.',
+                [('', (('stage', name),), seconds) for name, (seconds, _) in sorted(self.stages.items())])
+        samples = []
+        for kind, histogram in sorted(self.requests.items()):
+            for bound, count in histogram.cumulative():
+                samples.append(('_bucket', (('request', kind), ('le', _format_bound(bound))), count))
+            samples.append(('_sum', (('request', kind),), histogram.sum))
+            samples.append(('_count', (('request', kind),), histogram.count))
+        _metric('docstore_request_duration_seconds', 'histogram',
+                'Latency of Document Store requests in the last run.', samples)
+        return '\n'.join(lines) + '\n'
+
+    def log_summary(self):
+        """Log a summary of the statistics."""
+        report = self.report()
+        _logger.info('Run took %.1f seconds: %s', report['wall_seconds'],
+                     ', '.join('%s=%s' % item for item in report['counters'].items()))
+        for name, stage in report['stages'].items():
+            _logger.info('Stage %s: %.3f seconds in %s calls', name, stage['seconds'], stage['calls'])
+        for kind, request in report['requests'].items():
+            _logger.info('DocStore %s requests: %s taking %.3f seconds', kind, request['count'], request['sum'])
+
+
+_current = RunStats()
+_stage_listener = None
+
+
+def current():
+    """Get statistics of the current run.
+
+    :rtype: :obj:`RunStats`
+    """
+    return _current
+
+
+def reset():
+    """Start collecting statistics of a new run.
+
+    :returns: New statistics.
+    :rtype: :obj:`RunStats`
+    """
+    global _current  # pylint: disable=global-statement
+    _current = RunStats()
+    return _current
+
+
+def set_stage_listener(listener):
+    """Set listener called at the start and end of timed stages.
+
+    The listener is called with the stage name and True when the
+    stage starts, and False when it ends.
+
+    :param listener: Callable or None to remove the listener.
+    """
+    global _stage_listener  # pylint: disable=global-statement
+    _stage_listener = listener
+
+
+def _write_atomic(path, content):
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.stats-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf8') as file_obj:
+            file_obj.write(content)
+        # mkstemp() creates files readable by owner only.
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_json(stats, path):
+    """Write statistics as a JSON report.
+
+    :param stats: Statistics to write.
+    :type stats: :obj:`RunStats`
+    :param str path: Path to the report file.
+    """
+    _write_atomic(path, json.dumps(stats.report(), indent=2) + '\n')
+
+
+def write_prometheus(stats, path):
+    """Write statistics as a Prometheus textfile.
+
+    The file is replaced atomically, so node_exporter never reads a
+    partially written file.
+
+    :param stats: Statistics to write.
+    :type stats: :obj:`RunStats`
+    :param str path: Path to the textfile. Should end with '.prom'.
+    """
+    _write_atomic(path, stats.prometheus_text())
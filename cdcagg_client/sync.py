@@ -20,126 +20,51 @@ Synchronization dedulicates records based on provenance
 information. If two records share the same baseUrl + identifier
 combination in one of their provenance items, they are considered to
 be the same record. In that case the new record always overwrites the
-old one.
-
-Deduplication is implemented in :class:`StudyMethods`.
+old one. The exception is ``--deduplicate``: a record sharing all its
+provenance keys with a record found earlier in the same batch
+overwrites it only if its provenance datestamp is newer, so of equally
+new records the first one found is stored. See
+:class:`cdcagg_client.batch.BatchDeduplicator`.
+
+Deduplication is implemented in
+:class:`cdcagg_client.methods.StudyMethods`.
+
+Importing this module is kept fast. Kuha Client, the record classes
+and the modules of this package are imported in :func:`configure`
+and :func:`run` when they are needed. DDI parsers are imported lazily
+with :mod:`cdcagg_client.parsers`. :class:`StudyMethods`,
+:class:`IndexedStudyMethods` and the parser classes remain available
+as attributes of this module, and are imported on first access.
 """
 import sys
+import functools
 import logging
-from kuha_common.query import QueryController
-from kuha_common import (
-    conf,
-    cli_setup
-)
-from kuha_common.document_store.constants import REC_STATUS_DELETED
-import kuha_client
-from cdcagg_common.records import Study
-from cdcagg_common.mappings import (
-    DDI122NesstarRecordParser,
-    DDI25RecordParser,
-    DDI31RecordParser,
-    DDI32RecordParser,
-    DDI33RecordParser
-)
+from contextlib import ExitStack
 
 
 _logger = logging.getLogger(__name__)
+#: Classes of :mod:`cdcagg_client.methods` available as attributes of this module.
+METHODS_NAMES = ('StudyMethods', 'IndexedStudyMethods')
 
 
-class StudyMethods(kuha_client.CollectionMethods):
-    """Implement StudyMethods subclass of CollectionMethods
+def __getattr__(name):
+    # Collection methods and parser classes are imported on first access.
+    if name in METHODS_NAMES:
+        from cdcagg_client import methods
+        return getattr(methods, name)
+    from cdcagg_client import parsers
+    if name in parsers.PARSER_NAMES.values():
+        return parsers.import_parser(name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
-    Implement methods :meth:`query_record` and :meth:`query_distinct_ids` that
-    are abstract in base class.
-    Override method :meth:`update_record` to correctly handle provenance info.
-    """
 
-    collection = Study.get_collection()
-
-    async def query_record(self, record):
-        """Query record from Document Store.
-
-        This method is called from upsert() method. If this method
-        returns None, then the upsert() will never call
-        update_record(), but will call create_record() instead.
-
-        This query uses elemMatch to look for the identifier and
-        base_url from within the same provenance item. It loops
-        throught all provenance items of `record` to query for a
-        record with matching provenance base_url + identifier
-        combination. If a match is found, it is returned.
-
-        :param record: Study to query for.
-        :type record: :obj:`cdcagg_common.records.Study`
-        :returns: Result of the query.
-        :rtype: Instance of Study or None.
-        """
-        # This query uses elemMatch to make sure the identifier and base_url are
-        # within the same provenance item. Direct attribute here is not needed
-        # since we're interested in indirect records as well.
-
-        # Loop throught all provenance items to query for a record with matching
-        # provenance base_url + identifier combination.
-        rec = None
-        for prov in record._provenance:
-            rec = await QueryController().query_single(Study, _filter={
-                Study._provenance: {
-                    QueryController.fk_constants.elem_match: {
-                        Study._provenance.attr_base_url: prov.attr_base_url.get_value(),
-                        Study._provenance.attr_identifier: prov.attr_identifier.get_value()}}})
-            if rec:
-                break
-        return rec
-
-    async def query_distinct_ids(self):
-        """Query distinct IDs from collection that are not deleted.
-
-        :returns: Distinct ids
-        :rtype: set
-        """
-        ids = await QueryController().query_distinct(
-            Study, fieldname=Study._id,
-            _filter={Study._metadata.attr_status:
-                     {QueryController.fk_constants.not_equal: REC_STATUS_DELETED}})
-        return set(ids[Study._id.path])
-
-    async def update_record(self, new, old):
-        """Update existing Document Store record.
-
-        Override :meth:`kuha_client.CollectionMethods.update_record`
-        to handle provenance data correctly.
-
-        :param new: New record.
-        :type new: :obj:`cdcagg_common.records.Study`
-        :param old: Old record.
-        :type old: :obj:`cdcagg_common.records.Study`
-        :returns: False if record does not need updating.
-        :rtype: bool
-        """
-        new_dict = new.export_dict(include_provenance=False, include_metadata=False, include_id=False)
-        old_dict = old.export_dict(include_provenance=False, include_metadata=False, include_id=False)
-        if new_dict != old_dict:
-            # Records differ. Send new record to docstore
-            new_dict.update(new.export_provenance_dict())
-            # Use old aggregator identifier.
-            # Disabling pylint protected access -rule for the next row.
-            # Attribute _aggregator_identifier is prefixed with a single
-            # underscore since it reflects the underlying payload schema.
-            # pylint: disable-next=protected-access
-            new_dict.update(old._aggregator_identifier.export_dict())
-            await kuha_client.send_update_record_request(new.get_collection(),
-                                                         new_dict, old.get_id())
-        elif await self._update_metadata_if_deleted(old) is True:
-            # Records match, but old record is deleted. Update metadata to docstore.
-            await kuha_client.send_update_record_request(new.get_collection(),
-                                                         old.export_dict(include_provenance=True,
-                                                                         include_metadata=True,
-                                                                         include_id=False),
-                                                         old.get_id())
-        else:
-            # Records match. No need to update.
-            return False
-        return True
+def _positive_int(value):
+    # Argument type of options that need at least one of something.
+    import argparse
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be a positive integer, got %r' % (value,))
+    return number
 
 
 def configure():
@@ -148,11 +73,25 @@ def configure():
     :returns: Loaded settings.
     :rtype: :obj:`argparse.Namespace`
     """
+    from kuha_common import (
+        conf,
+        cli_setup
+    )
+    from cdcagg_client import (
+        cache,
+        httpclient,
+        profiling
+    )
     conf.load('cdcagg_client.sync', package='cdcagg_client', env_var_prefix='CDCAGG_')
     conf.add_print_arg()
     conf.add_config_arg()
     conf.add('--file-cache', type=str, env_var='FILE_CACHE',
              help='Path to a cache file. Leave unset to not use file caching.')
+    conf.add('--file-cache-backend', choices=cache.BACKENDS, default=cache.BACKEND_PICKLE,
+             env_var='FILE_CACHE_BACKEND',
+             help="File cache backend. 'sqlite' stores the cache in an SQLite database that is "
+             "committed in batches during the run and detects unmodified files by content hash. "
+             "An existing pickle cache is migrated on first use.")
     conf.add('--no-remove', action='store_true', env_var='NO_REMOVE',
              help="Don't remove records that were not found in this batch.")
     conf.add('--fail-on-parse', action='store_true', env_var='FAIL_ON_PARSE',
@@ -161,37 +100,354 @@ def configure():
              "Note that if a file is not parsed properly it's records are not stored "
              "correctly and the database content will not reflect the batch of files "
              "that were being processed.")
-    conf.add('paths', nargs='+', help="Paths to files to synchronize. If path points to a folder, it and its "
-             "subfolders will be searched for '.xml'-suffixed files")
+    conf.add('--preload-index', action='store_true', env_var='PRELOAD_INDEX',
+             help="Load provenance information of all records from Document Store when the "
+             "batch starts and use it to find existing records. Reduces the number of queries "
+             "sent to Document Store on large batches.")
+    conf.add('--fingerprint-cache', type=str, env_var='FINGERPRINT_CACHE',
+             help="Path to a file used to store content fingerprints of synchronized records. "
+             "Unchanged records are detected by their fingerprint without comparing them "
+             "field by field. Combined with --preload-index, unchanged records are not queried "
+             "from Document Store at all. Leave unset to not use fingerprints.")
+    conf.add('--concurrency', type=int, default=1, env_var='CONCURRENCY',
+             help="Maximum number of records to upsert concurrently. Records sharing "
+             "provenance information are never upserted concurrently. Note that values greater "
+             "than 1 use a file cache format that is not compatible with the default.")
+    conf.add('--parse-workers', type=int, default=0, env_var='PARSE_WORKERS',
+             help="Number of worker processes used to parse XML files. Use 0 to parse files "
+             "in the main process. Note that values greater than 0 use a file cache format that "
+             "is not compatible with the default.")
+    conf.add('--stream-min-size', type=int, default=0, env_var='STREAM_MIN_SIZE',
+             help="Read OAI-PMH ListRecords files of at least this many bytes one record at a time "
+             "and upsert each record as soon as it is parsed, instead of building the whole document "
+             "in memory. Use 0 to read all files whole. Note that values greater than 0 use a file "
+             "cache format that is not compatible with the default.")
+    conf.add('--archives', action='store_true', env_var='ARCHIVES',
+             help="Also read '.xml.gz' and '.xml.zst' compressed files and the '.xml' members of "
+             "'.zip', '.tar', '.tar.gz' and '.tgz' archives without extracting them to disk. "
+             "'.xml.zst' requires the zstandard package. Changes are detected per archive member. "
+             "Note that this option uses a file cache format that is not compatible with the default.")
+    conf.add('--deduplicate', action='store_true', env_var='DEDUPLICATE',
+             help="Upsert records sharing provenance keys with a record upserted earlier in the batch "
+             "only if they have a newer datestamp. Others are counted as coalesced and not sent to "
+             "Document Store. Note that this option uses a file cache format that is not compatible "
+             "with the default.")
+    conf.add('--id-page-size', type=int, default=0, env_var='ID_PAGE_SIZE',
+             help="Query IDs of existing records in pages of this size and store them compactly "
+             "to keep memory use low when removing records not found in the batch. Use 0 to query "
+             "all IDs at once. Note that values greater than 0 use a file cache format that is not "
+             "compatible with the default.")
+    conf.add('--discovery-workers', type=_positive_int, default=1, env_var='DISCOVERY_WORKERS',
+             help="Number of threads used to list folders and stat files while searching for "
+             "'.xml'-suffixed files. Note that values greater than 1 use a file cache format that "
+             "is not compatible with the default.")
+    conf.add('--directory-manifest', type=str, env_var='DIRECTORY_MANIFEST',
+             help="Path to a file used to store folder listings between runs. Folders whose "
+             "modification time has not changed are not listed again. With --archives, the members "
+             "of unchanged archives are not listed again either. Note that this option uses a file cache "
+             "format that is not compatible with the default.")
+    conf.add('--max-remove-fraction', type=float, env_var='MAX_REMOVE_FRACTION',
+             help="Abort before removing records that were not found in this batch if they make up "
+             "more than this fraction of the records in Document Store, for example 0.1. Guards "
+             "against mass removal when files are missing. Leave unset to not limit removal. Note "
+             "that this option uses a file cache format that is not compatible with the default.")
+    conf.add('--http-client', choices=httpclient.CLIENTS, default=httpclient.CLIENT_SIMPLE,
+             env_var='HTTP_CLIENT',
+             help="HTTP client used for Document Store requests. 'simple' opens a new connection for "
+             "each request. 'curl' keeps connections alive and reuses them, and requires pycurl, "
+             "which is installed with the 'curl' extra.")
+    conf.add('--http-max-clients', type=int, default=10, env_var='HTTP_MAX_CLIENTS',
+             help="Maximum number of Document Store requests in flight. With --http-client curl this "
+             "is also the number of connections kept alive.")
+    conf.add('--gzip-requests', action='store_true', env_var='GZIP_REQUESTS',
+             help="Compress request bodies of at least %s bytes with gzip. Document Store must accept "
+             "compressed requests. Compressed responses are always accepted." % (httpclient.GZIP_MIN_SIZE,))
+    conf.add('--max-retries', type=int, default=0, env_var='MAX_RETRIES',
+             help="Maximum number of retries of Document Store requests that time out or fail with a "
+             "server error. Only requests that are safe to repeat are retried: queries, updates and "
+             "deletes. Retries wait for a random, exponentially growing time. Use 0 to not retry.")
+    conf.add('--adaptive-rate', action='store_true', env_var='ADAPTIVE_RATE',
+             help="Adjust the number of Document Store requests in flight between 1 and "
+             "--http-max-clients based on response times and errors. The number grows while "
+             "Document Store keeps up and is halved when it slows down or fails. Requests over the "
+             "limit wait, which also slows down parsing and upserts.")
+    conf.add('--shard-index', type=int, default=0, env_var='SHARD_INDEX',
+             help="Index of the shard to synchronize, from 0 to --shard-count - 1. Files are assigned "
+             "to shards by a hash of their path, so processes given the same paths and shard count "
+             "synchronize distinct files.")
+    conf.add('--shard-count', type=int, default=1, env_var='SHARD_COUNT',
+             help="Number of shards the files are split into. With more than one shard, records not "
+             "found in the batch are not removed by the shard. Use --seen-ids-dir and a final run "
+             "with --remove-unseen instead. Note that values greater than 1 use a file cache format "
+             "that is not compatible with the default. Use a separate file cache for each shard.")
+    conf.add('--seen-ids-dir', type=str, env_var='SEEN_IDS_DIR',
+             help="Folder shared by all shards for files of record IDs seen by each shard.")
+    conf.add('--remove-unseen', action='store_true', env_var='REMOVE_UNSEEN',
+             help="Do not synchronize files. Remove records that no shard has seen, according to the "
+             "seen-ID files of all --shard-count shards in --seen-ids-dir, and delete the files. Run "
+             "once all shards have finished. Fails if a shard has not written its file.")
+    conf.add('--checkpoint-file', type=str, env_var='CHECKPOINT_FILE',
+             help="Path to a file to journal files completed during the run to. The file is removed "
+             "when the run finishes successfully. Use with --resume to continue a run that was "
+             "interrupted. Note that this option uses a file cache format that is not compatible "
+             "with the default.")
+    conf.add('--checkpoint-interval', type=float, default=60, env_var='CHECKPOINT_INTERVAL',
+             help="Seconds between flushes of --checkpoint-file to disk.")
+    conf.add('--resume', action='store_true', env_var='RESUME',
+             help="Continue an interrupted run from --checkpoint-file. Files completed before the "
+             "interruption are not read again, and their records are not removed as absent.")
+    conf.add('--watch', action='store_true', env_var='WATCH',
+             help="Keep running and synchronize XML files as they change in the watched paths. "
+             "Uses Linux inotify. Changed files are synchronized without removing records. A full "
+             "synchronization, which also removes absent records, runs at start and every "
+             "--reconcile-interval seconds. Note that this option uses a file cache format that is "
+             "not compatible with the default.")
+    conf.add('--watch-debounce', type=float, default=2.0, env_var='WATCH_DEBOUNCE',
+             help="Seconds without new changes before changed files are synchronized in watch mode.")
+    conf.add('--reconcile-interval', type=float, default=3600, env_var='RECONCILE_INTERVAL',
+             help="Seconds between full synchronizations in watch mode.")
+    conf.add('--oai-url', type=str, env_var='OAI_URL',
+             help="Harvest records directly from the OAI-PMH repository at this base URL with "
+             "ListRecords instead of reading files. Records are not written to disk. Records deleted "
+             "in the repository are deleted from Document Store. Of records not found in the batch, "
+             "only those with provenance from this base URL are removed.")
+    conf.add('--oai-metadata-prefix', type=str, default='oai_ddi25', env_var='OAI_METADATA_PREFIX',
+             help="Metadata prefix to harvest with --oai-url.")
+    conf.add('--oai-set', type=str, env_var='OAI_SET',
+             help="Set to harvest with --oai-url. Leave unset to harvest all sets.")
+    conf.add('--oai-state-file', type=str, env_var='OAI_STATE_FILE',
+             help="Path to a file to store the time of the last successful harvest to. Later "
+             "harvests only ask for records changed since. Records not found in the batch are "
+             "removed only when all records are harvested.")
+    conf.add('--stats-file', type=str, env_var='STATS_FILE',
+             help="Path to a file to write a JSON report of the run to. The report contains "
+             "time spent in each stage, record and file counters and latency histograms of "
+             "Document Store requests. Leave unset to not write the report.")
+    conf.add('--prometheus-file', type=str, env_var='PROMETHEUS_FILE',
+             help="Path to a file to write run statistics to in Prometheus text format, "
+             "for the node_exporter textfile collector. The file name should end with '.prom'. "
+             "Leave unset to not write the file.")
+    conf.add('--profile', choices=profiling.PROFILES, env_var='PROFILE',
+             help="Profile the run. 'cpu' writes a cProfile file, 'memory' writes tracemalloc snapshots "
+             "at stage boundaries and 'async' logs callbacks blocking the event loop and timings of "
+             "Document Store queries and updates. Worker processes are not profiled.")
+    conf.add('--profile-dir', type=str, default='.', env_var='PROFILE_DIR',
+             help="Folder to write profiles to with --profile.")
+    conf.add('paths', nargs='*', help="Paths to files to synchronize. If path points to a folder, it and its "
+             "subfolders will be searched for '.xml'-suffixed files. Required unless --oai-url is given.")
     settings = cli_setup.setup_common_modules(cli_setup.MOD_DS_CLIENT,
                                               cli_setup.MOD_LOGGING,
                                               cli_setup.MOD_DS_QUERY)
     return settings
 
 
+def _collection_methods(settings, fingerprints=None):
+    from cdcagg_client import methods as study_methods
+    methods = study_methods.IndexedStudyMethods if settings.preload_index else study_methods.StudyMethods
+    if fingerprints is not None:
+        methods = type(methods.__name__, (methods,), {'fingerprints': fingerprints})
+    return methods
+
+
+def _use_batch_processor(settings):
+    from cdcagg_client import cache
+    return settings.concurrency > 1 or settings.parse_workers > 0 or settings.stream_min_size > 0 or \
+        settings.archives or settings.deduplicate or settings.id_page_size > 0 or \
+        settings.file_cache_backend == cache.BACKEND_SQLITE or \
+        settings.discovery_workers > 1 or \
+        bool(settings.directory_manifest) or \
+        settings.max_remove_fraction is not None or settings.watch or settings.shard_count > 1 or \
+        settings.remove_unseen or bool(settings.checkpoint_file) or bool(settings.oai_url)
+
+
 def run(settings):
     """Run the program with 'settings'.
 
-    Load :class:`BatchProcessor` and call :meth:`BatchProcessor.upsert_run`
+    Load :class:`kuha_client.BatchProcessor` and call
+    :meth:`kuha_client.BatchProcessor.upsert_run`
+
+    If concurrency is greater than one, parse workers are requested,
+    large ListRecords files are streamed, compressed files and archives
+    are read, duplicates are coalesced, IDs are queried in pages,
+    SQLite file cache is requested or files are discovered with
+    multiple threads or a directory manifest, removal is limited,
+    source folders are watched,
+    the run is sharded or checkpointed, or records are harvested from
+    an OAI-PMH repository, use :class:`cdcagg_client.batch.BatchProcessor`.
+
+    Statistics of the run are logged at the end and written to
+    `stats_file` and `prometheus_file` if set, also if the run fails.
+
+    If `profile` is set, the run is profiled with
+    :func:`cdcagg_client.profiling.profile`.
+
+    If `watch` is set, the program keeps running and synchronizes
+    changed files with :func:`cdcagg_client.watch.watch`. Caches are
+    saved and statistics written after each synchronization.
 
     :param :obj:`argparse.Namespace` settings: Use settings to run the program.
     """
+    from cdcagg_client import (
+        profiling,
+        stats
+    )
+    stats.reset()
+    success = False
+    try:
+        with profiling.profile(settings.profile, settings.profile_dir):
+            _run(settings)
+        success = True
+    finally:
+        _finish_stats(settings, success)
+
+
+def _finish_stats(settings, success):
+    from cdcagg_client import stats
+    run_stats = stats.current()
+    run_stats.finish(success)
+    run_stats.log_summary()
+    if settings.stats_file:
+        stats.write_json(run_stats, settings.stats_file)
+    if settings.prometheus_file:
+        stats.write_prometheus(run_stats, settings.prometheus_file)
+
+
+def _after_watch_sync(settings, stores, success):
+    from cdcagg_client import stats
+    # Persist progress, since a long-running process may be killed.
+    for store in stores:
+        if hasattr(store, 'commit'):
+            store.commit()
+        else:
+            store.save()
+    _finish_stats(settings, success)
+    stats.reset()
+
+
+def _harvest(proc, settings, remove_absent):
+    from cdcagg_client import (
+        oai,
+        stats
+    )
+    state = None
+    from_date = None
+    key = oai.HarvestState.key(settings.oai_url, settings.oai_metadata_prefix, settings.oai_set)
+    if settings.oai_state_file:
+        state = oai.HarvestState(settings.oai_state_file)
+        state.load()
+        from_date = state.get(key)
+    if from_date is not None:
+        _logger.info('Harvesting records changed since %s', from_date)
+        if remove_absent:
+            _logger.info('Records not found in the batch are not removed, since the harvest is incremental')
+            remove_absent = False
+    harvester = oai.ListRecordsHarvester(settings.oai_url, settings.oai_metadata_prefix,
+                                         set_spec=settings.oai_set, from_date=from_date)
+    with stats.current().stage('upsert_run'):
+        proc.upsert_harvest_run(harvester, remove_absent=remove_absent)
+    if state is not None and harvester.response_date is not None:
+        state.set(key, harvester.response_date)
+        state.save()
+
+
+def _check_source(settings):
+    if not settings.oai_url:
+        if not settings.paths and not settings.remove_unseen:
+            raise ValueError('Give paths to synchronize or --oai-url')
+        return
+    if settings.paths:
+        raise ValueError('Paths can not be used with --oai-url')
+    if settings.watch or settings.shard_count > 1 or settings.remove_unseen or settings.checkpoint_file:
+        raise ValueError('--oai-url can not be used with --watch, --shard-count, --remove-unseen '
+                         'or --checkpoint-file')
+
+
+def _run(settings):
+    _check_source(settings)
+    if settings.resume and not settings.checkpoint_file:
+        raise ValueError('--resume requires --checkpoint-file')
+    if settings.checkpoint_file and settings.watch:
+        raise ValueError('--checkpoint-file can not be used with --watch')
+    import asyncio
+    import kuha_client
+    from cdcagg_client import (
+        archive,
+        batch,
+        cache,
+        checkpoint,
+        discovery,
+        fingerprint,
+        httpclient,
+        parsers,
+        shard,
+        stats,
+        watch
+    )
+    httpclient.configure(settings.http_client, max_clients=settings.http_max_clients,
+                         gzip_requests=settings.gzip_requests, max_retries=settings.max_retries,
+                         adaptive=settings.adaptive_rate)
     remove_absent = settings.no_remove is False
-    parsers = [DDI122NesstarRecordParser, DDI25RecordParser,
-               DDI31RecordParser, DDI32RecordParser, DDI33RecordParser]
-    collections_methods = [StudyMethods]
-    if settings.file_cache:
-        with kuha_client.open_file_logging_cache(settings.file_cache) as cache:
-            proc = kuha_client.BatchProcessor(collections_methods,
-                                              parsers=parsers,
-                                              cache=cache,
-                                              fail_on_parse=settings.fail_on_parse)
+    format_parsers = parsers.lazy_format_parsers()
+    with ExitStack() as stack:
+        fingerprints = None
+        if settings.fingerprint_cache:
+            fingerprints = stack.enter_context(fingerprint.open_fingerprint_store(settings.fingerprint_cache))
+        proc_kwargs = {'fail_on_parse': settings.fail_on_parse}
+        if _use_batch_processor(settings):
+            if settings.file_cache:
+                proc_kwargs['cache'] = stack.enter_context(cache.open_file_cache(
+                    settings.file_cache, backend=settings.file_cache_backend))
+            if settings.directory_manifest:
+                proc_kwargs['manifest'] = stack.enter_context(
+                    discovery.open_directory_manifest(settings.directory_manifest))
+            if settings.max_remove_fraction is not None:
+                proc_kwargs['max_remove_fraction'] = settings.max_remove_fraction
+            if settings.shard_count > 1:
+                proc_kwargs.update(shard_index=settings.shard_index, shard_count=settings.shard_count)
+                if settings.seen_ids_dir:
+                    proc_kwargs['seen_ids_path'] = shard.seen_ids_path(settings.seen_ids_dir, settings.shard_index,
+                                                                       settings.shard_count)
+            if settings.checkpoint_file:
+                proc_kwargs['checkpoint'] = checkpoint.Checkpoint(settings.checkpoint_file, resume=settings.resume,
+                                                                  interval=settings.checkpoint_interval)
+            proc = batch.BatchProcessor(_collection_methods(settings, fingerprints),
+                                        parsers=list(format_parsers.values()),
+                                        concurrency=settings.concurrency,
+                                        parse_workers=settings.parse_workers,
+                                        stream_min_size=settings.stream_min_size,
+                                        archives=settings.archives,
+                                        deduplicate=settings.deduplicate,
+                                        id_page_size=settings.id_page_size,
+                                        discovery_workers=settings.discovery_workers,
+                                        format_parsers=format_parsers, **proc_kwargs)
+        else:
+            if settings.file_cache:
+                proc_kwargs['cache'] = stack.enter_context(
+                    kuha_client.open_file_logging_cache(settings.file_cache))
+            proc = kuha_client.BatchProcessor([_collection_methods(settings, fingerprints)],
+                                              parsers=[parser.resolve() for parser in format_parsers.values()],
+                                              **proc_kwargs)
+        if settings.remove_unseen:
+            if not settings.seen_ids_dir or settings.shard_count < 2:
+                raise ValueError('--remove-unseen requires --seen-ids-dir and --shard-count greater than 1')
+            proc.remove_unseen_run(shard.read_seen_ids(settings.seen_ids_dir, settings.shard_count))
+            shard.remove_seen_ids(settings.seen_ids_dir, settings.shard_count)
+            return
+        if settings.oai_url:
+            _harvest(proc, settings, remove_absent)
+            return
+        if settings.watch:
+            stores = [proc_kwargs[key] for key in ('cache', 'manifest') if key in proc_kwargs]
+            if fingerprints is not None:
+                stores.append(fingerprints)
+            asyncio.run(watch.watch(proc, settings.paths, remove_absent=remove_absent,
+                                    debounce=settings.watch_debounce,
+                                    reconcile_interval=settings.reconcile_interval,
+                                    after_sync=functools.partial(_after_watch_sync, settings, stores),
+                                    suffixes=archive.source_suffixes(settings.archives)))
+            return
+        with stats.current().stage('upsert_run'):
             proc.upsert_run(settings.paths, remove_absent=remove_absent)
-        return
-    proc = kuha_client.BatchProcessor(collections_methods,
-                                      parsers=parsers,
-                                      fail_on_parse=settings.fail_on_parse)
-    proc.upsert_run(settings.paths, remove_absent=remove_absent)
 
 
 def cli():
@@ -200,6 +456,7 @@ def cli():
     Load configuration, run program, log and
     re-raise propagated exceptions.
     """
+    from kuha_common import conf
     settings = configure()
     if settings.print_configuration:
         print('Print active configuration and exit\n')
@@ -0,0 +1,313 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Watch source folders and synchronize changed files.
+
+:class:`InotifyWatcher` uses Linux inotify through :mod:`ctypes` to
+follow '.xml'-suffixed files, or files with other given suffixes, that
+are written, moved or copied into the watched folders. New subfolders
+are watched as they appear.
+Changed files are queued and handed out once no new changes have
+arrived for `debounce` seconds, or after `max_wait` seconds at the
+latest, so files still being written are not read half way.
+
+:func:`watch` runs a full reconciliation first, then upserts the
+changed files in batches as they are handed out. A full
+reconciliation, which also removes absent records, runs again every
+`reconcile_interval` seconds and whenever the inotify event queue
+overflows. Files removed from the folders are handled by the next
+reconciliation.
+"""
+import os
+import errno
+import ctypes
+import signal
+import struct
+import asyncio
+import logging
+
+
+_logger = logging.getLogger(__name__)
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+#: Events watched on each folder.
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+_EVENT = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+def _libc():
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError(errno.ENOSYS, 'inotify is not available on this platform')
+    return libc
+
+
+def _check(result):
+    if result < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return result
+
+
+class InotifyWatcher:
+    """Queue XML files changed in folders.
+
+    :param list paths: Paths to files and folders to watch.
+    :param float debounce: Seconds without new changes before changed
+                           files are handed out.
+    :param float max_wait: Maximum seconds a changed file waits while
+                           changes keep arriving. Defaults to ten times
+                           `debounce`.
+    :param tuple suffixes: Suffixes of files to follow in folders.
+    """
+
+    def __init__(self, paths, debounce=2.0, max_wait=None, suffixes=('.xml',)):
+        self._paths = [os.path.abspath(path) for path in paths]
+        self.suffixes = suffixes
+        self.debounce = debounce
+        self.max_wait = debounce * 10 if max_wait is None else max_wait
+        #: True if events may have been lost. Reset by :meth:`clear`.
+        self.overflowed = False
+        self._libc = None
+        self._fd = None
+        self._loop = None
+        # Watch descriptor -> folder path.
+        self._folders = {}
+        # Watch descriptor -> names of watched files, or None to watch all files.
+        self._names = {}
+        # Path -> time of latest change.
+        self._pending = {}
+        self._first_pending = None
+        self._changed = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        """Start watching. Must be called from a running event loop."""
+        self._libc = _libc()
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._fd = _check(self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        for path in self._paths:
+            if os.path.isdir(path):
+                self._watch_tree(path)
+            else:
+                self._watch_folder(os.path.dirname(path), name=os.path.basename(path))
+        self._loop.add_reader(self._fd, self._read)
+        _logger.info('Watching %s folders for changes', len(self._folders))
+
+    def close(self):
+        """Stop watching."""
+        if self._fd is None:
+            return
+        self._loop.remove_reader(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        self._folders.clear()
+        self._names.clear()
+
+    def _watch_folder(self, folder, name=None):
+        try:
+            wd = _check(self._libc.inotify_add_watch(self._fd, os.fsencode(folder), WATCH_MASK))
+        except OSError as exc:
+            if exc.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            # Removed before it could be watched.
+            return None
+        self._folders[wd] = folder
+        if name is None or (wd in self._names and self._names[wd] is None):
+            self._names[wd] = None
+        else:
+            self._names.setdefault(wd, set()).add(name)
+        return wd
+
+    def _watch_tree(self, root):
+        """Watch folder and its subfolders. Returns XML files found in them."""
+        found = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            if self._watch_folder(dirpath) is None:
+                dirnames[:] = []
+                continue
+            found.extend(os.path.join(dirpath, filename) for filename in filenames
+                         if filename.endswith(self.suffixes))
+        return found
+
+    def _queue(self, path):
+        now = self._loop.time()
+        if not self._pending:
+            self._first_pending = now
+        self._pending[path] = now
+        self._changed.set()
+
+    def _read(self):
+        try:
+            data = os.read(self._fd, _READ_SIZE)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            self._handle(wd, mask, name)
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            _logger.warning('Inotify event queue overflowed. Changes may have been lost.')
+            self.overflowed = True
+            self._changed.set()
+            return
+        if mask & IN_IGNORED:
+            self._folders.pop(wd, None)
+            self._names.pop(wd, None)
+            return
+        folder = self._folders.get(wd)
+        if folder is None or not name:
+            return
+        path = os.path.join(folder, name)
+        names = self._names.get(wd)
+        if mask & IN_ISDIR:
+            if names is None and mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may have been added before the watch.
+                for found in self._watch_tree(path):
+                    self._queue(found)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and (
+                name in names if names is not None else name.endswith(self.suffixes)):
+            self._queue(path)
+
+    def clear(self):
+        """Forget queued changes and reset :attr:`overflowed`."""
+        self._pending.clear()
+        self._first_pending = None
+        self.overflowed = False
+
+    def _ready(self, now):
+        if not self._pending:
+            return []
+        latest = max(self._pending.values())
+        if now - latest < self.debounce and now - self._first_pending < self.max_wait:
+            return []
+        ready = sorted(path for path, changed in self._pending.items() if now - changed >= self.debounce)
+        if not ready:
+            # Waited max_wait while changes keep arriving.
+            ready = sorted(self._pending)
+        for path in ready:
+            del self._pending[path]
+        self._first_pending = min(self._pending.values()) if self._pending else None
+        return ready
+
+    def _next_ready(self, now):
+        """Seconds until queued changes may be ready or None."""
+        if not self._pending:
+            return None
+        return max(0, min(max(self._pending.values()) + self.debounce, self._first_pending + self.max_wait) - now)
+
+    async def wait_changes(self, timeout=None):
+        """Wait for changed files.
+
+        :param float timeout: Maximum seconds to wait.
+        :returns: Sorted list of changed files. Empty if `timeout` passed
+                  without changes or events were lost, see :attr:`overflowed`.
+        :rtype: list
+        """
+        deadline = None if timeout is None else self._loop.time() + timeout
+        while True:
+            now = self._loop.time()
+            ready = self._ready(now)
+            if ready or self.overflowed:
+                return ready
+            if deadline is not None and now >= deadline:
+                return []
+            waits = [wait for wait in (self._next_ready(now), None if deadline is None else deadline - now)
+                     if wait is not None]
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), min(waits) if waits else None)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def _sync(description, coro):
+    try:
+        await coro
+    except Exception:  # pylint: disable=broad-except
+        # Keep watching. The next reconciliation retries.
+        _logger.exception('%s failed', description)
+        return False
+    return True
+
+
+async def watch(proc, paths, remove_absent=True, debounce=2.0, reconcile_interval=3600, after_sync=None,
+                suffixes=('.xml',)):
+    """Synchronize changed files until cancelled or terminated.
+
+    Failed synchronizations are logged and watching continues.
+    SIGTERM stops watching after the current synchronization.
+
+    :param proc: Batch processor.
+    :type proc: :obj:`cdcagg_client.batch.BatchProcessor`
+    :param list paths: Paths to files and folders.
+    :param bool remove_absent: Remove absent records in reconciliations.
+    :param float debounce: Seconds without new changes before syncing changed files.
+    :param float reconcile_interval: Seconds between full reconciliations.
+    :param callable after_sync: Called with True or False after each
+                                synchronization depending on its success.
+    :param tuple suffixes: Suffixes of files to follow in folders.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    watcher = InotifyWatcher(paths, debounce=debounce, suffixes=suffixes)
+    # Start watching before reconciling, so no change goes unnoticed.
+    watcher.start()
+    try:
+        next_reconcile = loop.time()
+        while not stopping.is_set():
+            if loop.time() >= next_reconcile or watcher.overflowed:
+                # Reconciliation covers queued changes.
+                watcher.clear()
+                _logger.info('Starting full reconciliation')
+                success = await _sync('Reconciliation', proc.upsert_paths(paths, remove_absent=remove_absent))
+                next_reconcile = loop.time() + reconcile_interval
+            else:
+                waiter = asyncio.ensure_future(watcher.wait_changes(timeout=next_reconcile - loop.time()))
+                stopper = asyncio.ensure_future(stopping.wait())
+                await asyncio.wait((waiter, stopper), return_when=asyncio.FIRST_COMPLETED)
+                stopper.cancel()
+                if not waiter.done():
+                    waiter.cancel()
+                    break
+                changed = [path for path in waiter.result() if os.path.isfile(path)]
+                if not changed:
+                    continue
+                _logger.info('Synchronizing %s changed files', len(changed))
+                success = await _sync('Synchronization of changed files', proc.upsert_paths(changed))
+            if after_sync is not None:
+                after_sync(success)
+    finally:
+        watcher.close()
+        loop.remove_signal_handler(signal.SIGTERM)
+    _logger.info('Stopped watching')
@@ -27,6 +27,11 @@ requires = [
     'cdcagg_common>=0.10.0'
 ]
 
+extras = {
+    # Keep-alive connections with --http-client curl.
+    'curl': ['pycurl']
+}
+
 
 setup(name='cdcagg_client',
       version=version,
@@ -35,9 +40,10 @@ setup(name='cdcagg_client',
       license='EUPL v1.2',
       author='Toni Sissala',
       author_email='toni.sissala@tuni.fi',
-      packages=find_packages(exclude=['tests']),
+      packages=find_packages(exclude=['tests', 'benchmarks']),
       include_package_data=True,
       install_requires=requires,
+      extras_require=extras,
       classifiers=(
           'Development Status :: 5 - Production/Stable',
           'Environment :: Console',
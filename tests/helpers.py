@@ -0,0 +1,39 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Helpers shared by tests."""
+from cdcagg_common.records import Study
+
+
+def study_with_provenance(*provenance, _id=None, study_number=None, harvest_date='2000-01-01T00:00:00Z',
+                          datestamp=None):
+    """Create a Study with provenance items.
+
+    :param provenance: (base_url, identifier) tuples, one per provenance item.
+    :param str _id: Record ID.
+    :param str study_number: Study number to add.
+    :param str harvest_date: Value of each provenance item.
+    :param str datestamp: Datestamp of each provenance item.
+    :rtype: :obj:`cdcagg_common.records.Study`
+    """
+    study = Study()
+    if study_number is not None:
+        study.add_study_number(study_number)
+    for base_url, identifier in provenance:
+        if datestamp is None:
+            study._provenance.add_value(harvest_date, base_url=base_url, identifier=identifier)
+        else:
+            study._provenance.add_value(harvest_date, base_url=base_url, identifier=identifier,
+                                        datestamp=datestamp)
+    if _id:
+        study._id.set_value(_id)
+    return study
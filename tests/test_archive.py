@@ -0,0 +1,145 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import gzip
+import tarfile
+import zipfile
+import tempfile
+from datetime import datetime
+from unittest import TestCase, mock
+from cdcagg_client import archive
+
+
+MEMBERS = (('records/a.xml', b'<a/>'), ('records/b.txt', b'b'), ('records/c.xml', b'<c>c</c>'))
+
+
+def write_tar(path, members, mtime=1700000000):
+    with tarfile.open(path, 'w:gz' if path.endswith('gz') else 'w') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = mtime
+            tar.addfile(info, io.BytesIO(data))
+
+
+ZIP_DATE_TIME = (2023, 11, 14, 22, 13, 20)
+
+
+def write_zip(path, members):
+    with zipfile.ZipFile(path, 'w') as zip_file:
+        for name, data in members:
+            zip_file.writestr(zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME), data)
+
+
+class TestArchive(TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive.close_archives)
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def _path(self, name):
+        return os.path.join(self._tmpdir.name, name)
+
+    def test_source_suffixes(self):
+        self.assertEqual(archive.source_suffixes(), ('.xml',))
+        with mock.patch.object(archive, 'zstd_available', return_value=False):
+            self.assertEqual(archive.source_suffixes(archives=True),
+                             ('.xml', '.xml.gz', '.zip', '.tar', '.tar.gz', '.tgz'))
+
+    def test_splits_member_paths(self):
+        path = archive.member_path('/data/x!/bundle.zip', 'dir/a.xml')
+        self.assertEqual(path, '/data/x!/bundle.zip!/dir/a.xml')
+        self.assertEqual(archive.split_member_path(path), ('/data/x!/bundle.zip', 'dir/a.xml'))
+        self.assertEqual(archive.split_member_path('/data/a.xml'), ('/data/a.xml', None))
+        self.assertFalse(archive.is_plain(path))
+        self.assertFalse(archive.is_plain('/data/a.xml.gz'))
+        self.assertTrue(archive.is_plain('/data/a.xml'))
+
+    def test_iterates_xml_members_with_signatures(self):
+        # Zip archives record local time.
+        zip_mtime_ns = int(datetime(*ZIP_DATE_TIME).timestamp()) * 10**9
+        for name, write, mtime_ns in (('bundle.zip', write_zip, zip_mtime_ns),
+                                      ('bundle.tar', write_tar, 1700000000 * 10**9),
+                                      ('bundle.tar.gz', write_tar, 1700000000 * 10**9)):
+            with self.subTest(name=name):
+                path = self._path(name)
+                write(path, MEMBERS)
+                self.assertEqual(list(archive.iterate_members(path)),
+                                 [(path + '!/records/a.xml', (mtime_ns, 4)),
+                                  (path + '!/records/c.xml', (mtime_ns, 8))])
+                self.assertEqual([archive.read_source(member) for member, _ in archive.iterate_members(path)],
+                                 [b'<a/>', b'<c>c</c>'])
+
+    def test_keeps_fractions_of_a_second_of_tar_members(self):
+        path = self._path('bundle.tar')
+        write_tar(path, MEMBERS, mtime=1700000000.5)
+        self.assertEqual([signature for _, signature in archive.iterate_members(path)],
+                         [(1700000000500000000, 4), (1700000000500000000, 8)])
+
+    def test_raises_archive_error_for_invalid_archive(self):
+        path = self._path('bundle.tar.gz')
+        with open(path, 'wb') as file_obj:
+            file_obj.write(b'not an archive')
+        with self.assertRaises(archive.ArchiveError):
+            list(archive.iterate_members(path))
+
+    def test_reads_tar_members_in_one_pass(self):
+        path = self._path('bundle.tar.gz')
+        members = [('%s.xml' % (index,), b'<r>%d</r>' % (index,)) for index in range(5)]
+        write_tar(path, members)
+        with mock.patch.object(archive.tarfile, 'open', wraps=archive.tarfile.open) as mock_open:
+            for name, data in members:
+                member = archive.member_path(path, name)
+                # Sniffed, then parsed.
+                self.assertEqual(archive.open_source(member).read(10), data[:10])
+                self.assertEqual(archive.read_source(member), data)
+            self.assertEqual(archive.read_source(archive.member_path(path, '1.xml')), b'<r>1</r>')
+        mock_open.assert_called_once_with(path)
+
+    def test_reopens_replaced_archive(self):
+        path = self._path('bundle.zip')
+        write_zip(path, [('a.xml', b'<old/>')])
+        self.assertEqual(archive.read_source(path + '!/a.xml'), b'<old/>')
+        write_zip(path + '.new', [('a.xml', b'<new/>')])
+        os.replace(path + '.new', path)
+        self.assertEqual(archive.read_source(path + '!/a.xml'), b'<new/>')
+
+    def test_reads_gzip_files(self):
+        path = self._path('record.xml.gz')
+        with gzip.open(path, 'wb') as file_obj:
+            file_obj.write(b'<record/>')
+        self.assertEqual(archive.read_source(path), b'<record/>')
+        self.assertEqual(b''.join(archive.iterate_chunks(path, read_size=4)), b'<record/>')
+
+    def test_zstd_requires_zstandard(self):
+        path = self._path('record.xml.zst')
+        open(path, 'wb').close()
+        with mock.patch.dict('sys.modules', {'zstandard': None}):
+            with self.assertRaisesRegex(ImportError, 'requires zstandard'):
+                archive.open_source(path)
+
+    def test_iterates_chunks_of_mapped_plain_file(self):
+        path = self._path('record.xml')
+        with open(path, 'wb') as file_obj:
+            file_obj.write(b'<record>content</record>')
+        chunks = [bytes(chunk) for chunk in archive.iterate_chunks(path, read_size=10)]
+        self.assertEqual(chunks, [b'<record>co', b'ntent</rec', b'ord>'])
+        open(path, 'wb').close()
+        self.assertEqual(list(archive.iterate_chunks(path)), [])
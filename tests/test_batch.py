@@ -0,0 +1,699 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gc
+import os.path
+import asyncio
+import zipfile
+import itertools
+import tempfile
+import tracemalloc
+from unittest import mock, TestCase, IsolatedAsyncioTestCase
+import kuha_client
+from kuha_common.query import QueryController
+from cdcagg_common.records import Study
+from cdcagg_common.mappings import (
+    DDI122NesstarRecordParser,
+    DDI25RecordParser,
+    DDI33RecordParser
+)
+from cdcagg_client import (
+    batch,
+    oai
+)
+from cdcagg_client.cache import (
+    FileCache,
+    SQLiteFileCache,
+    file_digest
+)
+from cdcagg_client.checkpoint import Checkpoint
+from cdcagg_client.fingerprint import FingerprintStore
+from cdcagg_client.methods import IndexedStudyMethods
+from cdcagg_client.idset import CompactIdSet
+from tests.helpers import study_with_provenance as _study
+
+
+def _testdata_path(path):
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'testdata', path)
+
+
+class _FakeMethods:
+    """Collection methods storing records in memory by provenance key."""
+
+    collection = 'studies'
+    delay = 0.01
+    existing = None
+    in_flight = 0
+    max_in_flight = 0
+    in_flight_keys = None
+    overlapping_keys = False
+    forgotten = None
+
+    def __init__(self, cache):
+        pass
+
+    @classmethod
+    def configure(cls, existing=None):
+        return type('FakeMethods', (cls,), {'existing': dict(existing or {}),
+                                            'in_flight_keys': set(),
+                                            'forgotten': []})
+
+    def forget_record(self, record_id):
+        self.forgotten.append(record_id)
+
+    async def query_record(self, record):
+        for key in batch.provenance_keys(record):
+            if key in self.existing:
+                old = Study()
+                old._id.set_value(self.existing[key])
+                return old
+        return None
+
+    def _existing_ids(self, base_url):
+        return {record_id for key, record_id in self.existing.items() if base_url in (None, key[0])}
+
+    async def query_distinct_ids(self, base_url=None):
+        return self._existing_ids(base_url)
+
+    async def query_distinct_id_set(self, page_size, base_url=None):
+        return CompactIdSet(sorted(self._existing_ids(base_url)))
+
+    async def upsert_record(self, record, old):
+        cls = type(self)
+        keys = set(batch.provenance_keys(record))
+        if keys & cls.in_flight_keys:
+            cls.overlapping_keys = True
+        cls.in_flight_keys |= keys
+        cls.in_flight += 1
+        cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        await asyncio.sleep(self.delay)
+        cls.in_flight -= 1
+        cls.in_flight_keys -= keys
+        if old is not None:
+            return old.get_id(), batch.UPSERT_UPDATED
+        record_id = 'new_%s' % (len(self.existing),)
+        for key in keys:
+            self.existing[key] = record_id
+        return record_id, batch.UPSERT_CREATED
+
+
+class _FakeParser:
+
+    files = {}
+    documents = {}
+
+    def __init__(self, records):
+        self.studies = records
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(cls.files[path])
+
+    @classmethod
+    def from_string(cls, document):
+        return cls(cls.documents[document])
+
+
+class _LazyParser(_FakeParser):
+    """Parser creating a record with the document as identifier."""
+
+    @classmethod
+    def from_string(cls, document):
+        return cls([_study(('http://some.url', document.decode()))])
+
+
+class _FakeHarvester:
+
+    base_url = 'http://some.url'
+    pages = 1
+
+    def __init__(self, records):
+        self._records = records
+
+    async def iterate(self):
+        for record in self._records:
+            yield record
+
+
+class TestBatchProcessor(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self._files = {}
+        self._documents = {}
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def _add_file(self, name, *records):
+        path = os.path.join(self._tmpdir.name, name)
+        with open(path, 'w') as file_obj:
+            file_obj.write('<xml/>')
+        self._files[path] = list(records)
+        return path
+
+    def _processor(self, methods, **kwargs):
+        parser = type('FakeParser', (_FakeParser,), {'files': self._files, 'documents': self._documents})
+        return batch.BatchProcessor(methods, [parser], **kwargs)
+
+    def test_rejects_invalid_concurrency(self):
+        with self.assertRaises(ValueError):
+            batch.BatchProcessor(_FakeMethods, [], concurrency=0)
+
+    async def test_keeps_concurrency_upserts_in_flight(self):
+        for index in range(10):
+            self._add_file('file_%s.xml' % (index,), _study(('http://some.url', 'id_%s' % (index,))))
+        methods = _FakeMethods.configure()
+        proc = self._processor(methods, concurrency=4)
+        await proc.upsert_paths([self._tmpdir.name])
+        self.assertEqual(methods.max_in_flight, 4)
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 10)
+
+    async def test_keeps_collection_methods_between_batches(self):
+        path = self._add_file('file.xml', _study(('http://some.url', 'id_1')))
+        methods = _FakeMethods.configure()
+        proc = self._processor(methods)
+        with mock.patch.object(methods, '__init__', return_value=None) as mock_init:
+            await proc.upsert_paths([path])
+            await proc.upsert_paths([path])
+        mock_init.assert_called_once_with(None)
+        self.assertEqual(proc.counters[batch.UPSERT_UPDATED], 1)
+
+    def test_rejects_invalid_discovery_workers(self):
+        with self.assertRaises(ValueError):
+            batch.BatchProcessor(_FakeMethods, [], discovery_workers=0)
+
+    async def test_discovers_files_in_subfolders_with_multiple_workers(self):
+        for index in range(4):
+            os.mkdir(os.path.join(self._tmpdir.name, 'sub_%s' % (index,)))
+            self._add_file(os.path.join('sub_%s' % (index,), 'file.xml'),
+                           _study(('http://some.url', 'id_%s' % (index,))))
+        methods = _FakeMethods.configure()
+        proc = self._processor(methods, discovery_workers=3)
+        await proc.upsert_paths([self._tmpdir.name])
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 4)
+
+    async def test_serializes_records_sharing_provenance_key(self):
+        for index in range(6):
+            self._add_file('file_%s.xml' % (index,), _study(('http://some.url', 'shared'),
+                                                            ('http://some.url', 'id_%s' % (index,))))
+        methods = _FakeMethods.configure()
+        proc = self._processor(methods, concurrency=4)
+        await proc.upsert_paths([self._tmpdir.name])
+        self.assertFalse(methods.overlapping_keys)
+        self.assertEqual(methods.max_in_flight, 1)
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 1)
+        self.assertEqual(proc.counters[batch.UPSERT_UPDATED], 5)
+
+    async def test_coalesces_duplicates_of_records_upserted_in_batch(self):
+        for index in range(3):
+            self._add_file('file_%s.xml' % (index,), _study(('http://some.url', 'shared')))
+        cache = FileCache(os.path.join(self._tmpdir.name, 'cache'))
+        methods = _FakeMethods.configure()
+        proc = self._processor(methods, cache=cache, concurrency=4, deduplicate=True)
+        with mock.patch.object(methods, 'upsert_record', autospec=True,
+                               side_effect=methods.upsert_record) as mock_upsert:
+            await proc.upsert_paths([self._tmpdir.name])
+        mock_upsert.assert_called_once()
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 1)
+        self.assertEqual(proc.counters['coalesced'], 2)
+        for index in range(3):
+            path = os.path.join(self._tmpdir.name, 'file_%s.xml' % (index,))
+            self.assertEqual(tuple(cache.get(path).record_ids), ('new_0',))
+
+    async def test_upserts_newer_duplicate(self):
+        self._add_file('file_0.xml', _study(('http://some.url', 'shared'), datestamp='2000-01-01'))
+        self._add_file('file_1.xml', _study(('http://some.url', 'shared'), datestamp='2001-01-01'))
+        self._add_file('file_2.xml', _study(('http://some.url', 'shared'), datestamp='2000-01-01'))
+        methods = _FakeMethods.configure()
+        proc = self._processor(methods, deduplicate=True)
+        await proc.upsert_paths([self._tmpdir.name])
+        self.assertEqual((proc.counters[batch.UPSERT_CREATED], proc.counters[batch.UPSERT_UPDATED],
+                          proc.counters['coalesced']), (1, 1, 1))
+
+    async def test_upserts_duplicates_without_deduplicate(self):
+        for index in range(3):
+            self._add_file('file_%s.xml' % (index,), _study(('http://some.url', 'shared')))
+        methods = _FakeMethods.configure()
+        proc = self._processor(methods)
+        await proc.upsert_paths([self._tmpdir.name])
+        self.assertEqual((proc.counters[batch.UPSERT_CREATED], proc.counters[batch.UPSERT_UPDATED],
+                          proc.counters['coalesced']), (1, 2, 0))
+
+    @mock.patch.object(batch.kuha_client, 'send_delete_record_request')
+    async def test_removes_absent_records(self, mock_delete):
+        self._add_file('file.xml', _study(('http://some.url', 'id_1')))
+        methods = _FakeMethods.configure({('http://some.url', 'id_1'): 'keep_me',
+                                          ('http://some.url', 'id_2'): 'delete_me'})
+        proc = self._processor(methods, concurrency=2)
+        await proc.upsert_paths([self._tmpdir.name], remove_absent=True)
+        mock_delete.assert_called_once_with('studies', record_id='delete_me')
+
+    @mock.patch.object(batch.kuha_client, 'send_delete_record_request')
+    async def test_upserts_harvested_records_and_deletes_deleted(self, mock_delete):
+        self._documents[b'<id_1/>'] = [_study(('http://some.url', 'id_1'))]
+        methods = _FakeMethods.configure({('http://some.url', 'id_2'): 'deleted_upstream',
+                                          ('http://some.url', 'id_3'): 'not_harvested',
+                                          ('http://other.url', 'id_3'): 'other_repository'})
+        proc = self._processor(methods)
+        await proc.upsert_harvest(_FakeHarvester([
+            oai.HarvestedRecord('id_1', '2026-01-01T00:00:00Z', False, b'<id_1/>', 'ddi25'),
+            oai.HarvestedRecord('id_2', '2026-01-02T00:00:00Z', True, None, None)]), remove_absent=True)
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 1)
+        self.assertEqual(mock_delete.call_args_list,
+                         [mock.call('studies', record_id='deleted_upstream'),
+                          mock.call('studies', record_id='not_harvested')])
+
+    async def test_streams_large_list_records_files(self):
+        path = self._add_file('file.xml')
+        for index in range(3):
+            self._documents[b'<id_%d/>' % (index,)] = [_study(('http://some.url', 'id_%s' % (index,)))]
+
+        def _iterate(path):
+            for index in range(3):
+                yield oai.HarvestedRecord('id_%s' % (index,), '2026-01-01', False, b'<id_%d/>' % (index,), None)
+        cache = FileCache(os.path.join(self._tmpdir.name, 'cache'))
+        proc = self._processor(_FakeMethods.configure(), cache=cache, stream_min_size=1)
+        with mock.patch.object(batch.oai, 'is_list_records_file', return_value=True), \
+                mock.patch.object(batch.oai, 'iterate_file_records', side_effect=_iterate):
+            await proc.upsert_paths([path])
+        self.assertEqual((proc.counters['streamed_files'], proc.counters[batch.UPSERT_CREATED]), (1, 3))
+        self.assertEqual(len(cache.get(path).record_ids), 3)
+
+    async def test_does_not_cache_streamed_file_failing_midway(self):
+        path = self._add_file('file.xml')
+        self._documents[b'<id_0/>'] = [_study(('http://some.url', 'id_0'))]
+
+        def _iterate(path):
+            yield oai.HarvestedRecord('id_0', '2026-01-01', False, b'<id_0/>', None)
+            raise ValueError('truncated')
+        cache = FileCache(os.path.join(self._tmpdir.name, 'cache'))
+        proc = self._processor(_FakeMethods.configure(), cache=cache, stream_min_size=1)
+        with mock.patch.object(batch.oai, 'is_list_records_file', return_value=True), \
+                mock.patch.object(batch.oai, 'iterate_file_records', side_effect=_iterate):
+            await proc.upsert_paths([path])
+        self.assertEqual((proc.counters['failed_files'], proc.counters[batch.UPSERT_CREATED]), (1, 1))
+        self.assertIsNone(cache.get(path))
+
+    async def _retained_memory(self, count):
+        path = self._add_file('file_%s.xml' % (count,))
+        created = itertools.count(1)
+
+        def _iterate(path):
+            for index in range(count):
+                yield oai.HarvestedRecord('id_%s' % (index,), '2026-01-01', False, b'id_%d' % (index,), None)
+
+        # Plain functions instead of mocks, which would keep the arguments of every call.
+        async def _query_multiple(*args, **kwargs):
+            return None
+
+        async def _send_create(collection, document):
+            return {'affected_resource': '%024x' % (next(created),)}
+        tracemalloc.start()
+        try:
+            cache = FileCache(os.path.join(self._tmpdir.name, 'cache_%s' % (count,)))
+            fingerprints = FingerprintStore(os.path.join(self._tmpdir.name, 'fingerprints_%s' % (count,)))
+            study_methods = type('IndexedStudyMethods', (IndexedStudyMethods,), {'fingerprints': fingerprints})
+            proc = batch.BatchProcessor(study_methods, [_LazyParser], cache=cache, concurrency=8,
+                                        stream_min_size=1, id_page_size=1000)
+            with mock.patch.object(batch.oai, 'is_list_records_file', return_value=True), \
+                    mock.patch.object(batch.oai, 'iterate_file_records', side_effect=_iterate), \
+                    mock.patch.object(QueryController, 'query_multiple', new=_query_multiple), \
+                    mock.patch.object(kuha_client, 'send_create_record_request', new=_send_create):
+                await proc.upsert_paths([path], remove_absent=True)
+            gc.collect()
+            retained = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], count)
+        self.assertEqual((len(cache.get(path).record_ids), len(fingerprints)), (count, count))
+        return retained
+
+    async def test_retains_compact_summary_per_record(self):
+        # Debug mode keeps a traceback of every task.
+        asyncio.get_running_loop().set_debug(False)
+        small = await self._retained_memory(2000)
+        large = await self._retained_memory(4000)
+        # The provenance index, fingerprints and file cache keep only the
+        # ID, provenance key and fingerprint of each record, which take a
+        # fraction of the memory of a Study and its exports.
+        self.assertLess((large - small) / 2000, 1024)
+
+    async def test_caches_record_ids_in_record_order(self):
+        path = self._add_file('file.xml', *(_study(('http://some.url', 'id_%s' % (index,))) for index in range(5)))
+        cache = FileCache(os.path.join(self._tmpdir.name, 'cache'))
+        methods = _FakeMethods.configure({('http://some.url', 'id_%s' % (index,)): 'record_%s' % (index,)
+                                          for index in range(5)})
+        proc = self._processor(methods, cache=cache, concurrency=5)
+        await proc.upsert_paths([path])
+        self.assertEqual(tuple(cache.get(path).record_ids), tuple('record_%s' % (index,) for index in range(5)))
+
+    @mock.patch.object(batch.kuha_client, 'send_delete_record_request')
+    async def test_removes_absent_records_using_paged_ids(self, mock_delete):
+        self._add_file('file.xml', _study(('http://some.url', 'id_1')))
+        methods = _FakeMethods.configure({('http://some.url', 'id_1'): '%024x' % (1,),
+                                          ('http://some.url', 'id_2'): '%024x' % (2,)})
+        proc = self._processor(methods, id_page_size=10)
+        await proc.upsert_paths([self._tmpdir.name], remove_absent=True)
+        mock_delete.assert_called_once_with('studies', record_id='%024x' % (2,))
+
+    @mock.patch.object(batch.kuha_client, 'send_delete_record_request')
+    async def test_removes_with_concurrency_deletes_in_flight(self, mock_delete):
+        in_flight = set()
+        max_in_flight = []
+
+        async def _delete(collection, record_id):
+            in_flight.add(record_id)
+            max_in_flight.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.discard(record_id)
+        mock_delete.side_effect = _delete
+        methods = _FakeMethods.configure({('http://some.url', 'id_%s' % (index,)): 'record_%s' % (index,)
+                                          for index in range(10)})
+        proc = self._processor(methods, concurrency=4)
+        await proc.upsert_paths([self._tmpdir.name], remove_absent=True)
+        self.assertEqual(proc.counters['removed'], 10)
+        self.assertEqual(max(max_in_flight), 4)
+        self.assertEqual(sorted(methods.forgotten), sorted('record_%s' % (index,) for index in range(10)))
+
+    @mock.patch.object(batch.kuha_client, 'send_delete_record_request')
+    async def test_aborts_removal_over_max_remove_fraction(self, mock_delete):
+        self._add_file('file.xml', _study(('http://some.url', 'id_1')))
+        methods = _FakeMethods.configure({('http://some.url', 'id_1'): 'keep_me',
+                                          ('http://some.url', 'id_2'): 'delete_me_1',
+                                          ('http://some.url', 'id_3'): 'delete_me_2'})
+        proc = self._processor(methods, max_remove_fraction=0.5)
+        with self.assertRaises(batch.RemovalAborted):
+            await proc.upsert_paths([self._tmpdir.name], remove_absent=True)
+        mock_delete.assert_not_called()
+        proc = self._processor(methods, max_remove_fraction=0.7)
+        await proc.upsert_paths([self._tmpdir.name], remove_absent=True)
+        self.assertEqual(mock_delete.call_count, 2)
+
+    def test_rejects_invalid_max_remove_fraction(self):
+        with self.assertRaises(ValueError):
+            batch.BatchProcessor(_FakeMethods, [], max_remove_fraction=1.5)
+
+    @mock.patch.object(batch.kuha_client, 'send_delete_record_request')
+    async def test_does_not_remove_records_of_cached_files(self, mock_delete):
+        self._add_file('file.xml', _study(('http://some.url', 'id_1')))
+        cache = FileCache(os.path.join(self._tmpdir.name, 'cache'))
+        methods = _FakeMethods.configure({('http://some.url', 'id_1'): 'keep_me'})
+        proc = self._processor(methods, cache=cache, concurrency=2)
+        await proc.upsert_paths([self._tmpdir.name], remove_absent=True)
+        self.assertEqual(proc.counters[batch.UPSERT_UPDATED], 1)
+        # Second run reads nothing.
+        await proc.upsert_paths([self._tmpdir.name], remove_absent=True)
+        self.assertEqual(proc.counters[batch.UPSERT_UPDATED], 0)
+        self.assertEqual(proc.counters['cached_files'], 1)
+        mock_delete.assert_not_called()
+
+    async def test_hashes_files_in_executor_for_sqlite_cache(self):
+        path = self._add_file('file.xml', _study(('http://some.url', 'id_1')))
+        os.utime(path, ns=(1000000000, 1000000000))
+        cache = SQLiteFileCache(os.path.join(self._tmpdir.name, 'cache'))
+        cache.load()
+        methods = _FakeMethods.configure({('http://some.url', 'id_1'): 'keep_me'})
+        proc = self._processor(methods, cache=cache)
+        loop = asyncio.get_running_loop()
+        with mock.patch.object(loop, 'run_in_executor', wraps=loop.run_in_executor) as mock_run_in_executor:
+            await proc.upsert_paths([path])
+        mock_run_in_executor.assert_any_call(None, batch.file_digest, path)
+        # Touched but not modified.
+        os.utime(path, ns=(2000000000, 2000000000))
+        with mock.patch.object(cache, 'is_unchanged', wraps=cache.is_unchanged) as mock_is_unchanged:
+            await proc.upsert_paths([path])
+        mock_is_unchanged.assert_called_with(path, (2000000000, 6), content_hash=file_digest(path))
+        self.assertEqual(proc.counters['cached_files'], 1)
+        self.assertEqual(proc.counters[batch.UPSERT_UPDATED], 0)
+        cache.save()
+
+    def _add_zip(self, name, *members):
+        path = os.path.join(self._tmpdir.name, name)
+        with zipfile.ZipFile(path, 'w') as zip_file:
+            for member_name, date_time, document, records in members:
+                zip_file.writestr(zipfile.ZipInfo(member_name, date_time=date_time), document)
+                self._documents[document] = list(records)
+        return path
+
+    async def test_caches_archive_members_separately(self):
+        first = ('a.xml', (2020, 1, 1, 0, 0, 0), b'<a/>', [_study(('http://some.url', 'id_1'))])
+        path = self._add_zip('bundle.zip', first, ('b.xml', (2020, 1, 1, 0, 0, 0), b'<b/>',
+                                                   [_study(('http://some.url', 'id_2'))]))
+        cache = FileCache(os.path.join(self._tmpdir.name, 'cache'))
+        proc = self._processor(_FakeMethods.configure(), cache=cache, concurrency=2, archives=True)
+        await proc.upsert_paths([self._tmpdir.name])
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 2)
+        self.assertEqual(tuple(cache.get(path + '!/b.xml').record_ids), ('new_1',))
+        self._add_zip('bundle.zip', first, ('b.xml', (2020, 1, 2, 0, 0, 0), b'<b>changed</b>',
+                                            [_study(('http://some.url', 'id_2'))]))
+        await proc.upsert_paths([self._tmpdir.name])
+        self.assertEqual((proc.counters['cached_files'], proc.counters[batch.UPSERT_UPDATED]), (1, 1))
+
+    @mock.patch.object(batch.kuha_client, 'send_delete_record_request')
+    async def test_shards_handle_distinct_files_and_write_seen_ids(self, mock_delete):
+        for index in range(8):
+            self._add_file('file_%s.xml' % (index,), _study(('http://some.url', 'id_%s' % (index,))))
+        methods = _FakeMethods.configure({('http://some.url', 'gone'): '%024x' % (99,)})
+        seen_dir = os.path.join(self._tmpdir.name, 'seen')
+        os.mkdir(seen_dir)
+        created = 0
+        for index in range(3):
+            proc = self._processor(methods, shard_index=index, shard_count=3,
+                                   seen_ids_path=os.path.join(seen_dir, str(index)))
+            await proc.upsert_paths([self._tmpdir.name], remove_absent=True)
+            created += proc.counters[batch.UPSERT_CREATED]
+        self.assertEqual(created, 8)
+        mock_delete.assert_not_called()
+        seen = []
+        for index in range(3):
+            with open(os.path.join(seen_dir, str(index))) as file_obj:
+                seen.extend(file_obj.read().split())
+        self.assertEqual(sorted(seen), sorted('new_%s' % (index,) for index in range(1, 9)))
+        proc = self._processor(methods)
+        await proc.remove_unseen(seen)
+        mock_delete.assert_called_once_with('studies', record_id='%024x' % (99,))
+
+    def test_rejects_invalid_shard_index(self):
+        with self.assertRaises(ValueError):
+            batch.BatchProcessor(_FakeMethods, [], shard_index=2, shard_count=2)
+
+    @mock.patch.object(batch.kuha_client, 'send_delete_record_request')
+    async def test_resumes_from_checkpoint_and_removes_absent_records(self, mock_delete):
+        self._add_file('file_1.xml', _study(('http://some.url', 'id_1')))
+        self._add_file('file_2.xml', _study(('http://some.url', 'id_2')))
+        methods = _FakeMethods.configure({('http://some.url', 'gone'): 'delete_me'})
+        upsert_record = methods.upsert_record
+
+        async def _fail_second(self, record, old):
+            if ('http://some.url', 'id_2') in batch.provenance_keys(record):
+                raise ValueError()
+            return await upsert_record(self, record, old)
+        checkpoint_path = os.path.join(self._tmpdir.name, 'checkpoint')
+        with mock.patch.object(methods, 'upsert_record', _fail_second):
+            proc = self._processor(methods, checkpoint=Checkpoint(checkpoint_path))
+            with self.assertRaises(ValueError):
+                await proc.upsert_paths([self._tmpdir.name], remove_absent=True)
+        mock_delete.assert_not_called()
+        proc = self._processor(methods, checkpoint=Checkpoint(checkpoint_path, resume=True))
+        await proc.upsert_paths([self._tmpdir.name], remove_absent=True)
+        self.assertEqual(proc.counters['resumed_files'], 1)
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 1)
+        mock_delete.assert_called_once_with('studies', record_id='delete_me')
+        self.assertFalse(os.path.exists(checkpoint_path))
+
+    async def test_logs_unparseable_file(self):
+        path = self._add_file('file.xml')
+        del self._files[path]
+        proc = self._processor(_FakeMethods.configure())
+        with mock.patch.object(batch._logger, 'exception') as mock_exception:
+            await proc.upsert_paths([path])
+        mock_exception.assert_called_once_with("Unable to parse file '%s'. Is the file valid?", path)
+        self.assertEqual(proc.counters['failed_files'], 1)
+
+    async def test_raises_unparseable_file_with_fail_on_parse(self):
+        path = self._add_file('file.xml')
+        del self._files[path]
+        proc = self._processor(_FakeMethods.configure(), fail_on_parse=True)
+        with self.assertRaises(KeyError):
+            await proc.upsert_paths([path])
+
+    async def test_propagates_upsert_errors(self):
+        self._add_file('file.xml', _study(('http://some.url', 'id_1')))
+        methods = _FakeMethods.configure()
+        methods.upsert_record = mock.AsyncMock(side_effect=ValueError())
+        proc = self._processor(methods, concurrency=2)
+        with self.assertRaises(ValueError):
+            await proc.upsert_paths([self._tmpdir.name])
+
+
+class TestBatchProcessorWithParseWorkers(IsolatedAsyncioTestCase):
+
+    parsers = [DDI122NesstarRecordParser, DDI25RecordParser, DDI33RecordParser]
+
+    def test_parse_record_dicts_exports_parsed_records(self):
+        path = _testdata_path('minimal_ddi122.xml')
+        record_dicts = batch.parse_record_dicts(self.parsers, path)
+        self.assertEqual(record_dicts, [record.export_dict() for record in batch.parse_records(self.parsers, path)])
+
+    def test_rejects_negative_parse_workers(self):
+        with self.assertRaises(ValueError):
+            batch.BatchProcessor(_FakeMethods, [], parse_workers=-1)
+
+    async def test_upserts_records_parsed_in_workers(self):
+        methods = _FakeMethods.configure()
+        proc = batch.BatchProcessor(methods, self.parsers, parse_workers=2, concurrency=2)
+        await proc.upsert_paths([_testdata_path('minimal_ddi122.xml'),
+                                 _testdata_path('no_relpubl_citation_titl_ddi25.xml')])
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 2)
+        self.assertIn(('http://services.fsd.tuni.fi/v0/oai', 'oai:fsd.uta.fi:FSD0115'), methods.existing)
+
+    async def test_reports_parse_errors_per_file(self):
+        inv_path = _testdata_path('unsupported_ddi33.xml')
+        proc = batch.BatchProcessor(_FakeMethods.configure(), self.parsers, parse_workers=2)
+        with mock.patch.object(batch._logger, 'exception') as mock_exception:
+            await proc.upsert_paths([_testdata_path('minimal_ddi122.xml'), inv_path])
+        mock_exception.assert_called_once_with("Unable to parse file '%s'. Is the file valid?", inv_path)
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 1)
+
+    async def test_raises_parse_errors_with_fail_on_parse(self):
+        proc = batch.BatchProcessor(_FakeMethods.configure(), self.parsers, parse_workers=2,
+                                    fail_on_parse=True)
+        with self.assertRaises(Exception):
+            await proc.upsert_paths([_testdata_path('unsupported_ddi33.xml')])
+
+
+class TestBatchProcessorWithFormatParsers(IsolatedAsyncioTestCase):
+
+    parsers = [DDI122NesstarRecordParser, DDI25RecordParser, DDI33RecordParser]
+    format_parsers = {'ddi122': DDI122NesstarRecordParser, 'ddi25': DDI25RecordParser,
+                      'ddi33': DDI33RecordParser}
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def _processor(self, **kwargs):
+        return batch.BatchProcessor(_FakeMethods.configure(), self.parsers,
+                                    format_parsers=self.format_parsers, **kwargs)
+
+    async def test_tries_parser_of_sniffed_format_first(self):
+        path = _testdata_path('no_relpubl_citation_titl_ddi25.xml')
+        proc = self._processor()
+        with mock.patch.object(batch, 'parse_records', wraps=batch.parse_records) as mock_parse:
+            await proc.upsert_paths([path])
+        mock_parse.assert_called_once_with([DDI122NesstarRecordParser, DDI25RecordParser, DDI33RecordParser],
+                                           path)
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 1)
+
+    async def test_skips_unsupported_file_without_parsing(self):
+        path = _testdata_path('unsupported_ddi33.xml')
+        proc = self._processor()
+        with mock.patch.object(batch, 'parse_records') as mock_parse, \
+                mock.patch.object(batch, '_logger') as mock_logger:
+            await proc.upsert_paths([path])
+        mock_parse.assert_not_called()
+        mock_logger.exception.assert_not_called()
+        mock_logger.warning.assert_called_once_with(
+            "Skipping file '%s'. It does not contain a study in a supported format.", path)
+        self.assertEqual((proc.counters['unsupported_files'], proc.counters['failed_files']), (1, 0))
+
+    async def test_does_not_raise_unsupported_file_with_fail_on_parse(self):
+        proc = self._processor(fail_on_parse=True)
+        await proc.upsert_paths([_testdata_path('unsupported_ddi33.xml')])
+        self.assertEqual(proc.counters['unsupported_files'], 1)
+
+    async def test_caches_unsupported_file_until_it_changes(self):
+        path = os.path.join(self._tmpdir.name, 'unsupported.xml')
+        with open(_testdata_path('unsupported_ddi33.xml'), 'rb') as src, open(path, 'wb') as dst:
+            dst.write(src.read())
+        cache = FileCache(os.path.join(self._tmpdir.name, 'cache'))
+        proc = self._processor(cache=cache)
+        await proc.upsert_paths([path])
+        self.assertEqual(cache.get(path).file_format, 'ddi33')
+        with mock.patch.object(batch, 'sniff_file', wraps=batch.sniff_file) as mock_sniff:
+            await proc.upsert_paths([path])
+            mock_sniff.assert_not_called()
+            self.assertEqual(proc.counters['cached_files'], 1)
+            os.utime(path, ns=(1000000000, 1000000000))
+            await proc.upsert_paths([path])
+        mock_sniff.assert_called_once_with(path)
+        self.assertEqual(proc.counters['unsupported_files'], 1)
+
+    async def test_stores_format_to_cache_and_sniffs_changed_file_again(self):
+        path = _testdata_path('minimal_ddi122.xml')
+        cache = FileCache(os.path.join(self._tmpdir.name, 'cache'))
+        proc = self._processor(cache=cache)
+        await proc.upsert_paths([path])
+        self.assertEqual(cache.get(path).file_format, 'ddi122')
+        # Invalidate signature to read the file again.
+        cache.set(path, (0, 0), [], file_format='ddi33')
+        with mock.patch.object(batch, 'sniff_file', wraps=batch.sniff_file) as mock_sniff:
+            await proc.upsert_paths([path])
+        mock_sniff.assert_called_once_with(path)
+        self.assertEqual(cache.get(path).file_format, 'ddi122')
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 1)
+
+    async def test_sends_sniffed_parsers_to_workers(self):
+        proc = self._processor(parse_workers=1)
+        await proc.upsert_paths([_testdata_path('minimal_ddi122.xml'),
+                                 _testdata_path('no_relpubl_citation_titl_ddi25.xml')])
+        self.assertEqual(proc.counters[batch.UPSERT_CREATED], 2)
+
+
+class TestKeyedLocks(IsolatedAsyncioTestCase):
+
+    async def test_locks_are_discarded_after_use(self):
+        locks = batch.KeyedLocks()
+        async with locks.hold(['a', 'b']):
+            self.assertTrue(locks.locked('a'))
+            self.assertEqual(len(locks), 2)
+        self.assertFalse(locks.locked('a'))
+        self.assertEqual(len(locks), 0)
+
+
+class TestBatchDeduplicator(TestCase):
+
+    def test_coalesces_records_with_keys_of_winner(self):
+        deduplicator = batch.BatchDeduplicator()
+        task = mock.Mock(**{'cancelled.return_value': False, 'exception.return_value': None,
+                            'result.return_value': 'record_id'})
+        deduplicator.add(_study(('http://some.url', 'a'), ('http://some.url', 'b')), task)
+        self.assertEqual(len(deduplicator), 2)
+        self.assertIs(deduplicator.winner(_study(('http://some.url', 'b'))), task)
+        # Provenance of another harvest would be lost.
+        self.assertIsNone(deduplicator.winner(_study(('http://some.url', 'b'), ('http://other.url', 'b'))))
+        self.assertIsNone(deduplicator.winner(_study(('http://other.url', 'c'))))
+        # Finished upserts are kept by ID.
+        task.add_done_callback.call_args[0][0](task)
+        self.assertEqual(deduplicator.winner(_study(('http://some.url', 'a'))), 'record_id')
+        deduplicator.discard([('http://some.url', 'a')])
+        self.assertEqual(len(deduplicator), 0)
+
+    def test_coalesces_records_that_are_not_newer(self):
+        deduplicator = batch.BatchDeduplicator()
+        task = mock.Mock()
+        deduplicator.add(_study(('http://some.url', 'a'), datestamp='2020-01-01',
+                                harvest_date='2020-01-03T00:00:00Z'), task)
+        self.assertIs(deduplicator.winner(_study(('http://some.url', 'a'), datestamp='2020-01-01',
+                                                 harvest_date='2020-01-04T00:00:00Z')), task)
+        self.assertIs(deduplicator.winner(_study(('http://some.url', 'a'), datestamp='2019-12-31')), task)
+        # Harvest date is not a datestamp.
+        self.assertIsNone(deduplicator.winner(_study(('http://some.url', 'a'), datestamp='2020-01-02',
+                                                     harvest_date='2020-01-01T00:00:00Z')))
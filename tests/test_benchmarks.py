@@ -0,0 +1,161 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import tempfile
+from unittest import TestCase
+from tornado.testing import AsyncHTTPTestCase
+from cdcagg_common.mappings import (
+    DDI122NesstarRecordParser,
+    DDI25RecordParser,
+    DDI31RecordParser,
+    DDI32RecordParser,
+    DDI33RecordParser
+)
+from benchmarks import corpus, docstore, importtime
+
+
+class TestCorpus(TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def _corpus(self, size=10, **kwargs):
+        return corpus.Corpus(self._tmpdir.name, size, files_per_dir=3, **kwargs)
+
+    def test_generates_all_records(self):
+        synthetic = self._corpus()
+        synthetic.generate()
+        for index in range(synthetic.size):
+            self.assertTrue(os.path.exists(synthetic.record_path(index)))
+        self.assertEqual(synthetic.record_path(7), os.path.join(self._tmpdir.name, 'ddi31', '0002',
+                                                                'record_7.xml'))
+
+    def test_content_is_reproducible(self):
+        self.assertEqual(self._corpus(seed=1).render(3), self._corpus(seed=1).render(3))
+        self.assertNotEqual(self._corpus(seed=1).render(3), self._corpus(seed=2).render(3))
+        self.assertNotEqual(self._corpus().render(3), self._corpus().render(3, revision=1))
+
+    def test_mutate_changes_fraction_of_records(self):
+        synthetic = self._corpus(size=20)
+        synthetic.generate()
+        indexes = synthetic.mutate(0.25)
+        self.assertEqual(len(indexes), 5)
+        with open(synthetic.record_path(indexes[0]), encoding='utf8') as file_obj:
+            self.assertEqual(file_obj.read(), synthetic.render(indexes[0], revision=1))
+
+    def test_rejects_unknown_formats(self):
+        with self.assertRaises(ValueError):
+            self._corpus(formats=('ddi40',))
+
+    def test_records_are_parsed(self):
+        parsers = {'ddi122': DDI122NesstarRecordParser, 'ddi25': DDI25RecordParser,
+                   'ddi31': DDI31RecordParser, 'ddi32': DDI32RecordParser, 'ddi33': DDI33RecordParser}
+        synthetic = self._corpus(size=len(corpus.FORMATS))
+        synthetic.generate()
+        for index in range(synthetic.size):
+            with self.subTest(record_format=synthetic.record_format(index)):
+                parser = parsers[synthetic.record_format(index)].from_file(synthetic.record_path(index))
+                studies = list(parser.studies)
+                self.assertEqual(len(studies), 1)
+
+
+class TestMatches(TestCase):
+
+    document = {'_id': 'id_1',
+                '_metadata': {'status': 'created'},
+                '_provenance': [{'base_url': 'http://some.url', 'identifier': 'oai_1'},
+                                {'base_url': 'http://other.url', 'identifier': 'oai_2'}]}
+
+    def test_matches_elem_match(self):
+        self.assertTrue(docstore.matches(self.document, {'_provenance': {'$elemMatch': {
+            '_provenance.base_url': 'http://some.url', '_provenance.identifier': 'oai_1'}}}))
+        self.assertFalse(docstore.matches(self.document, {'_provenance': {'$elemMatch': {
+            'base_url': 'http://some.url', 'identifier': 'oai_2'}}}))
+
+    def test_matches_or(self):
+        self.assertTrue(docstore.matches(self.document, {'$or': [{'_id': 'id_2'}, {'_id': 'id_1'}]}))
+        self.assertFalse(docstore.matches(self.document, {'$or': [{'_id': 'id_2'}, {'_id': 'id_3'}]}))
+
+    def test_matches_dotted_paths(self):
+        self.assertTrue(docstore.matches(self.document, {'_metadata.status': {'$ne': 'deleted'}}))
+        self.assertTrue(docstore.matches(self.document, {'_provenance.identifier': 'oai_2'}))
+        self.assertTrue(docstore.matches(self.document, {'_id': {'$in': ['id_1', 'id_2']}}))
+
+    def test_matches_gte(self):
+        self.assertTrue(docstore.matches(self.document, {'_id': {'$gte': 'id_1'}}))
+        self.assertFalse(docstore.matches(self.document, {'_id': {'$gte': 'id_2'}}))
+
+
+class TestFakeDocumentStoreApp(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.store = docstore.FakeDocumentStore()
+        return docstore.make_app(self.store)
+
+    def _request(self, method, path, body=None):
+        response = self.fetch('/v6' + path, method=method, raise_error=False,
+                              body=None if body is None else json.dumps(body))
+        return response.code, response.body.decode('utf8')
+
+    def test_create_query_update_delete(self):
+        code, body = self._request('POST', '/studies', {'study_number': 'a'})
+        self.assertEqual(code, 201)
+        record_id = json.loads(body)['affected_resource']
+        code, body = self._request('POST', '/query/studies', {'_filter': {'_id': record_id}, 'limit': 1})
+        self.assertEqual(json.loads(body)['study_number'], 'a')
+        code, _ = self._request('PUT', '/studies/' + record_id, {'study_number': 'b'})
+        self.assertEqual(code, 200)
+        self.assertEqual(self.store.records('studies')[record_id]['_metadata']['status'], 'updated')
+        code, _ = self._request('DELETE', '/studies/' + record_id)
+        self.assertEqual(code, 200)
+        code, body = self._request('POST', '/query/studies?query_type=distinct', {
+            'fieldname': '_id', '_filter': {'_metadata.status': {'$ne': 'deleted'}}})
+        self.assertEqual(json.loads(body), {'_id': []})
+        self.assertEqual(self.store.counters['create'], 1)
+        self.assertEqual(self.store.counters['requests'], 5)
+
+    def test_streams_multiple_records(self):
+        for study_number in ('a', 'b', 'c'):
+            self.store.create('studies', {'study_number': study_number})
+        _, body = self._request('POST', '/query/studies', {'sort_by': '_id', 'skip': 1, 'limit': 2,
+                                                           'fields': ['study_number']})
+        self.assertEqual([json.loads(line)['study_number'] for line in body.splitlines()], ['b', 'c'])
+
+    def test_update_of_unknown_record_is_not_found(self):
+        code, _ = self._request('PUT', '/studies/unknown', {})
+        self.assertEqual(code, 404)
+
+
+class TestImportTime(TestCase):
+
+    def test_parses_importtime_output(self):
+        output = ('import time: self [us] | cumulative | imported package\n'
+                  'import time:       120 |        120 |   cdcagg_client.stats\n'
+                  'import time:       300 |        420 | cdcagg_client.sync\n')
+        times = importtime.parse_importtime(output)
+        self.assertEqual(times, [importtime.ImportTime('cdcagg_client.stats', 120, 120),
+                                 importtime.ImportTime('cdcagg_client.sync', 300, 420)])
+        self.assertEqual(importtime.total_us(times, 'cdcagg_client.sync'), 420)
+
+    def test_sync_does_not_import_deferred_modules(self):
+        modules = importtime.loaded_modules()
+        self.assertIn(importtime.DEFAULT_MODULE, modules)
+        for name in importtime.DEFERRED_MODULES:
+            self.assertNotIn(name, modules)
@@ -0,0 +1,178 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path
+import pickle
+import sqlite3
+import tempfile
+from unittest import TestCase, mock
+from cdcagg_client import cache
+
+
+class TestFileCache(TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'cache')
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def test_entries_persist_between_runs(self):
+        with cache.open_file_cache(self.path) as file_cache:
+            file_cache.set('/some/file.xml', (1, 2), ['id_1'])
+        with cache.open_file_cache(self.path) as file_cache:
+            self.assertTrue(file_cache.is_unchanged('/some/file.xml', (1, 2)))
+            self.assertFalse(file_cache.is_unchanged('/some/file.xml', (1, 3)))
+            self.assertEqual(file_cache.get('/some/file.xml').record_ids, ('id_1',))
+
+    def test_stores_file_format(self):
+        with cache.open_file_cache(self.path) as file_cache:
+            file_cache.set('/some/file.xml', (1, 2), ['id_1'], file_format='ddi25')
+            file_cache.set('/some/other.xml', (1, 2), ['id_2'])
+        with cache.open_file_cache(self.path) as file_cache:
+            self.assertEqual(file_cache.get('/some/file.xml').file_format, 'ddi25')
+            self.assertIsNone(file_cache.get('/some/other.xml').file_format)
+
+    def test_ignores_unsupported_format(self):
+        with open(self.path, 'wb') as file_obj:
+            pickle.dump(['something else'], file_obj)
+        with cache.open_file_cache(self.path) as file_cache:
+            self.assertEqual(len(file_cache), 0)
+
+    def test_keeps_kuha_client_cache_before_overwriting_it(self):
+        content = pickle.dumps({'/some/file.xml': {'mtime': 1.0, 'ids': ['id_1']}})
+        with open(self.path, 'wb') as file_obj:
+            file_obj.write(content)
+        with cache.open_file_cache(self.path) as file_cache:
+            self.assertEqual(len(file_cache), 0)
+            file_cache.set('/some/file.xml', (1, 2), ['id_1'])
+        with open(self.path + '.unsupported', 'rb') as file_obj:
+            self.assertEqual(file_obj.read(), content)
+        with open(self.path, 'rb') as file_obj:
+            self.assertEqual(pickle.load(file_obj)['version'], cache.FileCache.version)
+
+    def test_ignores_corrupted_file(self):
+        with open(self.path, 'wb') as file_obj:
+            file_obj.write(b'not a pickle')
+        file_cache = cache.FileCache(self.path)
+        file_cache.load()
+        self.assertEqual(len(file_cache), 0)
+        self.assertTrue(os.path.exists(self.path + '.unsupported'))
+
+
+class TestSQLiteFileCache(TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'cache')
+        self.source = os.path.join(self._tmpdir.name, 'source.xml')
+        self._write_source('<xml/>')
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def _write_source(self, content, mtime_ns=None):
+        with open(self.source, 'w') as file_obj:
+            file_obj.write(content)
+        if mtime_ns is not None:
+            os.utime(self.source, ns=(mtime_ns, mtime_ns))
+
+    def test_entries_persist_between_runs(self):
+        with cache.open_file_cache(self.path, backend=cache.BACKEND_SQLITE) as file_cache:
+            file_cache.set(self.source, cache.file_signature(self.source), ['id_1', 'id_2'])
+        with cache.open_file_cache(self.path, backend=cache.BACKEND_SQLITE) as file_cache:
+            self.assertEqual(len(file_cache), 1)
+            self.assertTrue(file_cache.is_unchanged(self.source, cache.file_signature(self.source)))
+            self.assertEqual(file_cache.get(self.source).record_ids, ('id_1', 'id_2'))
+            self.assertEqual(list(file_cache.items()), [(self.source, file_cache.get(self.source))])
+
+    def test_touched_file_with_same_content_is_unchanged(self):
+        self._write_source('<xml/>', mtime_ns=1000000000)
+        with cache.open_file_cache(self.path, backend=cache.BACKEND_SQLITE) as file_cache:
+            file_cache.set(self.source, cache.file_signature(self.source), ['id_1'],
+                           content_hash=cache.file_digest(self.source))
+            self._write_source('<xml/>', mtime_ns=2000000000)
+            signature = cache.file_signature(self.source)
+            self.assertFalse(file_cache.is_unchanged(self.source, signature))
+            self.assertTrue(file_cache.is_unchanged(self.source, signature,
+                                                    content_hash=cache.file_digest(self.source)))
+            self.assertEqual(file_cache.get(self.source).mtime_ns, 2000000000)
+            self._write_source('<XML/>', mtime_ns=3000000000)
+            self.assertFalse(file_cache.is_unchanged(self.source, cache.file_signature(self.source),
+                                                     content_hash=cache.file_digest(self.source)))
+
+    def test_does_not_read_files(self):
+        with cache.open_file_cache(self.path, backend=cache.BACKEND_SQLITE) as file_cache:
+            with mock.patch.object(cache, 'file_digest') as mock_file_digest:
+                file_cache.set(self.source, (1, 6), ['id_1'])
+                self.assertFalse(file_cache.is_unchanged(self.source, (2, 6)))
+            mock_file_digest.assert_not_called()
+
+    def test_commits_in_batches(self):
+        file_cache = cache.SQLiteFileCache(self.path, commit_interval=2)
+        file_cache.load()
+        file_cache.set('/some/file_1.xml', (1, 1), ['id_1'], content_hash='hash')
+        file_cache.set('/some/file_2.xml', (1, 1), ['id_2'], content_hash='hash')
+        file_cache.set('/some/file_3.xml', (1, 1), ['id_3'], content_hash='hash')
+        # Another connection sees committed changes only.
+        reader = cache.SQLiteFileCache(self.path)
+        reader.load()
+        self.assertEqual(len(reader), 2)
+        reader.save()
+        file_cache.save()
+
+    def test_migrates_pickle_cache(self):
+        with cache.open_file_cache(self.path) as file_cache:
+            file_cache.set('/some/file.xml', (1, 2), ['id_1'])
+        with cache.open_file_cache(self.path, backend=cache.BACKEND_SQLITE) as file_cache:
+            self.assertEqual(file_cache.get('/some/file.xml'), cache.CacheEntry(1, 2, ('id_1',)))
+            self.assertTrue(file_cache.is_unchanged('/some/file.xml', (1, 2)))
+        self.assertTrue(os.path.exists(self.path + '.pickle'))
+
+    def test_does_not_migrate_kuha_client_cache(self):
+        content = pickle.dumps({self.source: {'mtime': os.stat(self.source).st_mtime, 'ids': ['id_1']}})
+        with open(self.path, 'wb') as file_obj:
+            file_obj.write(content)
+        with cache.open_file_cache(self.path, backend=cache.BACKEND_SQLITE) as file_cache:
+            self.assertEqual(len(file_cache), 0)
+        with open(self.path + '.unsupported', 'rb') as file_obj:
+            self.assertEqual(file_obj.read(), content)
+        self.assertFalse(os.path.exists(self.path + '.pickle'))
+
+    def test_stores_file_format(self):
+        with cache.open_file_cache(self.path, backend=cache.BACKEND_SQLITE) as file_cache:
+            file_cache.set(self.source, cache.file_signature(self.source), ['id_1'], file_format='ddi31')
+        with cache.open_file_cache(self.path, backend=cache.BACKEND_SQLITE) as file_cache:
+            self.assertEqual(file_cache.get(self.source).file_format, 'ddi31')
+
+    def test_adds_file_format_column_to_old_table(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE files (path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, '
+                           'size INTEGER NOT NULL, content_hash TEXT, record_ids TEXT NOT NULL)')
+        connection.execute("INSERT INTO files VALUES ('/some/file.xml', 1, 2, NULL, 'id_1')")
+        connection.commit()
+        connection.close()
+        with cache.open_file_cache(self.path, backend=cache.BACKEND_SQLITE) as file_cache:
+            self.assertEqual(file_cache.get('/some/file.xml'), cache.CacheEntry(1, 2, ('id_1',)))
+            file_cache.set('/some/file.xml', (1, 2), ['id_1'], file_format='ddi122', content_hash='hash')
+            self.assertEqual(file_cache.get('/some/file.xml').file_format, 'ddi122')
+
+    def test_unknown_backend_raises(self):
+        with self.assertRaises(ValueError):
+            with cache.open_file_cache(self.path, backend='unknown'):
+                pass
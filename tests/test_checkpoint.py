@@ -0,0 +1,80 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+from unittest import TestCase
+from cdcagg_client import checkpoint
+
+
+class TestCheckpoint(TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'checkpoint')
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def _interrupted_run(self):
+        journal = checkpoint.Checkpoint(self.path, interval=0)
+        journal.open()
+        journal.add('/some/file.xml', (1, 10), ['id_1', 'id_2'], file_format='ddi25')
+        journal.add('/some/other.xml', (2, 20), ['id_3'])
+        journal.close()
+
+    def test_resume_returns_completed_files_with_unchanged_signature(self):
+        self._interrupted_run()
+        journal = checkpoint.Checkpoint(self.path, resume=True)
+        journal.open()
+        entry = journal.completed('/some/file.xml', (1, 10))
+        self.assertEqual((entry.record_ids, entry.file_format), (('id_1', 'id_2'), 'ddi25'))
+        self.assertIsNone(journal.completed('/some/other.xml', (3, 20)))
+        self.assertIsNone(journal.completed('/some/new.xml', (1, 10)))
+        journal.close()
+
+    def test_without_resume_discards_journal(self):
+        self._interrupted_run()
+        journal = checkpoint.Checkpoint(self.path)
+        journal.open()
+        self.assertIsNone(journal.completed('/some/file.xml', (1, 10)))
+        journal.close()
+        with open(self.path) as file_obj:
+            self.assertEqual(file_obj.read(), '')
+
+    def test_ignores_truncated_line(self):
+        self._interrupted_run()
+        with open(self.path, 'a') as file_obj:
+            file_obj.write('{"path": "/some/cut')
+        journal = checkpoint.Checkpoint(self.path, resume=True)
+        journal.open()
+        journal.add('/some/third.xml', (3, 30), ['id_4'])
+        journal.close()
+        journal = checkpoint.Checkpoint(self.path, resume=True)
+        journal.open()
+        self.assertEqual(len(journal), 3)
+        self.assertIsNotNone(journal.completed('/some/third.xml', (3, 30)))
+        journal.remove()
+        self.assertEqual(os.listdir(self._tmpdir.name), [])
+
+    def test_flushes_at_interval(self):
+        journal = checkpoint.Checkpoint(self.path, interval=3600)
+        journal.open()
+        journal.add('/some/file.xml', (1, 10), ['id_1'])
+        # Buffered until the interval has passed.
+        self.assertEqual(os.path.getsize(self.path), 0)
+        journal.sync()
+        self.assertGreater(os.path.getsize(self.path), 0)
+        journal.close()
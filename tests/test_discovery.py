@@ -0,0 +1,204 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import shutil
+import tarfile
+import zipfile
+import tempfile
+from unittest import TestCase, mock
+from cdcagg_client import discovery
+
+
+# An old enough modification time that listings are not racy.
+OLD_MTIME_NS = 10**18
+
+
+def _walk_xml_files(path):
+    # Same search as cdcagg_client.batch.iterate_xml_files
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.xml'):
+                yield os.path.join(dirpath, filename)
+
+
+def _walk_xml_files_with_signatures(path):
+    for file_path in _walk_xml_files(path):
+        stat_result = os.stat(file_path)
+        yield file_path, (stat_result.st_mtime_ns, stat_result.st_size)
+
+
+class TestDiscoverXmlFiles(TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self._tmpdir.name, 'root')
+        for dirpath in ('a/b', 'a/c', 'b', 'c/d/e'):
+            os.makedirs(os.path.join(self.root, dirpath))
+        for path in ('1.xml', '2.txt', 'a/3.xml', 'a/b/4.xml', 'a/b/5.xml', 'a/c/6.xml', 'c/d/e/7.xml'):
+            self._touch(path)
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def _touch(self, path):
+        path = os.path.join(self.root, path)
+        with open(path, 'w') as file_obj:
+            file_obj.write('<xml/>')
+        return path
+
+    def _age_directories(self):
+        for dirpath, _, _ in os.walk(self.root):
+            os.utime(dirpath, ns=(OLD_MTIME_NS, OLD_MTIME_NS))
+
+    def test_yields_files_in_walk_order(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                discovered = list(discovery.discover_xml_files([self.root], workers=workers, prefetch=2))
+                self.assertEqual([path for path, _ in discovered], list(_walk_xml_files(self.root)))
+
+    def test_yields_signatures(self):
+        path, signature = next(discovery.discover_xml_files([self.root]))
+        self.assertEqual(path, os.path.join(self.root, '1.xml'))
+        self.assertEqual(signature, (os.stat(path).st_mtime_ns, 6))
+
+    def test_yields_file_paths_as_is(self):
+        path = os.path.join(self.root, '2.txt')
+        self.assertEqual([item[0] for item in discovery.discover_xml_files([path])], [path])
+
+    def test_is_lazy(self):
+        discovered = discovery.discover_xml_files([self.root], prefetch=1)
+        with mock.patch.object(discovery, '_list_directory', wraps=discovery._list_directory) as mock_list:
+            next(discovered)
+            discovered.close()
+        # Root and the first subfolder at most.
+        self.assertLessEqual(mock_list.call_count, 2)
+
+    def test_reuses_listings_of_unchanged_directories(self):
+        self._age_directories()
+        manifest = discovery.DirectoryManifest(os.path.join(self._tmpdir.name, 'manifest'))
+        with mock.patch.object(discovery, '_scan_directory', wraps=discovery._scan_directory) as mock_scan:
+            expected = list(discovery.discover_xml_files([self.root], manifest=manifest))
+        self.assertEqual(mock_scan.call_count, 8)
+        manifest.save()
+        manifest = discovery.DirectoryManifest(os.path.join(self._tmpdir.name, 'manifest'))
+        manifest.load()
+        with mock.patch.object(discovery, '_scan_directory', wraps=discovery._scan_directory) as mock_scan:
+            self.assertEqual(list(discovery.discover_xml_files([self.root], manifest=manifest)), expected)
+        mock_scan.assert_not_called()
+
+    def test_lists_changed_directories_again(self):
+        self._age_directories()
+        manifest = discovery.DirectoryManifest(os.path.join(self._tmpdir.name, 'manifest'))
+        list(discovery.discover_xml_files([self.root], manifest=manifest))
+        manifest.save()
+        new_path = self._touch('a/b/8.xml')
+        manifest.load()
+        with mock.patch.object(discovery, '_scan_directory', wraps=discovery._scan_directory) as mock_scan:
+            paths = [path for path, _ in discovery.discover_xml_files([self.root], manifest=manifest)]
+        mock_scan.assert_called_once_with(os.path.join(self.root, 'a', 'b'), mock.ANY)
+        self.assertIn(new_path, paths)
+
+    def test_drops_listings_of_removed_directories_on_save(self):
+        self._age_directories()
+        manifest_path = os.path.join(self._tmpdir.name, 'manifest')
+        manifest = discovery.DirectoryManifest(manifest_path)
+        list(discovery.discover_xml_files([self.root], manifest=manifest))
+        manifest.save()
+        shutil.rmtree(os.path.join(self.root, 'c'))
+        os.utime(self.root, ns=(OLD_MTIME_NS + 1, OLD_MTIME_NS + 1))
+        with mock.patch.object(discovery, '_scan_directory', wraps=discovery._scan_directory) as mock_scan:
+            list(discovery.discover_xml_files([self.root], manifest=manifest))
+        mock_scan.assert_called_once_with(self.root, OLD_MTIME_NS + 1)
+        manifest.save()
+        expected = [self.root] + [os.path.join(self.root, dirpath) for dirpath in ('a', 'a/b', 'a/c', 'b')]
+        with open(manifest_path) as file_obj:
+            self.assertEqual(sorted(json.load(file_obj)['directories']), sorted(expected))
+        self.assertIsNone(manifest.get(os.path.join(self.root, 'c'), OLD_MTIME_NS))
+        self.assertEqual(len(manifest), 0)
+
+    def test_keeps_listings_when_no_directory_was_listed(self):
+        self._age_directories()
+        manifest_path = os.path.join(self._tmpdir.name, 'manifest')
+        manifest = discovery.DirectoryManifest(manifest_path)
+        list(discovery.discover_xml_files([self.root], manifest=manifest))
+        manifest.save()
+        list(discovery.discover_xml_files([os.path.join(self.root, '1.xml')], manifest=manifest))
+        manifest.save()
+        self.assertIsNotNone(manifest.get(self.root, OLD_MTIME_NS))
+        with open(manifest_path) as file_obj:
+            self.assertEqual(len(json.load(file_obj)['directories']), 8)
+
+    def test_does_not_record_recently_modified_directories(self):
+        manifest = discovery.DirectoryManifest(os.path.join(self._tmpdir.name, 'manifest'))
+        list(discovery.discover_xml_files([self.root], manifest=manifest))
+        self.assertEqual(len(manifest), 0)
+
+    def test_skips_unreadable_directories(self):
+        with mock.patch.object(discovery, '_scan_directory', side_effect=PermissionError()):
+            with self.assertLogs(discovery._logger, level='WARNING'):
+                self.assertEqual(list(discovery.discover_xml_files([self.root])), [])
+
+    def test_replaces_archives_by_members(self):
+        archive_path = os.path.join(self.root, 'a', 'bundle.zip')
+        with zipfile.ZipFile(archive_path, 'w') as zip_file:
+            for name in ('records/a.xml', 'records/b.txt', 'records/c.xml'):
+                zip_file.writestr(name, '<xml/>')
+        self._touch('a/b/8.xml.gz')
+        paths = [path for path, _ in discovery.discover_xml_files([self.root], archives=True)]
+        self.assertEqual(paths[:4], [os.path.join(self.root, '1.xml'), os.path.join(self.root, 'a', '3.xml'),
+                                     archive_path + '!/records/a.xml', archive_path + '!/records/c.xml'])
+        self.assertIn(os.path.join(self.root, 'a', 'b', '8.xml.gz'), paths)
+        self.assertEqual([path for path, _ in discovery.discover_xml_files([archive_path], archives=True)],
+                         [archive_path + '!/records/a.xml', archive_path + '!/records/c.xml'])
+        self.assertEqual(list(discovery.discover_xml_files([self.root])), list(_walk_xml_files_with_signatures(
+            self.root)))
+
+    def test_reuses_members_of_unchanged_archives(self):
+        archive_path = os.path.join(self.root, 'a', 'bundle.tar.gz')
+        with tarfile.open(archive_path, 'w:gz') as tar:
+            tar.add(self._touch('a/b/4.xml'), arcname='records/a.xml')
+        os.utime(archive_path, ns=(OLD_MTIME_NS, OLD_MTIME_NS))
+        manifest_path = os.path.join(self._tmpdir.name, 'manifest')
+        manifest = discovery.DirectoryManifest(manifest_path)
+        expected = list(discovery.discover_xml_files([self.root], manifest=manifest, archives=True))
+        self.assertIn((archive_path + '!/records/a.xml', mock.ANY), expected)
+        manifest.save()
+        manifest = discovery.DirectoryManifest(manifest_path)
+        manifest.load()
+        with mock.patch.object(discovery.archive, 'iterate_members') as mock_iterate_members:
+            self.assertEqual(list(discovery.discover_xml_files([self.root], manifest=manifest, archives=True)),
+                             expected)
+            mock_iterate_members.assert_not_called()
+            os.utime(archive_path, ns=(OLD_MTIME_NS + 1, OLD_MTIME_NS + 1))
+            list(discovery.discover_xml_files([self.root], manifest=manifest, archives=True))
+            mock_iterate_members.assert_called_once_with(archive_path)
+
+    def test_skips_unreadable_archives(self):
+        self._touch('a/bundle.tar.gz')
+        with self.assertLogs(discovery._logger, level='WARNING'):
+            paths = [path for path, _ in discovery.discover_xml_files([self.root], archives=True)]
+        self.assertEqual(paths, list(_walk_xml_files(self.root)))
+
+    def test_ignores_manifest_of_other_version(self):
+        path = os.path.join(self._tmpdir.name, 'manifest')
+        with open(path, 'w') as file_obj:
+            json.dump({self.root: [OLD_MTIME_NS, ['1.xml'], []]}, file_obj)
+        manifest = discovery.DirectoryManifest(path)
+        with self.assertLogs(discovery._logger, level='INFO'):
+            manifest.load()
+        self.assertIsNone(manifest.get(self.root, OLD_MTIME_NS))
@@ -0,0 +1,62 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path
+import tempfile
+from unittest import TestCase
+from cdcagg_client import fingerprint
+
+
+class TestDictFingerprint(TestCase):
+
+    def test_is_independent_of_key_order(self):
+        self.assertEqual(fingerprint.dict_fingerprint({'a': 1, 'b': [{'c': 'd', 'e': None}]}),
+                         fingerprint.dict_fingerprint({'b': [{'e': None, 'c': 'd'}], 'a': 1}))
+
+    def test_differs_for_different_content(self):
+        self.assertNotEqual(fingerprint.dict_fingerprint({'a': [1, 2]}),
+                            fingerprint.dict_fingerprint({'a': [2, 1]}))
+
+
+class TestFingerprintStore(TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'fingerprints')
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def test_open_nonexistent_store(self):
+        with fingerprint.open_fingerprint_store(self.path) as store:
+            self.assertEqual(len(store), 0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_fingerprints_persist_between_runs(self):
+        with fingerprint.open_fingerprint_store(self.path) as store:
+            store.set('id_1', 'fp_1')
+            store.set('id_2', 'fp_2')
+            store.discard('id_2')
+        with fingerprint.open_fingerprint_store(self.path) as store:
+            self.assertEqual(store.get('id_1'), 'fp_1')
+            self.assertNotIn('id_2', store)
+
+    def test_saves_on_exception(self):
+        with self.assertRaises(ValueError):
+            with fingerprint.open_fingerprint_store(self.path) as store:
+                store.set('id_1', 'fp_1')
+                raise ValueError()
+        with fingerprint.open_fingerprint_store(self.path) as store:
+            self.assertEqual(store.get('id_1'), 'fp_1')
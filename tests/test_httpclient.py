@@ -0,0 +1,139 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+from cdcagg_client import httpclient
+from benchmarks.docstore import FakeDocumentStore, ServerThread
+
+
+class TestGzipRequests(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.store = FakeDocumentStore(gzip=True)
+        self.server = ServerThread(self.store).__enter__()
+        httpclient.configure(gzip_requests=True)
+        super().setUp()
+
+    def tearDown(self):
+        AsyncHTTPClient.configure(None)
+        self.server.__exit__(None, None, None)
+        super().tearDown()
+
+    async def _create(self, document):
+        request = HTTPRequest(self.server.url + '/studies', method='POST', body=json.dumps(document))
+        response = await AsyncHTTPClient().fetch(request)
+        self.assertNotIn('Content-Encoding', request.headers)
+        return json.loads(response.body)['affected_resource']
+
+    async def test_compresses_large_request_bodies(self):
+        record_id = await self._create({'abstract': 'a' * httpclient.GZIP_MIN_SIZE})
+        self.assertEqual(self.store.counters['gzip_requests'], 1)
+        self.assertEqual(self.store.records('studies')[record_id]['abstract'], 'a' * httpclient.GZIP_MIN_SIZE)
+
+    async def test_sends_small_request_bodies_as_is(self):
+        await self._create({'abstract': 'a'})
+        self.assertEqual(self.store.counters['gzip_requests'], 0)
+
+
+@mock.patch.object(httpclient.AdaptiveMixin, 'retry_backoff', 0)
+class TestRetries(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.store = FakeDocumentStore()
+        self.server = ServerThread(self.store).__enter__()
+        httpclient.configure(max_retries=2, adaptive=True)
+        super().setUp()
+
+    def tearDown(self):
+        AsyncHTTPClient.configure(None)
+        self.server.__exit__(None, None, None)
+        super().tearDown()
+
+    def _fetch(self, path, **kwargs):
+        return AsyncHTTPClient().fetch(self.server.url + path, method='POST', body='{}', **kwargs)
+
+    async def test_retries_queries(self):
+        self.store.failures = 2
+        response = await self._fetch('/query/studies?query_type=count')
+        self.assertEqual(json.loads(response.body), {'count': 0})
+        self.assertEqual(self.store.counters['requests'], 3)
+
+    async def test_gives_up_after_max_retries(self):
+        self.store.failures = 3
+        with self.assertRaises(HTTPClientError) as cm:
+            await self._fetch('/query/studies?query_type=count')
+        self.assertEqual(cm.exception.code, 503)
+        self.assertEqual(self.store.counters['requests'], 3)
+        response = await self._fetch('/query/studies?query_type=count', raise_error=False)
+        self.assertEqual(response.code, 200)
+
+    async def test_does_not_retry_creates(self):
+        self.store.failures = 1
+        response = await self._fetch('/studies', raise_error=False)
+        self.assertEqual(response.code, 503)
+        self.assertEqual(self.store.counters['requests'], 1)
+
+
+class TestAdaptiveLimiter(IsolatedAsyncioTestCase):
+
+    @mock.patch.object(httpclient.time, 'monotonic', return_value=100.0)
+    def test_grows_in_slow_start_and_halves_once_per_latency(self, mock_monotonic):
+        limiter = httpclient.AdaptiveLimiter(8)
+        for _ in range(3):
+            limiter.succeeded(0.01)
+        self.assertEqual(limiter.limit, 4)
+        limiter.failed()
+        limiter.failed()
+        self.assertEqual(limiter.limit, 2)
+        limiter.succeeded(0.01)
+        self.assertEqual(limiter.limit, 2.5)
+        for now in (101.0, 102.0):
+            mock_monotonic.return_value = now
+            limiter.failed()
+        # Not below minimum.
+        self.assertEqual(limiter.limit, 1)
+
+    def test_decreases_when_latency_grows(self):
+        limiter = httpclient.AdaptiveLimiter(8)
+        limiter.succeeded(0.01)
+        limiter.succeeded(0.01)
+        limiter.succeeded(1.0)
+        self.assertEqual(limiter.limit, 1.5)
+
+    async def test_acquire_waits_for_free_slot(self):
+        limiter = httpclient.AdaptiveLimiter(4)
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(waiting.done())
+        limiter.release()
+        await waiting
+        self.assertEqual(limiter.in_flight, 1)
+
+
+class TestConfigure(TestCase):
+
+    def tearDown(self):
+        AsyncHTTPClient.configure(None)
+        super().tearDown()
+
+    def test_configures_client_class(self):
+        httpclient.configure(max_clients=4)
+        self.assertIs(AsyncHTTPClient.configured_class(), httpclient.SimpleAsyncHTTPClient)
+
+    def test_rejects_unknown_client(self):
+        with self.assertRaises(ValueError):
+            httpclient.configure('unknown')
@@ -0,0 +1,54 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from cdcagg_client.idset import CompactIdSet
+
+
+def _oid(number):
+    return '%024x' % (number,)
+
+
+class TestCompactIdSet(TestCase):
+
+    def test_contains_added_ids(self):
+        ids = CompactIdSet(_oid(number) for number in range(0, 100, 2))
+        self.assertEqual(len(ids), 50)
+        self.assertIn(_oid(10), ids)
+        self.assertNotIn(_oid(11), ids)
+
+    def test_discard_removes_ids(self):
+        ids = CompactIdSet(_oid(number) for number in range(10))
+        ids.discard(_oid(3))
+        ids.discard(_oid(3))
+        ids.discard(_oid(100))
+        self.assertEqual(len(ids), 9)
+        self.assertNotIn(_oid(3), ids)
+        self.assertEqual(list(ids), [_oid(number) for number in range(10) if number != 3])
+
+    def test_out_of_order_ids_are_sorted_and_deduplicated(self):
+        ids = CompactIdSet([_oid(5), _oid(1), _oid(3), _oid(1)])
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(list(ids), [_oid(1), _oid(3), _oid(5)])
+        ids.discard(_oid(3))
+        self.assertEqual(list(ids), [_oid(1), _oid(5)])
+
+    def test_supports_ids_that_are_not_objectids(self):
+        ids = CompactIdSet([_oid(1), 'some_id'])
+        self.assertIn('some_id', ids)
+        ids.discard('some_id')
+        self.assertEqual(list(ids), [_oid(1)])
+
+    def test_stores_objectids_compactly(self):
+        ids = CompactIdSet(_oid(number) for number in range(1000))
+        self.assertEqual(ids.nbytes, 1000 * 12 + 1000 // 8)
@@ -0,0 +1,88 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock, IsolatedAsyncioTestCase, TestCase
+from cdcagg_common.records import Study
+from cdcagg_client import index
+from tests.helpers import study_with_provenance as _study
+
+
+class TestProvenanceIndex(TestCase):
+
+    def test_lookup_returns_None_for_unknown_record(self):
+        idx = index.ProvenanceIndex()
+        self.assertIsNone(idx.lookup(_study(('http://some.url', 'id_1'))))
+
+    def test_lookup_returns_entry_of_first_matching_provenance_item(self):
+        idx = index.ProvenanceIndex()
+        idx.add(('http://some.url', 'id_1'), 'first_id', 'first_fp')
+        idx.add(('http://another.url', 'id_2'), 'second_id')
+        entry = idx.lookup(_study(('http://unknown.url', 'id_0'),
+                                  ('http://another.url', 'id_2'),
+                                  ('http://some.url', 'id_1')))
+        self.assertEqual(entry, index.IndexEntry('second_id', None))
+
+    def test_add_record_adds_all_provenance_keys(self):
+        idx = index.ProvenanceIndex()
+        idx.add_record(_study(('http://some.url', 'id_1'), ('http://another.url', 'id_2')),
+                       'some_id', 'some_fp')
+        self.assertEqual(len(idx), 2)
+        self.assertIn(('http://some.url', 'id_1'), idx)
+        self.assertIn(('http://another.url', 'id_2'), idx)
+
+
+class TestProvenanceIndexLoad(IsolatedAsyncioTestCase):
+
+    def _mock_query_multiple(self, pages):
+        pages = list(pages)
+
+        async def _query_multiple(record_class, on_record, **kwargs):
+            for record in pages.pop(0):
+                await on_record(record)
+        return mock.patch.object(index.QueryController, 'query_multiple', side_effect=_query_multiple)
+
+    async def test_load_pages_by_id_until_short_page(self):
+        idx = index.ProvenanceIndex(page_size=2)
+        pages = [[_study(('http://some.url', 'id_1'), _id='id_a'),
+                  _study(('http://some.url', 'id_2'), _id='id_b')],
+                 [_study(('http://some.url', 'id_2'), _id='id_b'),
+                  _study(('http://some.url', 'id_3'), _id='id_c')]]
+        with self._mock_query_multiple(pages) as mock_query_multiple:
+            await idx.load()
+        self.assertEqual(mock_query_multiple.call_count, 2)
+        first_kwargs, second_kwargs = (call[1] for call in mock_query_multiple.call_args_list)
+        self.assertEqual(first_kwargs['limit'], 2)
+        self.assertNotIn('_filter', first_kwargs)
+        self.assertNotIn('skip', second_kwargs)
+        self.assertEqual(second_kwargs['limit'], 3)
+        self.assertEqual(second_kwargs['_filter'], {Study._id: {index.QueryController.fk_constants.from_: 'id_b'}})
+        self.assertTrue(idx.loaded)
+        self.assertEqual(len(idx), 3)
+        self.assertEqual(idx.lookup(_study(('http://some.url', 'id_3'))).record_id, 'id_c')
+
+    async def test_load_stops_when_page_repeats_only_last_record(self):
+        idx = index.ProvenanceIndex(page_size=1)
+        pages = [[_study(('http://some.url', 'id_1'), _id='id_a')],
+                 [_study(('http://some.url', 'id_1'), _id='id_a')]]
+        with self._mock_query_multiple(pages) as mock_query_multiple:
+            await idx.load()
+        self.assertEqual(mock_query_multiple.call_count, 2)
+        self.assertEqual(len(idx), 1)
+
+    async def test_load_keeps_first_record_of_shared_key(self):
+        idx = index.ProvenanceIndex(page_size=10)
+        pages = [[_study(('http://some.url', 'id_1'), _id='id_a'),
+                  _study(('http://some.url', 'id_1'), _id='id_b')]]
+        with self._mock_query_multiple(pages):
+            await idx.load()
+        self.assertEqual(idx.lookup(_study(('http://some.url', 'id_1'))).record_id, 'id_a')
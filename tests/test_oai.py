@@ -0,0 +1,175 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import gzip
+import shutil
+import tempfile
+import tracemalloc
+from unittest import IsolatedAsyncioTestCase, TestCase
+from xml.etree import ElementTree
+from tornado.httpclient import AsyncHTTPClient
+from cdcagg_client import oai
+from cdcagg_client.sniff import OAI_NS
+from benchmarks.oaipmh import FakeRepository, OAIServerThread
+
+
+_DDI25 = '<codeBook xmlns="ddi:codebook:2_5"><stdyDscr/></codeBook>'
+
+
+class TestListRecordsHarvester(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.repository = FakeRepository(page_size=2)
+        self.server = OAIServerThread(self.repository).__enter__()
+        super().setUp()
+
+    def tearDown(self):
+        AsyncHTTPClient.configure(None)
+        self.server.__exit__(None, None, None)
+        super().tearDown()
+
+    async def _harvest(self, **kwargs):
+        harvester = oai.ListRecordsHarvester(self.server.url, 'oai_ddi25', **kwargs)
+        return harvester, [record async for record in harvester.iterate()]
+
+    async def test_follows_resumption_tokens(self):
+        for index in range(5):
+            self.repository.add('id_%s' % (index,), '2026-01-0%sT00:00:00Z' % (index + 1,), _DDI25)
+        harvester, records = await self._harvest()
+        self.assertEqual([record.identifier for record in records], ['id_%s' % (index,) for index in range(5)])
+        self.assertEqual(harvester.pages, 3)
+        self.assertEqual(harvester.response_date, self.repository.response_date)
+        self.assertEqual({record.file_format for record in records}, {'ddi25'})
+
+    async def test_wraps_records_in_get_record_envelope(self):
+        self.repository.add('id_1', '2026-01-01T00:00:00Z', _DDI25)
+        _, (record,) = await self._harvest()
+        root = ElementTree.fromstring(record.document)
+        request = root.find('{%s}request' % (OAI_NS,))
+        self.assertEqual((request.get('verb'), request.get('identifier'), request.text),
+                         ('GetRecord', 'id_1', self.server.url))
+        self.assertIsNotNone(root.find('{%s}GetRecord/{%s}record/{%s}metadata/{ddi:codebook:2_5}codeBook'
+                                       % (OAI_NS, OAI_NS, OAI_NS)))
+
+    async def test_returns_deleted_records(self):
+        self.repository.add('id_1', '2026-01-01T00:00:00Z', _DDI25)
+        self.repository.add('id_2', '2026-01-02T00:00:00Z')
+        _, records = await self._harvest()
+        self.assertEqual([(record.identifier, record.deleted, record.document is None) for record in records],
+                         [('id_1', False, False), ('id_2', True, True)])
+
+    async def test_harvests_from_date_with_repository_granularity(self):
+        self.repository.granularity = oai.GRANULARITY_DAYS
+        self.repository.add('id_1', '2026-01-01', _DDI25, sets=('some_set',))
+        self.repository.add('id_2', '2026-01-02', _DDI25, sets=('some_set',))
+        self.repository.add('id_3', '2026-01-03', _DDI25)
+        _, records = await self._harvest(from_date='2026-01-02T12:00:00Z', set_spec='some_set')
+        self.assertEqual([record.identifier for record in records], ['id_2'])
+        self.assertEqual(self.repository.requests[-1],
+                         {'verb': 'ListRecords', 'metadataPrefix': 'oai_ddi25', 'from': '2026-01-02',
+                          'set': 'some_set'})
+
+    async def test_raises_on_errors(self):
+        self.repository.add('id_1', '2026-01-01T00:00:00Z', _DDI25)
+        harvester = oai.ListRecordsHarvester(self.server.url, 'oai_dc')
+        with self.assertRaises(oai.OAIError) as cm:
+            [record async for record in harvester.iterate()]
+        self.assertEqual(cm.exception.code, 'cannotDisseminateFormat')
+
+
+def _list_records_file(path, count, abstract=''):
+    with open(path, 'w', encoding='utf8') as file_obj:
+        file_obj.write('<OAI-PMH xmlns="%s"><responseDate>2026-01-01T00:00:00Z</responseDate>'
+                       '<request verb="ListRecords" metadataPrefix="oai_ddi25">http://some.url/oai</request>'
+                       '<ListRecords>' % (OAI_NS,))
+        for index in range(count):
+            file_obj.write('<record><header><identifier>id_%s</identifier><datestamp>2026-01-01</datestamp>'
+                           '</header><metadata><codeBook xmlns="ddi:codebook:2_5"><stdyDscr>'
+                           '<abstract>%s</abstract></stdyDscr></codeBook></metadata></record>'
+                           % (index, abstract))
+        file_obj.write('<record><header status="deleted"><identifier>id_deleted</identifier>'
+                       '<datestamp>2026-01-01</datestamp></header></record>')
+        file_obj.write('</ListRecords></OAI-PMH>')
+
+
+class TestFileRecords(TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'records.xml')
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def test_detects_list_records_files(self):
+        _list_records_file(self.path, 1)
+        self.assertTrue(oai.is_list_records_file(self.path))
+        with open(self.path, 'w', encoding='utf8') as file_obj:
+            file_obj.write('<OAI-PMH xmlns="%s"><responseDate/><request/><GetRecord/></OAI-PMH>' % (OAI_NS,))
+        self.assertFalse(oai.is_list_records_file(self.path))
+        with open(self.path, 'w', encoding='utf8') as file_obj:
+            file_obj.write('<ListRecords xmlns="%s"/>' % (OAI_NS,))
+        self.assertFalse(oai.is_list_records_file(self.path))
+
+    def test_reads_records_with_request_of_file(self):
+        _list_records_file(self.path, 3)
+        records = list(oai.iterate_file_records(self.path, read_size=100))
+        self.assertEqual([(record.identifier, record.deleted) for record in records],
+                         [('id_0', False), ('id_1', False), ('id_2', False), ('id_deleted', True)])
+        request = ElementTree.fromstring(records[0].document).find('{%s}request' % (OAI_NS,))
+        self.assertEqual((request.text, request.get('metadataPrefix')), ('http://some.url/oai', 'oai_ddi25'))
+
+    def test_reads_records_of_compressed_file(self):
+        _list_records_file(self.path, 2)
+        with open(self.path, 'rb') as src, gzip.open(self.path + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        self.assertTrue(oai.is_list_records_file(self.path + '.gz'))
+        self.assertEqual([record.identifier for record in oai.iterate_file_records(self.path + '.gz', read_size=100)],
+                         ['id_0', 'id_1', 'id_deleted'])
+
+    def _peak_memory(self, count):
+        _list_records_file(self.path, count, abstract='a' * 1000)
+        tracemalloc.start()
+        try:
+            for _ in oai.iterate_file_records(self.path):
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_memory_does_not_grow_with_file_size(self):
+        small = self._peak_memory(500)
+        large = self._peak_memory(5000)
+        self.assertLess(large, small * 1.5)
+        self.assertLess(large, os.path.getsize(self.path) / 10)
+
+
+class TestHarvestState(TestCase):
+
+    def test_saves_and_loads_dates_by_harvest(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'state.json')
+            state = oai.HarvestState(path)
+            state.load()
+            key = oai.HarvestState.key('http://some.url/oai', 'oai_ddi25')
+            self.assertIsNone(state.get(key))
+            state.set(key, '2026-01-01T00:00:00Z')
+            state.save()
+            state = oai.HarvestState(path)
+            state.load()
+            self.assertEqual(state.get(key), '2026-01-01T00:00:00Z')
+            self.assertIsNone(state.get(oai.HarvestState.key('http://some.url/oai', 'oai_ddi25', 'some_set')))
+            self.assertEqual(os.listdir(tmpdir), ['state.json'])
@@ -0,0 +1,42 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+from unittest import TestCase, mock
+from cdcagg_client import parsers
+
+
+class TestLazyParser(TestCase):
+
+    @mock.patch.object(parsers.importlib, 'import_module')
+    def test_imports_parser_class_on_first_use(self, mock_import_module):
+        lazy = parsers.LazyParser('DDI25RecordParser')
+        mock_import_module.assert_not_called()
+        parser_class = mock_import_module.return_value.DDI25RecordParser
+        self.assertIs(lazy.from_file('/some/file.xml'), parser_class.from_file.return_value)
+        self.assertIs(lazy.from_string(b'<xml/>'), parser_class.from_string.return_value)
+        mock_import_module.assert_called_once_with('cdcagg_common.mappings')
+        parser_class.from_file.assert_called_once_with('/some/file.xml')
+
+    def test_pickles_without_parser_class(self):
+        lazy = parsers.LazyParser('DDI25RecordParser')
+        lazy._parser_class = object
+        unpickled = pickle.loads(pickle.dumps(lazy))
+        self.assertEqual(unpickled, lazy)
+        self.assertIsNone(unpickled._parser_class)
+
+    def test_format_parsers_are_in_order(self):
+        format_parsers = parsers.lazy_format_parsers()
+        self.assertEqual(list(format_parsers), ['ddi122', 'ddi25', 'ddi31', 'ddi32', 'ddi33'])
+        self.assertEqual(format_parsers['ddi25'], parsers.LazyParser('DDI25RecordParser'))
+        self.assertNotEqual(format_parsers['ddi25'], format_parsers['ddi33'])
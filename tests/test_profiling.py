@@ -0,0 +1,89 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pstats
+import asyncio
+import tempfile
+import tracemalloc
+from unittest import TestCase
+from cdcagg_client import profiling, stats
+
+
+@profiling.timed('sleep')
+async def _sleep(result):
+    await asyncio.sleep(0)
+    return result
+
+
+class TestProfile(TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self._tmpdir.name, 'profiles')
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def test_without_mode_does_not_profile(self):
+        with profiling.profile(None, self.directory):
+            self.assertEqual(asyncio.run(_sleep(1)), 1)
+            self.assertIsNone(stats._stage_listener)
+        self.assertFalse(os.path.exists(self.directory))
+
+    def test_rejects_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            with profiling.profile('disk', self.directory):
+                pass
+
+    def test_cpu_writes_pstats_file(self):
+        with self.assertRaises(ValueError):
+            with profiling.profile(profiling.PROFILE_CPU, self.directory):
+                sorted(range(1000), key=str)
+                raise ValueError()
+        profile_stats = pstats.Stats(os.path.join(self.directory, profiling.CPU_PROFILE_FILE))
+        self.assertTrue(any('sorted' in funcname for _, _, funcname in profile_stats.stats))
+
+    def test_memory_snapshots_stage_boundaries(self):
+        with profiling.profile(profiling.PROFILE_MEMORY, self.directory):
+            with stats.current().stage('upsert_run'):
+                with stats.current().stage('compare'):
+                    data = [bytes(1000) for _ in range(100)]
+        del data
+        self.assertIsNone(stats._stage_listener)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['memory-000-run-start.snapshot', 'memory-001-upsert_run-start.snapshot',
+                          'memory-002-upsert_run-end.snapshot', 'memory-003-run-end.snapshot'])
+        snapshot = tracemalloc.Snapshot.load(os.path.join(self.directory, 'memory-002-upsert_run-end.snapshot'))
+        self.assertGreater(sum(stat.size for stat in snapshot.statistics('filename')
+                               if stat.traceback[0].filename == __file__), 100000)
+
+    def test_async_times_coroutines_in_debug_loops(self):
+
+        async def _loop_settings():
+            loop = asyncio.get_running_loop()
+            await _sleep(None)
+            return loop.get_debug(), loop.slow_callback_duration
+
+        policy = asyncio.get_event_loop_policy()
+        with profiling.profile_async(slow_callback_duration=0.5) as timings:
+            loop_settings = asyncio.run(_loop_settings())
+            asyncio.run(_sleep(None))
+        self.assertEqual(loop_settings, (True, 0.5))
+        self.assertEqual(timings.timings['sleep'][1], 2)
+        self.assertIs(asyncio.get_event_loop_policy(), policy)
+        asyncio.run(_sleep(None))
+        self.assertEqual(timings.timings['sleep'][1], 2)
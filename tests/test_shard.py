@@ -0,0 +1,56 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+from unittest import TestCase
+from cdcagg_client import shard
+
+
+class TestShardOf(TestCase):
+
+    def test_is_stable_and_spreads_files(self):
+        self.assertEqual(shard.shard_of('/data/provider/record_1.xml', 4), 1)
+        counts = [0] * 4
+        for index in range(1000):
+            counts[shard.shard_of('/data/provider/record_%s.xml' % (index,), 4)] += 1
+        self.assertEqual(sum(counts), 1000)
+        self.assertTrue(all(200 < count < 300 for count in counts), counts)
+
+
+class TestSeenIds(TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.directory = self._tmpdir.name
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def test_reads_ids_of_all_shards(self):
+        shard.write_seen_ids(shard.seen_ids_path(self.directory, 0, 2), ['id_1', 'id_2'])
+        shard.write_seen_ids(shard.seen_ids_path(self.directory, 1, 2), ['id_3'])
+        self.assertEqual(sorted(shard.read_seen_ids(self.directory, 2)), ['id_1', 'id_2', 'id_3'])
+        self.assertEqual(sorted(os.listdir(self.directory)), ['seen-0-of-2.ids', 'seen-1-of-2.ids'])
+
+    def test_raises_if_shard_is_missing(self):
+        shard.write_seen_ids(shard.seen_ids_path(self.directory, 0, 2), ['id_1'])
+        with self.assertRaises(shard.IncompleteShards):
+            shard.read_seen_ids(self.directory, 2)
+
+    def test_removes_files_of_all_shards(self):
+        shard.write_seen_ids(shard.seen_ids_path(self.directory, 1, 3), ['id_1'])
+        shard.remove_seen_ids(self.directory, 3)
+        self.assertEqual(os.listdir(self.directory), [])
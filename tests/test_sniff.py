@@ -0,0 +1,68 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path
+import tempfile
+from unittest import TestCase
+from cdcagg_client import sniff
+
+
+def _testdata_path(path):
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'testdata', path)
+
+
+class TestSniffFile(TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def _sniff(self, content, **kwargs):
+        path = os.path.join(self._tmpdir.name, 'file.xml')
+        with open(path, 'w', encoding='utf8') as file_obj:
+            file_obj.write(content)
+        return sniff.sniff_file(path, **kwargs)
+
+    def test_detects_testdata(self):
+        for name, expected in (('minimal_ddi122.xml', ('ddi122', True)),
+                               ('minimal_ddi32.xml', ('ddi32', True)),
+                               ('no_relpubl_citation_titl_ddi25.xml', ('ddi122', True)),
+                               ('unsupported_ddi33.xml', ('ddi33', False))):
+            with self.subTest(name=name):
+                self.assertEqual(sniff.sniff_file(_testdata_path(name), read_size=64), expected)
+
+    def test_detects_document_root_without_oai_envelope(self):
+        self.assertEqual(self._sniff('<codeBook xmlns="ddi:codebook:2_5"><stdyDscr/></codeBook>'),
+                         ('ddi25', True))
+        self.assertEqual(self._sniff('<DDIInstance xmlns="ddi:instance:3_1"><s:StudyUnit '
+                                     'xmlns:s="ddi:studyunit:3_1"/></DDIInstance>'),
+                         ('ddi31', True))
+
+    def test_unknown_namespace_is_left_to_parser(self):
+        self.assertEqual(self._sniff('<codeBook><stdyDscr/></codeBook>'), (None, True))
+
+    def test_rejects_other_roots(self):
+        self.assertEqual(self._sniff('<html><body/></html>'), (None, False))
+        self.assertEqual(self._sniff('<OAI-PMH xmlns="%s"><error/></OAI-PMH>' % (sniff.OAI_NS,)),
+                         (None, False))
+
+    def test_stops_reading_at_max_bytes(self):
+        content = '<codeBook xmlns="ddi:codebook:2_5"><docDscr>%s</docDscr><stdyDscr/></codeBook>' % ('x' * 200,)
+        self.assertEqual(self._sniff(content, read_size=16, max_bytes=64), ('ddi25', True))
+
+    def test_malformed_file_is_left_to_parser(self):
+        self.assertEqual(self._sniff('<codeBook xmlns="ddi:codebook:2_5"><a></b>'), (None, True))
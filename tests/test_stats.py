@@ -0,0 +1,116 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import tempfile
+from unittest import TestCase, mock
+from cdcagg_client import stats
+
+
+class TestHistogram(TestCase):
+
+    def test_counts_values_in_buckets(self):
+        histogram = stats.Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative(), [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 2.65)
+
+
+class TestRunStats(TestCase):
+
+    def setUp(self):
+        self.run_stats = stats.RunStats()
+        super().setUp()
+
+    def test_stage_accumulates_time_and_calls(self):
+        with mock.patch.object(stats.time, 'perf_counter', side_effect=[1.0, 1.5, 2.0, 3.0]):
+            for _ in range(2):
+                with self.run_stats.stage('parse'):
+                    pass
+        self.assertEqual(self.run_stats.stages, {'parse': [1.5, 2]})
+
+    def test_stage_calls_listener_at_start_and_end(self):
+        listener = mock.Mock()
+        stats.set_stage_listener(listener)
+        self.addCleanup(stats.set_stage_listener, None)
+        with self.assertRaises(ValueError):
+            with self.run_stats.stage('remove'):
+                listener.assert_called_once_with('remove', True)
+                raise ValueError()
+        self.assertEqual(listener.call_args_list, [mock.call('remove', True), mock.call('remove', False)])
+        self.assertEqual(self.run_stats.stages['remove'][1], 1)
+
+    def test_request_counts_errors(self):
+        with self.assertRaises(ValueError):
+            with self.run_stats.request('update'):
+                raise ValueError()
+        self.assertEqual(self.run_stats.requests['update'].count, 1)
+        self.assertEqual(self.run_stats.counters['request_errors'], 1)
+
+    def test_report(self):
+        self.run_stats.increment('created', 3)
+        self.run_stats.increment('unchanged')
+        self.run_stats.add_stage_time('parse', 0.5)
+        self.run_stats.requests['query'] = stats.Histogram(buckets=(0.1,))
+        self.run_stats.requests['query'].observe(0.05)
+        self.run_stats.finish(True)
+        self.run_stats.wall_seconds = 2.0
+        report = self.run_stats.report()
+        self.assertEqual(report['counters'], {'created': 3, 'unchanged': 1})
+        self.assertEqual(report['records_per_second'], 2.0)
+        self.assertEqual(report['stages'], {'parse': {'seconds': 0.5, 'calls': 1}})
+        self.assertEqual(report['requests'], {'query': {'count': 1, 'sum': 0.05,
+                                                        'buckets': {'0.1': 1, '+Inf': 1}}})
+        self.assertTrue(report['success'])
+
+    def test_prometheus_text(self):
+        self.run_stats.increment('deleted', 2)
+        self.run_stats.increment('failed_files')
+        self.run_stats.requests['delete'] = stats.Histogram(buckets=(0.1,))
+        self.run_stats.requests['delete'].observe(0.2)
+        self.run_stats.finish(False)
+        lines = self.run_stats.prometheus_text().splitlines()
+        self.assertIn('cdcagg_client_last_run_success 0', lines)
+        self.assertIn('cdcagg_client_records{outcome="deleted"} 2', lines)
+        self.assertIn('cdcagg_client_files{outcome="failed"} 1', lines)
+        self.assertIn('# TYPE cdcagg_client_docstore_request_duration_seconds histogram', lines)
+        self.assertIn('cdcagg_client_docstore_request_duration_seconds_bucket{request="delete",le="0.1"} 0', lines)
+        self.assertIn('cdcagg_client_docstore_request_duration_seconds_bucket{request="delete",le="+Inf"} 1', lines)
+        self.assertIn('cdcagg_client_docstore_request_duration_seconds_count{request="delete"} 1', lines)
+
+
+class TestWriteFiles(TestCase):
+
+    def test_writes_json_and_prometheus_files(self):
+        run_stats = stats.RunStats()
+        run_stats.finish(True)
+        with tempfile.TemporaryDirectory() as dirname:
+            json_path = os.path.join(dirname, 'stats.json')
+            prom_path = os.path.join(dirname, 'stats.prom')
+            stats.write_json(run_stats, json_path)
+            stats.write_prometheus(run_stats, prom_path)
+            with open(json_path) as file_obj:
+                self.assertTrue(json.load(file_obj)['success'])
+            with open(prom_path) as file_obj:
+                self.assertEqual(file_obj.read(), run_stats.prometheus_text())
+            self.assertEqual(os.stat(prom_path).st_mode & 0o777, 0o644)
+            self.assertEqual(sorted(os.listdir(dirname)), ['stats.json', 'stats.prom'])
+
+    def test_reset_replaces_current_stats(self):
+        old = stats.current()
+        new = stats.reset()
+        self.assertIsNot(old, new)
+        self.assertIs(stats.current(), new)
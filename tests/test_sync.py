@@ -12,9 +12,11 @@
 # limitations under the License.
 
 import os.path
+import asyncio
+import json
 import tempfile
 from unittest import mock, IsolatedAsyncioTestCase, TestCase
-from argparse import Namespace
+from argparse import ArgumentTypeError, Namespace
 from kuha_common.document_store.constants import (
     REC_STATUS_CREATED,
     REC_STATUS_DELETED,
@@ -26,8 +28,33 @@ from kuha_common.cli_setup import (
     MOD_DS_QUERY,
     MOD_LOGGING
 )
+from kuha_common import (
+    conf,
+    cli_setup
+)
+from kuha_common.query import QueryController
+import kuha_client
 from cdcagg_common.records import Study
-from cdcagg_client import sync
+from cdcagg_client import (
+    batch,
+    cache,
+    checkpoint,
+    discovery,
+    httpclient,
+    methods,
+    oai,
+    shard,
+    stats,
+    sync,
+    watch
+)
+from cdcagg_client.fingerprint import (
+    FingerprintStore,
+    record_fingerprint
+)
+from cdcagg_client.index import ProvenanceIndex
+from cdcagg_client.cache import open_file_cache
+from tests.helpers import study_with_provenance
 
 
 def _testdata_path(path=''):
@@ -41,7 +68,43 @@ def settings(paths, no_remove=False, file_cache='', **kw):
                      no_remove=no_remove,
                      file_cache=file_cache,
                      print_configuration=kw.get('print_configuration', False),
-                     fail_on_parse=kw.get('fail_on_parse', False))
+                     fail_on_parse=kw.get('fail_on_parse', False),
+                     preload_index=kw.get('preload_index', False),
+                     fingerprint_cache=kw.get('fingerprint_cache', ''),
+                     concurrency=kw.get('concurrency', 1),
+                     parse_workers=kw.get('parse_workers', 0),
+                     stream_min_size=kw.get('stream_min_size', 0),
+                     archives=kw.get('archives', False),
+                     deduplicate=kw.get('deduplicate', False),
+                     id_page_size=kw.get('id_page_size', 0),
+                     file_cache_backend=kw.get('file_cache_backend', 'pickle'),
+                     discovery_workers=kw.get('discovery_workers', 1),
+                     directory_manifest=kw.get('directory_manifest'),
+                     max_remove_fraction=kw.get('max_remove_fraction'),
+                     http_client=kw.get('http_client', 'simple'),
+                     http_max_clients=kw.get('http_max_clients', 10),
+                     gzip_requests=kw.get('gzip_requests', False),
+                     max_retries=kw.get('max_retries', 0),
+                     adaptive_rate=kw.get('adaptive_rate', False),
+                     shard_index=kw.get('shard_index', 0),
+                     shard_count=kw.get('shard_count', 1),
+                     seen_ids_dir=kw.get('seen_ids_dir'),
+                     remove_unseen=kw.get('remove_unseen', False),
+                     checkpoint_file=kw.get('checkpoint_file'),
+                     checkpoint_interval=kw.get('checkpoint_interval', 60),
+                     resume=kw.get('resume', False),
+                     watch=kw.get('watch', False),
+                     watch_debounce=kw.get('watch_debounce', 2.0),
+                     reconcile_interval=kw.get('reconcile_interval', 3600),
+                     oai_url=kw.get('oai_url'),
+                     oai_metadata_prefix=kw.get('oai_metadata_prefix', 'oai_ddi25'),
+                     oai_set=kw.get('oai_set'),
+                     oai_state_file=kw.get('oai_state_file'),
+                     document_store_url=kw.get('document_store_url', 'http://localhost:6001/v6'),
+                     stats_file=kw.get('stats_file'),
+                     prometheus_file=kw.get('prometheus_file'),
+                     profile=kw.get('profile'),
+                     profile_dir=kw.get('profile_dir', '.'))
 
 
 class _Base(TestCase):
@@ -64,9 +127,9 @@ class TestConfigure(_Base):
 
     def setUp(self):
         super().setUp()
-        self._mock_conf = self._init_patcher(mock.patch.object(sync, 'conf'))
+        self._mock_conf = self._init_patcher(mock.patch('kuha_common.conf'))
         self._mock_setup_common_modules = self._init_patcher(mock.patch.object(
-            sync.cli_setup, 'setup_common_modules'))
+            cli_setup, 'setup_common_modules'))
 
     def test_calls_conf_load(self):
         sync.configure()
@@ -87,6 +150,11 @@ class TestConfigure(_Base):
         self._mock_conf.add.assert_has_calls([
             mock.call('--file-cache', type=str, env_var='FILE_CACHE',
                       help='Path to a cache file. Leave unset to not use file caching.'),
+            mock.call('--file-cache-backend', choices=('pickle', 'sqlite'), default='pickle',
+                      env_var='FILE_CACHE_BACKEND',
+                      help="File cache backend. 'sqlite' stores the cache in an SQLite database that is "
+                      "committed in batches during the run and detects unmodified files by content hash. "
+                      "An existing pickle cache is migrated on first use."),
             mock.call('--no-remove', action='store_true', env_var='NO_REMOVE',
                       help="Don't remove records that were not found in this batch."),
             mock.call('--fail-on-parse', action='store_true', env_var='FAIL_ON_PARSE',
@@ -95,9 +163,142 @@ class TestConfigure(_Base):
                       "tolerant. Note that if a file is not parsed properly it's records "
                       "are not stored correctly and the database content will not reflect "
                       "the batch of files that were being processed."),
-            mock.call('paths', nargs='+',
-                      help="Paths to files to synchronize. If path points to a folder, "
-                      "it and its subfolders will be searched for '.xml'-suffixed files")])
+            mock.call('--preload-index', action='store_true', env_var='PRELOAD_INDEX',
+                      help="Load provenance information of all records from Document Store when the "
+                      "batch starts and use it to find existing records. Reduces the number of queries "
+                      "sent to Document Store on large batches."),
+            mock.call('--fingerprint-cache', type=str, env_var='FINGERPRINT_CACHE',
+                      help="Path to a file used to store content fingerprints of synchronized records. "
+                      "Unchanged records are detected by their fingerprint without comparing them "
+                      "field by field. Combined with --preload-index, unchanged records are not queried "
+                      "from Document Store at all. Leave unset to not use fingerprints."),
+            mock.call('--concurrency', type=int, default=1, env_var='CONCURRENCY',
+                      help="Maximum number of records to upsert concurrently. Records sharing "
+                      "provenance information are never upserted concurrently. Note that values greater "
+                      "than 1 use a file cache format that is not compatible with the default."),
+            mock.call('--parse-workers', type=int, default=0, env_var='PARSE_WORKERS',
+                      help="Number of worker processes used to parse XML files. Use 0 to parse files "
+                      "in the main process. Note that values greater than 0 use a file cache format that "
+                      "is not compatible with the default."),
+            mock.call('--stream-min-size', type=int, default=0, env_var='STREAM_MIN_SIZE',
+                      help="Read OAI-PMH ListRecords files of at least this many bytes one record at a time "
+                      "and upsert each record as soon as it is parsed, instead of building the whole document "
+                      "in memory. Use 0 to read all files whole. Note that values greater than 0 use a file "
+                      "cache format that is not compatible with the default."),
+            mock.call('--archives', action='store_true', env_var='ARCHIVES',
+                      help="Also read '.xml.gz' and '.xml.zst' compressed files and the '.xml' members of "
+                      "'.zip', '.tar', '.tar.gz' and '.tgz' archives without extracting them to disk. "
+                      "'.xml.zst' requires the zstandard package. Changes are detected per archive member. "
+                      "Note that this option uses a file cache format that is not compatible with the default."),
+            mock.call('--deduplicate', action='store_true', env_var='DEDUPLICATE',
+                      help="Upsert records sharing provenance keys with a record upserted earlier in the batch "
+                      "only if they have a newer datestamp. Others are counted as coalesced and not sent to "
+                      "Document Store. Note that this option uses a file cache format that is not compatible "
+                      "with the default."),
+            mock.call('--id-page-size', type=int, default=0, env_var='ID_PAGE_SIZE',
+                      help="Query IDs of existing records in pages of this size and store them compactly "
+                      "to keep memory use low when removing records not found in the batch. Use 0 to query "
+                      "all IDs at once. Note that values greater than 0 use a file cache format that is not "
+                      "compatible with the default."),
+            mock.call('--discovery-workers', type=sync._positive_int, default=1, env_var='DISCOVERY_WORKERS',
+                      help="Number of threads used to list folders and stat files while searching for "
+                      "'.xml'-suffixed files. Note that values greater than 1 use a file cache format that "
+                      "is not compatible with the default."),
+            mock.call('--directory-manifest', type=str, env_var='DIRECTORY_MANIFEST',
+                      help="Path to a file used to store folder listings between runs. Folders whose "
+                      "modification time has not changed are not listed again. With --archives, the members "
+                      "of unchanged archives are not listed again either. Note that this option uses a file cache "
+                      "format that is not compatible with the default."),
+            mock.call('--max-remove-fraction', type=float, env_var='MAX_REMOVE_FRACTION',
+                      help="Abort before removing records that were not found in this batch if they make up "
+                      "more than this fraction of the records in Document Store, for example 0.1. Guards "
+                      "against mass removal when files are missing. Leave unset to not limit removal. Note "
+                      "that this option uses a file cache format that is not compatible with the default."),
+            mock.call('--http-client', choices=('simple', 'curl'), default='simple',
+                      env_var='HTTP_CLIENT',
+                      help="HTTP client used for Document Store requests. 'simple' opens a new connection for "
+                      "each request. 'curl' keeps connections alive and reuses them, and requires pycurl, "
+                      "which is installed with the 'curl' extra."),
+            mock.call('--http-max-clients', type=int, default=10, env_var='HTTP_MAX_CLIENTS',
+                      help="Maximum number of Document Store requests in flight. With --http-client curl this "
+                      "is also the number of connections kept alive."),
+            mock.call('--gzip-requests', action='store_true', env_var='GZIP_REQUESTS',
+                      help="Compress request bodies of at least 1024 bytes with gzip. Document Store must accept "
+                      "compressed requests. Compressed responses are always accepted."),
+            mock.call('--max-retries', type=int, default=0, env_var='MAX_RETRIES',
+                      help="Maximum number of retries of Document Store requests that time out or fail with a "
+                      "server error. Only requests that are safe to repeat are retried: queries, updates and "
+                      "deletes. Retries wait for a random, exponentially growing time. Use 0 to not retry."),
+            mock.call('--adaptive-rate', action='store_true', env_var='ADAPTIVE_RATE',
+                      help="Adjust the number of Document Store requests in flight between 1 and "
+                      "--http-max-clients based on response times and errors. The number grows while "
+                      "Document Store keeps up and is halved when it slows down or fails. Requests over the "
+                      "limit wait, which also slows down parsing and upserts."),
+            mock.call('--shard-index', type=int, default=0, env_var='SHARD_INDEX',
+                      help="Index of the shard to synchronize, from 0 to --shard-count - 1. Files are assigned "
+                      "to shards by a hash of their path, so processes given the same paths and shard count "
+                      "synchronize distinct files."),
+            mock.call('--shard-count', type=int, default=1, env_var='SHARD_COUNT',
+                      help="Number of shards the files are split into. With more than one shard, records not "
+                      "found in the batch are not removed by the shard. Use --seen-ids-dir and a final run "
+                      "with --remove-unseen instead. Note that values greater than 1 use a file cache format "
+                      "that is not compatible with the default. Use a separate file cache for each shard."),
+            mock.call('--seen-ids-dir', type=str, env_var='SEEN_IDS_DIR',
+                      help="Folder shared by all shards for files of record IDs seen by each shard."),
+            mock.call('--remove-unseen', action='store_true', env_var='REMOVE_UNSEEN',
+                      help="Do not synchronize files. Remove records that no shard has seen, according to the "
+                      "seen-ID files of all --shard-count shards in --seen-ids-dir, and delete the files. Run "
+                      "once all shards have finished. Fails if a shard has not written its file."),
+            mock.call('--checkpoint-file', type=str, env_var='CHECKPOINT_FILE',
+                      help="Path to a file to journal files completed during the run to. The file is removed "
+                      "when the run finishes successfully. Use with --resume to continue a run that was "
+                      "interrupted. Note that this option uses a file cache format that is not compatible "
+                      "with the default."),
+            mock.call('--checkpoint-interval', type=float, default=60, env_var='CHECKPOINT_INTERVAL',
+                      help="Seconds between flushes of --checkpoint-file to disk."),
+            mock.call('--resume', action='store_true', env_var='RESUME',
+                      help="Continue an interrupted run from --checkpoint-file. Files completed before the "
+                      "interruption are not read again, and their records are not removed as absent."),
+            mock.call('--watch', action='store_true', env_var='WATCH',
+                      help="Keep running and synchronize XML files as they change in the watched paths. "
+                      "Uses Linux inotify. Changed files are synchronized without removing records. A full "
+                      "synchronization, which also removes absent records, runs at start and every "
+                      "--reconcile-interval seconds. Note that this option uses a file cache format that is "
+                      "not compatible with the default."),
+            mock.call('--watch-debounce', type=float, default=2.0, env_var='WATCH_DEBOUNCE',
+                      help="Seconds without new changes before changed files are synchronized in watch mode."),
+            mock.call('--reconcile-interval', type=float, default=3600, env_var='RECONCILE_INTERVAL',
+                      help="Seconds between full synchronizations in watch mode."),
+            mock.call('--oai-url', type=str, env_var='OAI_URL',
+                      help="Harvest records directly from the OAI-PMH repository at this base URL with "
+                      "ListRecords instead of reading files. Records are not written to disk. Records deleted "
+                      "in the repository are deleted from Document Store. Of records not found in the batch, "
+                      "only those with provenance from this base URL are removed."),
+            mock.call('--oai-metadata-prefix', type=str, default='oai_ddi25', env_var='OAI_METADATA_PREFIX',
+                      help="Metadata prefix to harvest with --oai-url."),
+            mock.call('--oai-set', type=str, env_var='OAI_SET',
+                      help="Set to harvest with --oai-url. Leave unset to harvest all sets."),
+            mock.call('--oai-state-file', type=str, env_var='OAI_STATE_FILE',
+                      help="Path to a file to store the time of the last successful harvest to. Later "
+                      "harvests only ask for records changed since. Records not found in the batch are "
+                      "removed only when all records are harvested."),
+            mock.call('--stats-file', type=str, env_var='STATS_FILE',
+                      help="Path to a file to write a JSON report of the run to. The report contains "
+                      "time spent in each stage, record and file counters and latency histograms of "
+                      "Document Store requests. Leave unset to not write the report."),
+            mock.call('--prometheus-file', type=str, env_var='PROMETHEUS_FILE',
+                      help="Path to a file to write run statistics to in Prometheus text format, "
+                      "for the node_exporter textfile collector. The file name should end with '.prom'. "
+                      "Leave unset to not write the file."),
+            mock.call('--profile', choices=('cpu', 'memory', 'async'), env_var='PROFILE',
+                      help="Profile the run. 'cpu' writes a cProfile file, 'memory' writes tracemalloc snapshots "
+                      "at stage boundaries and 'async' logs callbacks blocking the event loop and timings of "
+                      "Document Store queries and updates. Worker processes are not profiled."),
+            mock.call('--profile-dir', type=str, default='.', env_var='PROFILE_DIR',
+                      help="Folder to write profiles to with --profile."),
+            mock.call('paths', nargs='*',
+                      help="Paths to files to synchronize. If path points to a folder, it and its "
+                      "subfolders will be searched for '.xml'-suffixed files. Required unless --oai-url is given.")])
 
     def test_calls_cli_setup_setup_common_modules(self):
         sync.configure()
@@ -108,6 +309,12 @@ class TestConfigure(_Base):
         rval = sync.configure()
         self.assertEqual(rval, self._mock_setup_common_modules.return_value)
 
+    def test_discovery_workers_must_be_positive(self):
+        self.assertEqual(sync._positive_int('4'), 4)
+        for value in ('0', '-1'):
+            with self.subTest(value=value), self.assertRaises(ArgumentTypeError):
+                sync._positive_int(value)
+
 
 class TestStudyMethods(IsolatedAsyncioTestCase):
 
@@ -117,7 +324,7 @@ class TestStudyMethods(IsolatedAsyncioTestCase):
         self.studymeths = sync.StudyMethods(mock.Mock())
         super().setUp()
 
-    @mock.patch.object(sync.kuha_client, 'send_update_record_request')
+    @mock.patch.object(kuha_client, 'send_update_record_request')
     async def test_update_record_with_matching_records(self, mock_send):
         """If records match and old record is not deleted, do nothing."""
         old = Study()
@@ -128,7 +335,7 @@ class TestStudyMethods(IsolatedAsyncioTestCase):
         mock_send.assert_not_called()
         self.assertEqual(result, False)
 
-    @mock.patch.object(sync.kuha_client, 'send_update_record_request')
+    @mock.patch.object(kuha_client, 'send_update_record_request')
     async def test_update_record_with_differing_records(self, mock_send):
         """If records don't match, send the new one to docstore."""
         old = Study()
@@ -147,7 +354,7 @@ class TestStudyMethods(IsolatedAsyncioTestCase):
         mock_send.assert_called_once_with(new.collection, new_rec_dict, 'some-id')
         self.assertEqual(result, True)
 
-    @mock.patch.object(sync.kuha_client, 'send_update_record_request')
+    @mock.patch.object(kuha_client, 'send_update_record_request')
     async def test_update_record_matching_records_old_record_is_deleted(self, mock_send):
         """If records match, but older is deleted, change the metadata accordingly and send to docstore"""
         old = Study()
@@ -167,7 +374,7 @@ class TestStudyMethods(IsolatedAsyncioTestCase):
         mock_send.assert_called_once_with(new.collection, exp_dict, 'some-id')
         self.assertEqual(result, True)
 
-    @mock.patch.object(sync.kuha_client, 'send_update_record_request')
+    @mock.patch.object(kuha_client, 'send_update_record_request')
     async def test_update_record_keeps_old_aggregator_identifier(self, mock_send):
         """Updating an old record must not change the old record's _aggregator_identifier.
 
@@ -193,6 +400,287 @@ class TestStudyMethods(IsolatedAsyncioTestCase):
         self.assertEqual(carg_dict, exp_rec_dict)
         mock_send.assert_called_once_with(new.collection, exp_rec_dict, old.get_id())
 
+    @staticmethod
+    def _elem_match(base_url, identifier):
+        return {Study._provenance: {
+            MDB_ELEM_MATCH: {
+                Study._provenance.attr_base_url: base_url,
+                Study._provenance.attr_identifier: identifier}}}
+
+    @mock.patch.object(QueryController, 'query_multiple')
+    @mock.patch.object(QueryController, 'query_single')
+    async def test_query_record_with_single_provenance_item_calls_query_single(self, mock_query_single,
+                                                                               mock_query_multiple):
+        record = study_with_provenance(('http://some.url', 'id_1'))
+        result = await self.studymeths.query_record(record)
+        mock_query_single.assert_called_once_with(Study, _filter=self._elem_match('http://some.url', 'id_1'))
+        mock_query_multiple.assert_not_called()
+        self.assertEqual(result, mock_query_single.return_value)
+
+    @mock.patch.object(QueryController, 'query_multiple')
+    @mock.patch.object(QueryController, 'query_single')
+    async def test_query_record_without_provenance_returns_None(self, mock_query_single, mock_query_multiple):
+        result = await self.studymeths.query_record(Study())
+        mock_query_single.assert_not_called()
+        mock_query_multiple.assert_not_called()
+        self.assertIsNone(result)
+
+    @mock.patch.object(QueryController, 'query_multiple')
+    @mock.patch.object(QueryController, 'query_single')
+    async def test_query_record_with_multiple_provenance_items_queries_once(self, mock_query_single,
+                                                                            mock_query_multiple):
+        record = study_with_provenance(('http://some.url', 'id_1'),
+                                       ('http://another.url', 'id_2'),
+                                       ('http://third.url', 'id_3'))
+        result = await self.studymeths.query_record(record)
+        mock_query_single.assert_not_called()
+        in_ = QueryController.fk_constants.in_
+        mock_query_multiple.assert_called_once_with(Study, mock.ANY, _filter={Study._provenance: {
+            MDB_ELEM_MATCH: {
+                Study._provenance.attr_base_url: {in_: ['http://some.url', 'http://another.url',
+                                                        'http://third.url']},
+                Study._provenance.attr_identifier: {in_: ['id_1', 'id_2', 'id_3']}}}})
+        self.assertIsNone(result)
+
+    @mock.patch.object(QueryController, 'query_multiple')
+    async def test_query_record_prefers_match_for_earliest_provenance_item(self, mock_query_multiple):
+        """Choose the same record that sequential per-provenance queries would choose."""
+        results = [study_with_provenance(('http://some.url', 'id_2'), _id='other_combination'),
+                   study_with_provenance(('http://third.url', 'id_3'), _id='later'),
+                   study_with_provenance(('http://another.url', 'id_2'), _id='earlier')]
+
+        async def _query_multiple(record_class, on_record, _filter):
+            for result in results:
+                await on_record(result)
+        mock_query_multiple.side_effect = _query_multiple
+        record = study_with_provenance(('http://some.url', 'id_1'),
+                                       ('http://another.url', 'id_2'),
+                                       ('http://third.url', 'id_3'))
+        result = await self.studymeths.query_record(record)
+        self.assertEqual(result.get_id(), 'earlier')
+
+
+class TestStudyMethodsUpsertRecord(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.studymeths = sync.StudyMethods(mock.Mock())
+        super().setUp()
+
+    @mock.patch.object(kuha_client, 'send_create_record_request',
+                       return_value={'affected_resource': 'new_id'})
+    async def test_creates_and_returns_id_from_response(self, mock_send_create):
+        record = Study()
+        record.add_study_number('study_1')
+        result = await self.studymeths.upsert_record(record, None)
+        mock_send_create.assert_called_once_with(
+            'studies', record.export_dict(include_metadata=False, include_id=False))
+        self.assertEqual(result, ('new_id', batch.UPSERT_CREATED))
+
+    @mock.patch.object(kuha_client, 'send_update_record_request')
+    async def test_updates_and_returns_old_id(self, mock_send_update):
+        old = Study()
+        old.add_study_number('study_1')
+        old._id.set_value('old_id')
+        new = Study()
+        new.add_study_number('study_2')
+        result = await self.studymeths.upsert_record(new, old)
+        mock_send_update.assert_called_once()
+        self.assertEqual(result, ('old_id', batch.UPSERT_UPDATED))
+
+    @mock.patch.object(kuha_client, 'send_update_record_request')
+    async def test_returns_unchanged_for_matching_records(self, mock_send_update):
+        old = Study()
+        old._id.set_value('old_id')
+        result = await self.studymeths.upsert_record(Study(old.export_dict()), old)
+        mock_send_update.assert_not_called()
+        self.assertEqual(result, ('old_id', batch.UPSERT_UNCHANGED))
+
+    @mock.patch.object(kuha_client, 'send_update_record_request')
+    @mock.patch.object(kuha_client, 'send_create_record_request',
+                       return_value={'affected_resource': 'new_id'})
+    async def test_collects_stats(self, mock_send_create, mock_send_update):
+        run_stats = stats.reset()
+        old = Study()
+        old._id.set_value('old_id')
+        new = Study()
+        new.add_study_number('study_1')
+        await self.studymeths.upsert_record(new, None)
+        await self.studymeths.upsert_record(new, old)
+        await self.studymeths.upsert_record(Study(old.export_dict()), old)
+        self.assertEqual(run_stats.counters, {'created': 1, 'updated': 1, 'unchanged': 1})
+        self.assertEqual(run_stats.requests['create'].count, 1)
+        self.assertEqual(run_stats.requests['update'].count, 1)
+        self.assertEqual(run_stats.stages['compare'][1], 2)
+
+
+class TestStudyMethodsQueryDistinctIdSet(IsolatedAsyncioTestCase):
+
+    @mock.patch.object(QueryController, 'query_multiple')
+    async def test_queries_ids_in_pages(self, mock_query_multiple):
+        pages = [['%024x' % (number,) for number in range(2)], ['%024x' % (number,) for number in range(1, 3)]]
+
+        async def _query_multiple(record_class, on_record, **kwargs):
+            for _id in pages.pop(0):
+                await on_record(Study({'_id': _id}))
+        mock_query_multiple.side_effect = _query_multiple
+        ids = await sync.StudyMethods(mock.Mock()).query_distinct_id_set(2)
+        self.assertEqual(list(ids), ['%024x' % (number,) for number in range(3)])
+        self.assertEqual(mock_query_multiple.call_count, 2)
+        mock_query_multiple.assert_called_with(
+            Study, mock.ANY, sort_by=Study._id, limit=3, fields=[Study._id],
+            _filter={Study._metadata.attr_status: {MDB_NOT_EQUAL: REC_STATUS_DELETED},
+                     Study._id: {QueryController.fk_constants.from_: '%024x' % (1,)}})
+
+    @mock.patch.object(QueryController, 'query_distinct')
+    async def test_queries_ids_of_base_url(self, mock_query_distinct):
+        mock_query_distinct.return_value = {'_id': ['some_id']}
+        ids = await sync.StudyMethods(mock.Mock()).query_distinct_ids(base_url='http://some.url')
+        self.assertEqual(ids, {'some_id'})
+        mock_query_distinct.assert_called_once_with(
+            Study, fieldname=Study._id,
+            _filter={Study._metadata.attr_status: {MDB_NOT_EQUAL: REC_STATUS_DELETED},
+                     Study._provenance.attr_base_url: 'http://some.url'})
+
+
+class TestIndexedStudyMethods(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.studymeths = sync.IndexedStudyMethods(mock.Mock())
+        super().setUp()
+
+    @staticmethod
+    def _study(base_url, identifier, _id=None):
+        return study_with_provenance((base_url, identifier), _id=_id, study_number='study_1')
+
+    @mock.patch.object(QueryController, 'query_single')
+    @mock.patch.object(ProvenanceIndex, 'load')
+    async def test_query_record_loads_index_once(self, mock_load, mock_query_single):
+        self.studymeths._index.loaded = False
+
+        async def _load(fingerprints=None):
+            self.studymeths._index.loaded = True
+        mock_load.side_effect = _load
+        await self.studymeths.query_record(self._study('http://some.url', 'id_1'))
+        await self.studymeths.query_record(self._study('http://some.url', 'id_2'))
+        mock_load.assert_called_once_with(fingerprints=None)
+        mock_query_single.assert_not_called()
+
+    @mock.patch.object(QueryController, 'query_single')
+    async def test_query_record_queries_by_id_on_index_hit(self, mock_query_single):
+        self.studymeths._index.loaded = True
+        self.studymeths._index.add(('http://some.url', 'id_1'), 'some_id')
+        result = await self.studymeths.query_record(self._study('http://some.url', 'id_1'))
+        mock_query_single.assert_called_once_with(Study, _filter={Study._id: 'some_id'})
+        self.assertEqual(result, mock_query_single.return_value)
+
+    @mock.patch.object(QueryController, 'query_single')
+    async def test_query_record_returns_None_on_index_miss(self, mock_query_single):
+        self.studymeths._index.loaded = True
+        result = await self.studymeths.query_record(self._study('http://some.url', 'id_1'))
+        mock_query_single.assert_not_called()
+        self.assertIsNone(result)
+
+    @mock.patch.object(QueryController, 'query_single')
+    @mock.patch.object(kuha_client.CollectionMethods, 'create_record')
+    async def test_create_record_updates_index(self, mock_create_record, mock_query_single):
+        self.studymeths._index.loaded = True
+        study = self._study('http://some.url', 'id_1')
+        await self.studymeths.create_record(study)
+        mock_create_record.assert_called_once_with(study)
+        await self.studymeths.query_record(self._study('http://some.url', 'id_1'))
+        mock_query_single.assert_called_once_with(Study, _filter={
+            Study._provenance: {
+                MDB_ELEM_MATCH: {
+                    Study._provenance.attr_base_url: 'http://some.url',
+                    Study._provenance.attr_identifier: 'id_1'}}})
+
+    @mock.patch.object(kuha_client, 'send_update_record_request')
+    async def test_update_record_updates_index(self, mock_send):
+        self.studymeths._index.loaded = True
+        old = self._study('http://some.url', 'id_1', _id='some_id')
+        new = self._study('http://another.url', 'id_2')
+        new.add_abstract('some abstract', 'en')
+        await self.studymeths.update_record(new, old)
+        mock_send.assert_called_once()
+        entry = self.studymeths._index.lookup(new)
+        self.assertEqual(entry.record_id, 'some_id')
+        self.assertEqual(entry.fingerprint, record_fingerprint(new))
+
+
+class TestStudyMethodsWithFingerprints(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.fingerprints = FingerprintStore('/nonexistent/fingerprints')
+        study_methods = type('StudyMethods', (sync.IndexedStudyMethods,), {'fingerprints': self.fingerprints})
+        self.studymeths = study_methods(mock.Mock())
+        self.studymeths._index.loaded = True
+        super().setUp()
+
+    @staticmethod
+    def _study(abstract='some abstract', _id=None):
+        study = study_with_provenance(('http://some.url', 'id_1'), _id=_id, study_number='study_1')
+        study.add_abstract(abstract, 'en')
+        return study
+
+    @mock.patch.object(kuha_client, 'send_update_record_request')
+    @mock.patch.object(QueryController, 'query_single')
+    async def test_unchanged_record_is_not_queried_nor_updated(self, mock_query_single, mock_send):
+        new = self._study()
+        self.studymeths._index.add(('http://some.url', 'id_1'), 'some_id', record_fingerprint(new))
+        old = await self.studymeths.query_record(new)
+        result = await self.studymeths.update_record(new, old)
+        mock_query_single.assert_not_called()
+        mock_send.assert_not_called()
+        self.assertEqual(old.get_id(), 'some_id')
+        self.assertFalse(result)
+
+    @mock.patch.object(QueryController, 'query_single')
+    async def test_deleted_record_is_queried_although_fingerprint_matches(self, mock_query_single):
+        new = self._study()
+        self.fingerprints.set('some_id', record_fingerprint(new))
+        self.studymeths._index.add(('http://some.url', 'id_1'), 'some_id', record_fingerprint(new))
+        self.studymeths.forget_record('some_id')
+        self.assertNotIn('some_id', self.fingerprints)
+        old = await self.studymeths.query_record(new)
+        mock_query_single.assert_called_once_with(Study, _filter={Study._id: 'some_id'})
+        self.assertEqual(old, mock_query_single.return_value)
+
+    @mock.patch.object(kuha_client, 'send_update_record_request')
+    @mock.patch.object(QueryController, 'query_single')
+    async def test_changed_record_is_queried_and_updated(self, mock_query_single, mock_send):
+        mock_query_single.return_value = self._study(_id='some_id')
+        new = self._study(abstract='another abstract')
+        self.studymeths._index.add(('http://some.url', 'id_1'), 'some_id',
+                                   record_fingerprint(mock_query_single.return_value))
+        old = await self.studymeths.query_record(new)
+        result = await self.studymeths.update_record(new, old)
+        mock_query_single.assert_called_once_with(Study, _filter={Study._id: 'some_id'})
+        mock_send.assert_called_once()
+        self.assertTrue(result)
+        self.assertEqual(self.fingerprints.get('some_id'), record_fingerprint(new))
+
+    @mock.patch.object(kuha_client, 'send_update_record_request')
+    @mock.patch.object(methods, 'export_content_dict', wraps=methods.export_content_dict)
+    async def test_update_record_does_not_export_old_record_if_fingerprint_matches(self, mock_export,
+                                                                                   mock_send):
+        new = self._study()
+        old = self._study(_id='some_id')
+        self.fingerprints.set('some_id', record_fingerprint(new))
+        result = await self.studymeths.update_record(new, old)
+        mock_export.assert_called_once_with(new)
+        mock_send.assert_not_called()
+        self.assertFalse(result)
+
+    @mock.patch.object(kuha_client, 'send_update_record_request')
+    async def test_update_record_with_matching_fingerprint_updates_deleted_record(self, mock_send):
+        new = self._study()
+        old = self._study(_id='some_id')
+        old.set_status(REC_STATUS_DELETED)
+        self.fingerprints.set('some_id', record_fingerprint(new))
+        result = await self.studymeths.update_record(new, old)
+        mock_send.assert_called_once()
+        self.assertTrue(result)
+
 
 class TestCli(TestCase):
 
@@ -208,7 +696,7 @@ class TestCli(TestCase):
         sync.cli()
         mock_run.assert_called_once_with(settings(['/some/path']))
 
-    @mock.patch.object(sync.conf, 'print_conf')
+    @mock.patch.object(conf, 'print_conf')
     @mock.patch.object(sync, 'run')
     @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], print_configuration=True))
     def test_prints_configuration(self, mock_configure, mock_run, mock_print_conf):
@@ -224,7 +712,7 @@ class TestCli(TestCase):
             sync.cli()
         mock_logger.exception.assert_called_once_with('Unhandled exception')
 
-    @mock.patch.object(sync.kuha_client, 'BatchProcessor')
+    @mock.patch.object(kuha_client, 'BatchProcessor')
     @mock.patch.object(sync, 'configure', return_value=settings(['/some/path']))
     def test_calls_BatchProcessor_with_default_args(self, mock_configure, mock_BatchProcessor):
         sync.cli()
@@ -237,8 +725,8 @@ class TestCli(TestCase):
                                                     fail_on_parse=False)
         mock_BatchProcessor.return_value.upsert_run.assert_called_once_with(['/some/path'], remove_absent=True)
 
-    @mock.patch.object(sync.kuha_client, 'FileLoggingCache')
-    @mock.patch.object(sync.kuha_client, 'BatchProcessor')
+    @mock.patch.object(kuha_client, 'FileLoggingCache')
+    @mock.patch.object(kuha_client, 'BatchProcessor')
     @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'],
                                                                 no_remove=True,
                                                                 file_cache='/path/to/filecache',
@@ -257,18 +745,261 @@ class TestCli(TestCase):
                                                     fail_on_parse=True)
         mock_BatchProcessor.return_value.upsert_run.assert_called_once_with(['/some/path'], remove_absent=False)
 
+    @mock.patch.object(kuha_client, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], preload_index=True))
+    def test_calls_BatchProcessor_with_IndexedStudyMethods(self, mock_configure, mock_BatchProcessor):
+        sync.cli()
+        cargs, _ = mock_BatchProcessor.call_args
+        self.assertEqual(cargs, ([sync.IndexedStudyMethods],))
+
+    @mock.patch.object(kuha_client, 'BatchProcessor')
+    def test_writes_stats_files(self, mock_BatchProcessor):
+        with tempfile.TemporaryDirectory() as dirname:
+            stats_file = os.path.join(dirname, 'stats.json')
+            prometheus_file = os.path.join(dirname, 'stats.prom')
+            with mock.patch.object(sync, 'configure', return_value=settings(
+                    ['/some/path'], stats_file=stats_file, prometheus_file=prometheus_file)):
+                sync.cli()
+            with open(stats_file) as file_obj:
+                report = json.load(file_obj)
+            with open(prometheus_file) as file_obj:
+                prometheus_text = file_obj.read()
+        self.assertTrue(report['success'])
+        self.assertIn('upsert_run', report['stages'])
+        self.assertIn('cdcagg_client_last_run_success 1', prometheus_text)
+
+    @mock.patch.object(kuha_client, 'BatchProcessor')
+    def test_writes_stats_file_on_failure(self, mock_BatchProcessor):
+        mock_BatchProcessor.return_value.upsert_run.side_effect = ValueError()
+        with tempfile.TemporaryDirectory() as dirname:
+            stats_file = os.path.join(dirname, 'stats.json')
+            with mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], stats_file=stats_file)):
+                with self.assertRaises(ValueError):
+                    sync.cli()
+            with open(stats_file) as file_obj:
+                self.assertFalse(json.load(file_obj)['success'])
+
+    @mock.patch.object(kuha_client, 'BatchProcessor')
+    def test_writes_cpu_profile(self, mock_BatchProcessor):
+        with tempfile.TemporaryDirectory() as dirname:
+            profile_dir = os.path.join(dirname, 'profiles')
+            with mock.patch.object(sync, 'configure', return_value=settings(
+                    ['/some/path'], profile='cpu', profile_dir=profile_dir)):
+                sync.cli()
+            self.assertEqual(os.listdir(profile_dir), ['cpu.pstats'])
+        mock_BatchProcessor.return_value.upsert_run.assert_called_once_with(['/some/path'], remove_absent=True)
+
+    @mock.patch.object(kuha_client, 'BatchProcessor')
+    def test_passes_fingerprint_store_to_StudyMethods(self, mock_BatchProcessor):
+        with tempfile.TemporaryDirectory() as dirname:
+            with mock.patch.object(sync, 'configure', return_value=settings(
+                    ['/some/path'], fingerprint_cache=os.path.join(dirname, 'fingerprints'))):
+                sync.cli()
+        ([methods],), _ = mock_BatchProcessor.call_args
+        self.assertTrue(issubclass(methods, sync.StudyMethods))
+        self.assertIsInstance(methods.fingerprints, FingerprintStore)
+
+    @mock.patch.object(kuha_client, 'BatchProcessor')
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], concurrency=8))
+    def test_passes_concurrency_to_BatchProcessor(self, mock_configure, mock_BatchProcessor,
+                                                  mock_kuha_BatchProcessor):
+        sync.cli()
+        mock_kuha_BatchProcessor.assert_not_called()
+        self.assertEqual(mock_BatchProcessor.call_args[1]['concurrency'], 8)
+
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], stream_min_size=1024))
+    def test_passes_stream_min_size_to_BatchProcessor(self, mock_configure, mock_BatchProcessor):
+        sync.cli()
+        self.assertEqual(mock_BatchProcessor.call_args[1]['stream_min_size'], 1024)
+
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], archives=True))
+    def test_passes_archives_to_BatchProcessor(self, mock_configure, mock_BatchProcessor):
+        sync.cli()
+        self.assertTrue(mock_BatchProcessor.call_args[1]['archives'])
+
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], deduplicate=True))
+    def test_passes_deduplicate_to_BatchProcessor(self, mock_configure, mock_BatchProcessor):
+        sync.cli()
+        self.assertTrue(mock_BatchProcessor.call_args[1]['deduplicate'])
+
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], parse_workers=2))
+    def test_passes_parse_workers_to_BatchProcessor(self, mock_configure, mock_BatchProcessor):
+        sync.cli()
+        _, ckwargs = mock_BatchProcessor.call_args
+        self.assertEqual(ckwargs['parse_workers'], 2)
+        self.assertEqual(ckwargs['concurrency'], 1)
+
+    @mock.patch.object(discovery, 'open_directory_manifest')
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], discovery_workers=8,
+                                                                directory_manifest='/path/to/manifest'))
+    def test_passes_discovery_options_to_BatchProcessor(self, mock_configure, mock_BatchProcessor,
+                                                        mock_open_directory_manifest):
+        sync.cli()
+        mock_open_directory_manifest.assert_called_once_with('/path/to/manifest')
+        _, ckwargs = mock_BatchProcessor.call_args
+        self.assertEqual(ckwargs['discovery_workers'], 8)
+        self.assertEqual(ckwargs['manifest'], mock_open_directory_manifest.return_value.__enter__.return_value)
+
+    @mock.patch.object(cache, 'open_file_cache')
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], file_cache='/path/to/filecache',
+                                                                file_cache_backend='sqlite'))
+    def test_passes_sqlite_file_cache_to_BatchProcessor(self, mock_configure, mock_BatchProcessor,
+                                                        mock_open_file_cache):
+        sync.cli()
+        mock_open_file_cache.assert_called_once_with('/path/to/filecache', backend='sqlite')
+        _, ckwargs = mock_BatchProcessor.call_args
+        self.assertEqual(ckwargs['cache'], mock_open_file_cache.return_value.__enter__.return_value)
+
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], shard_index=1, shard_count=4,
+                                                                seen_ids_dir='/path/to/seen'))
+    def test_passes_shard_to_BatchProcessor(self, mock_configure, mock_BatchProcessor):
+        sync.cli()
+        _, ckwargs = mock_BatchProcessor.call_args
+        self.assertEqual((ckwargs['shard_index'], ckwargs['shard_count'], ckwargs['seen_ids_path']),
+                         (1, 4, '/path/to/seen/seen-1-of-4.ids'))
+        mock_BatchProcessor.return_value.upsert_run.assert_called_once_with(['/some/path'], remove_absent=True)
+
+    @mock.patch.object(httpclient, 'configure')
+    @mock.patch.object(kuha_client, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], http_client='curl',
+                                                                http_max_clients=4, gzip_requests=True,
+                                                                max_retries=5, adaptive_rate=True))
+    def test_configures_http_client(self, mock_configure, mock_BatchProcessor, mock_httpclient_configure):
+        sync.cli()
+        mock_httpclient_configure.assert_called_once_with('curl', max_clients=4, gzip_requests=True,
+                                                          max_retries=5, adaptive=True)
+        mock_BatchProcessor.return_value.upsert_run.assert_called_once_with(['/some/path'], remove_absent=True)
+
+    @mock.patch.object(checkpoint, 'Checkpoint')
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], checkpoint_file='/some/checkpoint',
+                                                                resume=True, checkpoint_interval=10))
+    def test_passes_checkpoint_to_BatchProcessor(self, mock_configure, mock_BatchProcessor, mock_Checkpoint):
+        sync.cli()
+        mock_Checkpoint.assert_called_once_with('/some/checkpoint', resume=True, interval=10)
+        _, ckwargs = mock_BatchProcessor.call_args
+        self.assertEqual(ckwargs['checkpoint'], mock_Checkpoint.return_value)
+
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], resume=True))
+    def test_resume_requires_checkpoint_file(self, mock_configure, mock_BatchProcessor):
+        with self.assertRaises(ValueError):
+            sync.cli()
+        mock_BatchProcessor.assert_not_called()
+
+    @mock.patch.object(shard, 'remove_seen_ids')
+    @mock.patch.object(shard, 'read_seen_ids')
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], shard_count=4, remove_unseen=True,
+                                                                seen_ids_dir='/path/to/seen'))
+    def test_remove_unseen_removes_records_not_seen_by_shards(self, mock_configure, mock_BatchProcessor,
+                                                              mock_read_seen_ids, mock_remove_seen_ids):
+        sync.cli()
+        proc = mock_BatchProcessor.return_value
+        proc.upsert_run.assert_not_called()
+        mock_read_seen_ids.assert_called_once_with('/path/to/seen', 4)
+        proc.remove_unseen_run.assert_called_once_with(mock_read_seen_ids.return_value)
+        mock_remove_seen_ids.assert_called_once_with('/path/to/seen', 4)
+
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], remove_unseen=True))
+    def test_remove_unseen_requires_seen_ids_dir(self, mock_configure, mock_BatchProcessor):
+        with self.assertRaises(ValueError):
+            sync.cli()
+        mock_BatchProcessor.return_value.remove_unseen_run.assert_not_called()
+
+    @mock.patch.object(oai, 'ListRecordsHarvester')
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings([], oai_url='http://some.url/oai',
+                                                                oai_set='some_set'))
+    def test_oai_url_harvests_records(self, mock_configure, mock_BatchProcessor, mock_ListRecordsHarvester):
+        sync.cli()
+        mock_ListRecordsHarvester.assert_called_once_with('http://some.url/oai', 'oai_ddi25', set_spec='some_set',
+                                                          from_date=None)
+        proc = mock_BatchProcessor.return_value
+        proc.upsert_run.assert_not_called()
+        proc.upsert_harvest_run.assert_called_once_with(mock_ListRecordsHarvester.return_value, remove_absent=True)
+
+    @mock.patch.object(oai, 'HarvestState')
+    @mock.patch.object(oai, 'ListRecordsHarvester')
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings([], oai_url='http://some.url/oai',
+                                                                oai_state_file='/path/to/state'))
+    def test_oai_state_file_harvests_incrementally(self, mock_configure, mock_BatchProcessor,
+                                                   mock_ListRecordsHarvester, mock_HarvestState):
+        state = mock_HarvestState.return_value
+        state.get.return_value = '2026-01-01T00:00:00Z'
+        mock_ListRecordsHarvester.return_value.response_date = '2026-02-01T00:00:00Z'
+        sync.cli()
+        mock_HarvestState.assert_called_once_with('/path/to/state')
+        _, ckwargs = mock_ListRecordsHarvester.call_args
+        self.assertEqual(ckwargs['from_date'], '2026-01-01T00:00:00Z')
+        mock_BatchProcessor.return_value.upsert_harvest_run.assert_called_once_with(
+            mock_ListRecordsHarvester.return_value, remove_absent=False)
+        state.set.assert_called_once_with(mock_HarvestState.key.return_value, '2026-02-01T00:00:00Z')
+        state.save.assert_called_once_with()
+
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], oai_url='http://some.url/oai'))
+    def test_oai_url_rejects_paths(self, mock_configure, mock_BatchProcessor):
+        with self.assertRaises(ValueError):
+            sync.cli()
+        mock_BatchProcessor.assert_not_called()
+
+    @mock.patch.object(asyncio, 'run')
+    @mock.patch.object(watch, 'watch', new_callable=mock.Mock)
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], watch=True, watch_debounce=5,
+                                                                reconcile_interval=600))
+    def test_watch_runs_watch_loop(self, mock_configure, mock_BatchProcessor, mock_watch, mock_run):
+        sync.cli()
+        proc = mock_BatchProcessor.return_value
+        proc.upsert_run.assert_not_called()
+        mock_run.assert_called_once_with(mock_watch.return_value)
+        args, kwargs = mock_watch.call_args
+        self.assertEqual(args, (proc, ['/some/path']))
+        self.assertEqual((kwargs['remove_absent'], kwargs['debounce'], kwargs['reconcile_interval']),
+                         (True, 5, 600))
+        self.assertEqual(kwargs['suffixes'], ('.xml',))
+
+    @mock.patch.object(stats, 'write_json')
+    def test_after_watch_sync_saves_stores_and_starts_new_stats(self, mock_write_json):
+        file_cache = mock.Mock(spec=['commit'])
+        manifest = mock.Mock(spec=['save'])
+        old_stats = stats.reset()
+        sync._after_watch_sync(settings(['/some/path'], stats_file='/path/to/stats'), [file_cache, manifest], True)
+        file_cache.commit.assert_called_once_with()
+        manifest.save.assert_called_once_with()
+        mock_write_json.assert_called_once_with(old_stats, '/path/to/stats')
+        self.assertTrue(old_stats.success)
+        self.assertIsNot(stats.current(), old_stats)
+
+    @mock.patch.object(batch, 'BatchProcessor')
+    @mock.patch.object(sync, 'configure', return_value=settings(['/some/path'], max_remove_fraction=0.1))
+    def test_passes_max_remove_fraction_to_BatchProcessor(self, mock_configure, mock_BatchProcessor):
+        sync.cli()
+        self.assertEqual(mock_BatchProcessor.call_args[1]['max_remove_fraction'], 0.1)
+
 
 class TestIntegration(_Base):
     """Test from cli to http requests"""
 
     def setUp(self):
         super().setUp()
-        self._mock_query_single = self._init_patcher(mock.patch.object(sync.QueryController, 'query_single'))
-        self._mock_query_distinct = self._init_patcher(mock.patch.object(sync.QueryController, 'query_distinct'))
+        self._mock_query_single = self._init_patcher(mock.patch.object(QueryController, 'query_single'))
+        self._mock_query_distinct = self._init_patcher(mock.patch.object(QueryController, 'query_distinct'))
         self._mock_send_delete_record_request = self._init_patcher(
-            mock.patch.object(sync.kuha_client, 'send_delete_record_request'))
+            mock.patch.object(kuha_client, 'send_delete_record_request'))
         self._mock_send_update_record_request = self._init_patcher(
-            mock.patch.object(sync.kuha_client, 'send_update_record_request'))
+            mock.patch.object(kuha_client, 'send_update_record_request'))
         self._mock_send_create_record_request = self._init_patcher(mock.patch('kuha_client.send_create_record_request'))
         self._mock_configure = self._init_patcher(mock.patch.object(sync, 'configure'))
 
@@ -381,6 +1112,38 @@ class TestIntegration(_Base):
             self._mock_send_update_record_request.assert_not_called()
             self._mock_query_single.assert_not_called()
 
+    def _assert_keeps_file_cache_written_by_kuha_client(self, **kwargs):
+        """A file cache written by kuha_client is not migrated. It is
+        kept aside and all files are read again."""
+        self._mock_query_single.return_value = Study({'study_number': 'study_1',
+                                                      '_id': 'some_id'})
+        path = _testdata_path('minimal_ddi122.xml')
+        with tempfile.TemporaryDirectory() as dirname:
+            cache_path = os.path.join(dirname, 'filelog')
+            with kuha_client.open_file_logging_cache(cache_path) as kuha_cache:
+                proc = kuha_client.BatchProcessor([sync.StudyMethods],
+                                                  parsers=[sync.DDI122NesstarRecordParser],
+                                                  cache=kuha_cache)
+                proc.upsert_run([path], remove_absent=False)
+            with open(cache_path, 'rb') as file_obj:
+                kuha_content = file_obj.read()
+            self._mock_query_single.reset_mock()
+            self._mock_configure.return_value = settings([path], file_cache=cache_path, **kwargs)
+            # Call
+            sync.cli()
+            # Assert
+            self._mock_query_single.assert_called_once()
+            with open(cache_path + '.unsupported', 'rb') as file_obj:
+                self.assertEqual(file_obj.read(), kuha_content)
+            with open_file_cache(cache_path, backend=kwargs.get('file_cache_backend', 'pickle')) as file_cache:
+                self.assertEqual(file_cache.get(path).record_ids, ('some_id',))
+
+    def test_keeps_file_cache_written_by_kuha_client(self):
+        self._assert_keeps_file_cache_written_by_kuha_client(concurrency=2)
+
+    def test_keeps_file_cache_written_by_kuha_client_for_sqlite(self):
+        self._assert_keeps_file_cache_written_by_kuha_client(file_cache_backend='sqlite')
+
     def test_minimal_ddi32_creates(self):
         self._mock_query_single.return_value = None
         self._mock_configure.return_value = settings([_testdata_path('minimal_ddi32.xml')])
@@ -437,14 +1200,16 @@ class TestIntegration(_Base):
         self.assertEqual(rec_dict['identifiers'][0]['identifier'], 'study_1')
         self.assertEqual(rec_dict['study_titles'][0]['study_title'], 'some study')
 
-    @mock.patch.object(sync.kuha_client._logger, 'exception')
-    def test_batch_with_unsupported_ddi_logs_exception(self, mock_exception):
+    @mock.patch.object(batch, '_logger')
+    def test_batch_with_unsupported_ddi_logs_warning(self, mock_logger):
         """Test against #11 at Bitbucket"""
         self._mock_query_single.return_value = None
         inv_path = _testdata_path('unsupported_ddi33.xml')
         self._mock_configure.return_value = settings([_testdata_path('minimal_ddi122.xml'), inv_path])
         sync.cli()
-        mock_exception.assert_called_once_with("Unable to parse file '%s'. Is the file valid?", inv_path)
+        mock_logger.exception.assert_not_called()
+        mock_logger.warning.assert_called_once_with(
+            "Skipping file '%s'. It does not contain a study in a supported format.", inv_path)
 
     def test_aggregator_identifier_is_sha256(self):
         """Test against #20 at Bitbucket"""
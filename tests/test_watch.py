@@ -0,0 +1,138 @@
+# Copyright CESSDA ERIC 2026
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import signal
+import asyncio
+import tempfile
+from unittest import mock, IsolatedAsyncioTestCase
+from cdcagg_client import watch
+
+
+class _TmpdirTestCase(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        super().setUp()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        super().tearDown()
+
+    def _write(self, *parts):
+        path = os.path.join(self._tmpdir.name, *parts)
+        with open(path, 'w') as file_obj:
+            file_obj.write('<xml/>')
+        return path
+
+
+class TestInotifyWatcher(_TmpdirTestCase):
+
+    async def asyncSetUp(self):
+        self.watcher = watch.InotifyWatcher([self._tmpdir.name], debounce=0.05)
+        self.watcher.start()
+        await super().asyncSetUp()
+
+    async def asyncTearDown(self):
+        self.watcher.close()
+        await super().asyncTearDown()
+
+    async def test_queues_written_xml_files(self):
+        path = self._write('file.xml')
+        self._write('file.txt')
+        self.assertEqual(await self.watcher.wait_changes(timeout=1), [path])
+
+    async def test_queues_files_with_given_suffixes(self):
+        self.watcher.suffixes = ('.xml', '.zip')
+        paths = [self._write('file.xml'), self._write('file.zip')]
+        self._write('file.txt')
+        self.assertEqual(await self.watcher.wait_changes(timeout=1), paths)
+
+    async def test_watches_new_subfolders(self):
+        os.mkdir(os.path.join(self._tmpdir.name, 'sub'))
+        await asyncio.sleep(0.01)
+        path = self._write('sub', 'file.xml')
+        self.assertEqual(await self.watcher.wait_changes(timeout=1), [path])
+
+    async def test_returns_nothing_after_timeout(self):
+        self.assertEqual(await self.watcher.wait_changes(timeout=0.01), [])
+
+    async def test_waits_until_changes_settle(self):
+        path = self._write('file.xml')
+        await asyncio.sleep(0.03)
+        self._write('file.xml')
+        await asyncio.sleep(0.03)
+        # Latest change is 30 ms old.
+        self.assertEqual(await self.watcher.wait_changes(timeout=0), [])
+        self.assertEqual(await self.watcher.wait_changes(timeout=1), [path])
+        self.assertEqual(len(self.watcher), 0)
+
+    async def test_hands_out_files_after_max_wait(self):
+        self.watcher.max_wait = 0.1
+        first = self._write('first.xml')
+        for index in range(10):
+            await asyncio.sleep(0.02)
+            self._write('file_%s.xml' % (index,))
+        changed = await self.watcher.wait_changes(timeout=0)
+        self.assertIn(first, changed)
+        self.assertLess(len(changed), 11)
+
+
+class TestInotifyWatcherWithFilePath(_TmpdirTestCase):
+
+    async def test_watches_named_file_only(self):
+        path = self._write('file.xml')
+        watcher = watch.InotifyWatcher([path], debounce=0.01)
+        watcher.start()
+        try:
+            self._write('other.xml')
+            self._write('file.xml')
+            self.assertEqual(await watcher.wait_changes(timeout=1), [path])
+        finally:
+            watcher.close()
+
+
+class TestWatch(_TmpdirTestCase):
+
+    async def test_reconciles_then_syncs_changed_files(self):
+        proc = mock.Mock(upsert_paths=mock.AsyncMock())
+        results = []
+
+        def _after_sync(success):
+            results.append(success)
+            if len(results) == 1:
+                self._write('file.xml')
+            else:
+                os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.wait_for(watch.watch(proc, [self._tmpdir.name], debounce=0.01,
+                                           after_sync=_after_sync), 5)
+        self.assertEqual(proc.upsert_paths.call_args_list, [
+            mock.call([self._tmpdir.name], remove_absent=True),
+            mock.call([os.path.join(self._tmpdir.name, 'file.xml')])])
+        self.assertEqual(results, [True, True])
+
+    async def test_keeps_watching_after_failure(self):
+        proc = mock.Mock(upsert_paths=mock.AsyncMock(side_effect=[ValueError(), None, None, None]))
+        results = []
+
+        def _after_sync(success):
+            results.append(success)
+            if len(results) == 2:
+                os.kill(os.getpid(), signal.SIGTERM)
+        with mock.patch.object(watch._logger, 'exception') as mock_exception:
+            await asyncio.wait_for(watch.watch(proc, [self._tmpdir.name], remove_absent=False,
+                                               reconcile_interval=0.01, after_sync=_after_sync), 5)
+        mock_exception.assert_called_once_with('%s failed', 'Reconciliation')
+        self.assertEqual(results[:2], [False, True])
+        self.assertEqual(proc.upsert_paths.call_args_list[:2],
+                         [mock.call([self._tmpdir.name], remove_absent=False)] * 2)